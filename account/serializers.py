@@ -1,6 +1,7 @@
 from django import forms
 
-from utils.api import serializers, UsernameSerializer
+from problem.models import ProblemRuleType, UserProblemStatus
+from utils.api import serializers, ValuesSerializer
 
 from .models import AdminType, ProblemPermission, User, UserProfile
 
@@ -73,7 +74,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = UserProfile
-        fields = "__all__"
+        exclude = ("acm_problems_status", "oi_problems_status")
 
     def __init__(self, *args, **kwargs):
         self.show_real_name = kwargs.pop("show_real_name", False)
@@ -82,6 +83,21 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_real_name(self, obj):
         return obj.real_name if self.show_real_name else None
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # 由 UserProblemStatus 生成和原先 acm_problems_status, oi_problems_status 格式相同的数据
+        problems_status = {rule_type: {"problems": {}, "contest_problems": {}} for rule_type in ProblemRuleType.choices()}
+        rows = UserProblemStatus.objects.filter(user_id=instance.user_id) \
+            .values_list("problem_id", "contest_id", "status", "score", "problem___id", "problem__rule_type")
+        for problem_id, contest_id, status, score, display_id, rule_type in rows:
+            item = {"status": status, "_id": display_id}
+            if rule_type == ProblemRuleType.OI:
+                item["score"] = score
+            problems_status[rule_type]["contest_problems" if contest_id else "problems"][str(problem_id)] = item
+        data["acm_problems_status"] = problems_status[ProblemRuleType.ACM]
+        data["oi_problems_status"] = problems_status[ProblemRuleType.OI]
+        return data
+
 
 class EditUserSerializer(serializers.Serializer):
     id = serializers.IntegerField()
@@ -135,9 +151,12 @@ class FileUploadForm(forms.Form):
     file = forms.FileField()
 
 
-class RankInfoSerializer(serializers.ModelSerializer):
-    user = UsernameSerializer()
+class RankInfoSerializer(ValuesSerializer):
+    # 排名接口不再输出 acm_problems_status 和 oi_problems_status: 做题状态已经由 UserProblemStatus 保存,
+    # UserProfile 中的这两列不再更新; 前端的排名页面不使用这两个字段, 个人主页通过 UserProfileAPI 获取
+    fields = ("id", "user_id", "user__username", "real_name", "avatar", "blog", "mood", "github", "school", "major",
+              "language", "accepted_number", "total_score", "submission_number")
 
-    class Meta:
-        model = UserProfile
-        fields = "__all__"
+    def to_representation(self, row):
+        row["user"] = {"id": row.pop("user_id"), "username": row.pop("user__username"), "real_name": None}
+        return row
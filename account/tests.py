@@ -475,6 +475,13 @@ class UserRankAPITest(APITestCase):
         self.assertEqual(data[0]["user"]["username"], "test2")
         self.assertEqual(data[1]["user"]["username"], "test1")
 
+    def test_no_problems_status(self):
+        resp = self.client.get(self.url, data={"rule": ContestRuleType.ACM})
+        self.assertSuccess(resp)
+        item = resp.data["data"]["results"][0]
+        self.assertNotIn("acm_problems_status", item)
+        self.assertNotIn("oi_problems_status", item)
+
     def test_admin_role_filted(self):
         self.create_admin("admin", "admin123")
         admin = User.objects.get(username="admin")
@@ -485,11 +492,11 @@ class UserRankAPITest(APITestCase):
         profile1.save()
         resp = self.client.get(self.url, data={"rule": ContestRuleType.ACM})
         self.assertSuccess(resp)
-        self.assertEqual(len(resp.data["data"]), 2)
+        self.assertEqual(len(resp.data["data"]["results"]), 2)
 
         resp = self.client.get(self.url, data={"rule": ContestRuleType.OI})
         self.assertSuccess(resp)
-        self.assertEqual(len(resp.data["data"]), 2)
+        self.assertEqual(len(resp.data["data"]["results"]), 2)
 
 
 class ProfileProblemDisplayIDRefreshAPITest(APITestCase):
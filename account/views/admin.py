@@ -8,7 +8,7 @@ from django.http import HttpResponse
 from django.contrib.auth.hashers import make_password
 
 from submission.models import Submission
-from utils.api import APIView, validate_serializer
+from utils.api import APIView, CountStrategy, invalidate_counts, validate_serializer
 from utils.shortcuts import rand_str
 
 from ..decorators import super_admin_required
@@ -36,6 +36,7 @@ class UserAdminAPI(APIView):
             with transaction.atomic():
                 ret = User.objects.bulk_create(user_list)
                 UserProfile.objects.bulk_create([UserProfile(user=ret[i], real_name=data[i][3]) for i in range(len(ret))])
+            invalidate_counts(User, UserProfile)
             return self.success()
         except IntegrityError as e:
             # Extract detail from exception message
@@ -119,7 +120,7 @@ class UserAdminAPI(APIView):
             user = user.filter(Q(username__icontains=keyword) |
                                Q(userprofile__real_name__icontains=keyword) |
                                Q(email__icontains=keyword))
-        return self.success(self.paginate_data(request, user, UserAdminSerializer))
+        return self.success(self.paginate_data(request, user, UserAdminSerializer, count_strategy=CountStrategy.AUTO))
 
     @super_admin_required
     def delete(self, request):
@@ -130,6 +131,7 @@ class UserAdminAPI(APIView):
         if str(request.user.id) in ids:
             return self.error("Current user can not be deleted")
         User.objects.filter(id__in=ids).delete()
+        invalidate_counts(User, UserProfile)
         return self.success()
 
 
@@ -194,7 +196,8 @@ class GenerateUserAPI(APIView):
                     worksheet.write_string(i, 1, item.raw_password)
                     i += 1
                 workbook.close()
-                return self.success({"file_id": file_id})
+            invalidate_counts(User, UserProfile)
+            return self.success({"file_id": file_id})
         except IntegrityError as e:
             # Extract detail from exception message
             #    duplicate key value violates unique constraint "user_username_key"
@@ -4,8 +4,11 @@ from unittest import mock
 from django.conf import settings
 from django.utils import timezone
 
+from judge import heartbeat
 from options.options import SysOptions
 from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey
 from .models import JudgeServer
 
 
@@ -82,6 +85,7 @@ class WebsiteConfigAPITest(APITestCase):
 
 class JudgeServerHeartbeatTest(APITestCase):
     def setUp(self):
+        cache.delete(CacheKey.judge_server_hosts)
         self.url = self.reverse("judge_server_heartbeat_api")
         self.data = {"hostname": "testhostname", "judger_version": "1.0.4", "cpu_core": 4,
                      "cpu": 90.5, "memory": 80.3, "action": "heartbeat", "service_url": "http://127.0.0.1"}
@@ -90,18 +94,23 @@ class JudgeServerHeartbeatTest(APITestCase):
         SysOptions.judge_server_token = self.token
         self.headers = {"HTTP_X_JUDGE_SERVER_TOKEN": self.hashed_token, settings.IP_HEADER: "1.2.3.4"}
 
-    def test_new_heartbeat(self):
+    @mock.patch("judge.tasks.flush_judge_server_heartbeat.send")
+    def test_new_heartbeat(self, flush_task):
         resp = self.client.post(self.url, data=self.data, **self.headers)
         self.assertSuccess(resp)
+        self.assertIn(self.data["hostname"], heartbeat.alive_hostnames())
+        heartbeat.flush()
         server = JudgeServer.objects.first()
-        self.assertEqual(server.ip, "127.0.0.1")
+        self.assertEqual(server.ip, "1.2.3.4")
 
     def test_update_heartbeat(self):
         self.test_new_heartbeat()
         data = self.data
         data["judger_version"] = "2.0.0"
-        resp = self.client.post(self.url, data=data, **self.headers)
+        with mock.patch("judge.tasks.flush_judge_server_heartbeat.send"):
+            resp = self.client.post(self.url, data=data, **self.headers)
         self.assertSuccess(resp)
+        heartbeat.flush()
         self.assertEqual(JudgeServer.objects.get(hostname=self.data["hostname"]).judger_version, data["judger_version"])
 
 
@@ -16,6 +16,9 @@ from requests.exceptions import RequestException
 from account.decorators import super_admin_required
 from account.models import User
 from contest.models import Contest
+from judge import heartbeat, verdict_cache, waiting_queue
+from judge.allocator import get_slot_allocator, sync_judge_server, remove_judge_server
+from judge.connection import connection_reuse_rate
 from judge.dispatcher import process_pending_task
 from options.options import SysOptions
 from problem.models import Problem
@@ -109,14 +112,34 @@ class JudgeServerAPI(APIView):
     @super_admin_required
     def get(self, request):
         servers = JudgeServer.objects.all().order_by("-last_heartbeat")
+        serializer = JudgeServerSerializer(servers, many=True)
+        data = serializer.data
+        # 正在运行的任务数以槽位分配器中的为准, 心跳时间和状态以 redis 中的为准
+        task_numbers = get_slot_allocator().task_numbers()
+        reuse_rate = connection_reuse_rate()
+        last_heartbeats = heartbeat.last_heartbeats()
+        alive = set(heartbeat.alive_hostnames())
+        last_heartbeat_field = serializer.child.fields["last_heartbeat"]
+        for item in data:
+            hostname = item["hostname"]
+            item["task_number"] = task_numbers.get(hostname, item["task_number"])
+            item["connection_reuse_rate"] = reuse_rate.get(hostname)
+            if hostname in last_heartbeats:
+                item["last_heartbeat"] = last_heartbeat_field.to_representation(last_heartbeats[hostname])
+                item["status"] = "normal" if hostname in alive else "abnormal"
         return self.success({"token": SysOptions.judge_server_token,
-                             "servers": JudgeServerSerializer(servers, many=True).data})
+                             "servers": data,
+                             "waiting_queue": waiting_queue.depth(),
+                             "verdict_cache": verdict_cache.stats(),
+                             "test_case_affinity": get_slot_allocator().affinity_stats()})
 
     @super_admin_required
     def delete(self, request):
         hostname = request.GET.get("hostname")
         if hostname:
             JudgeServer.objects.filter(hostname=hostname).delete()
+            heartbeat.remove(hostname)
+            remove_judge_server(hostname)
         return self.success()
 
     @validate_serializer(EditJudgeServerSerializer)
@@ -124,6 +147,9 @@ class JudgeServerAPI(APIView):
     def put(self, request):
         is_disabled = request.data.get("is_disabled", False)
         JudgeServer.objects.filter(id=request.data["id"]).update(is_disabled=is_disabled)
+        for server in JudgeServer.objects.filter(id=request.data["id"]):
+            heartbeat.set_disabled(server.hostname, is_disabled)
+            sync_judge_server(server)
         if not is_disabled:
             process_pending_task()
         return self.success()
@@ -137,43 +163,22 @@ class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
         if hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest() != client_token:
             return self.error("Invalid token")
 
-        try:
-            # 使用get_or_create避免重复记录，优先使用最新的记录
-            servers = JudgeServer.objects.filter(hostname=data["hostname"]).order_by("-create_time")
-            if servers.exists():
-                # 如果存在多个相同hostname的记录，删除旧的，只保留最新的
-                if servers.count() > 1:
-                    servers[1:].delete()
-                server = servers.first()
-            else:
-                raise JudgeServer.DoesNotExist
-            
-            server.judger_version = data["judger_version"]
-            server.cpu_core = data["cpu_core"]
-            server.memory_usage = data["memory"]
-            server.cpu_usage = data["cpu"]
-            # 强制使用8080端口，因为判题服务器实际监听8080端口
-            service_url = data.get("service_url", "")
-            if service_url and ":12358" in service_url:
-                service_url = service_url.replace(":12358", ":8080")
-            server.service_url = service_url
-            server.ip = request.ip
-            server.last_heartbeat = timezone.now()
-            server.save(update_fields=["judger_version", "cpu_core", "memory_usage", "service_url", "ip", "last_heartbeat"])
-        except JudgeServer.DoesNotExist:
-            # 强制使用8080端口
-            service_url = data.get("service_url", "")
-            if service_url and ":12358" in service_url:
-                service_url = service_url.replace(":12358", ":8080")
-            JudgeServer.objects.create(hostname=data["hostname"],
-                                       judger_version=data["judger_version"],
-                                       cpu_core=data["cpu_core"],
-                                       memory_usage=data["memory"],
-                                       cpu_usage=data["cpu"],
-                                       ip=request.META["REMOTE_ADDR"],
-                                       service_url=service_url,
-                                       last_heartbeat=timezone.now(),
-                                       )
+        # 强制使用8080端口，因为判题服务器实际监听8080端口
+        service_url = data.get("service_url", "")
+        if service_url and ":12358" in service_url:
+            service_url = service_url.replace(":12358", ":8080")
+        # 心跳只写入 redis, 由 flush_judge_server_heartbeat 定期写回数据库
+        server = heartbeat.record(data["hostname"],
+                                  judger_version=data["judger_version"],
+                                  cpu_core=data["cpu_core"],
+                                  memory_usage=data["memory"],
+                                  cpu_usage=data["cpu"],
+                                  service_url=service_url,
+                                  ip=request.ip)
+        if settings.JUDGE_SLOT_ALLOCATOR == "db":
+            # 通过数据库分配槽位时, 仍然需要实时更新数据库中的心跳时间
+            heartbeat.flush()
+        sync_judge_server(server)
         # 新server上线 处理队列中的，防止没有新的提交而导致一直waiting
         process_pending_task()
 
@@ -245,7 +250,7 @@ class DashboardInfoAPI(APIView):
         today_submission_count = Submission.objects.filter(
             create_time__gte=datetime(today.year, today.month, today.day, 0, 0, tzinfo=pytz.UTC)).count()
         recent_contest_count = Contest.objects.exclude(end_time__lt=timezone.now()).count()
-        judge_server_count = len(list(filter(lambda x: x.status == "normal", JudgeServer.objects.all())))
+        judge_server_count = len(heartbeat.alive_hostnames())
         return self.success({
             "user_count": User.objects.count(),
             "recent_contest_count": recent_contest_count,
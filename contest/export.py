@@ -0,0 +1,163 @@
+import csv
+import logging
+
+import xlsxwriter
+
+from problem.models import Problem
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType
+from utils.shortcuts import rand_str
+from . import scoreboard
+from .models import Contest
+
+logger = logging.getLogger(__name__)
+
+# 导出任务的状态和导出的文件保留的时间 (秒)
+EXPORT_TTL = 3600
+# 每次从排名中读取的行数, 写完一批更新一次进度
+CHUNK_SIZE = 500
+
+
+class ExportFormat:
+    XLSX = "xlsx"
+    CSV = "csv"
+
+
+class ExportStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+
+def _key(token):
+    return f"{CacheKey.contest_rank_export}:{token}"
+
+
+def file_path(token, file_format):
+    return f"/tmp/contest-rank-{token}.{file_format}"
+
+
+class CSVWriter:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class XLSXWriter:
+    def __init__(self, path):
+        # constant_memory 模式下每写完一行就刷到磁盘, 内存占用和行数无关
+        self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        self.worksheet = self.workbook.add_worksheet()
+        self.row_number = 0
+
+    def write_row(self, row):
+        for column, value in enumerate(row):
+            self.worksheet.write_string(self.row_number, column, value)
+        self.row_number += 1
+
+    def close(self):
+        self.workbook.close()
+
+
+WRITERS = {ExportFormat.XLSX: XLSXWriter, ExportFormat.CSV: CSVWriter}
+
+
+def _header(contest, titles):
+    if contest.rule_type == ContestRuleType.OI:
+        return ["User ID", "Username", "Real Name", "Total Score"] + titles
+    return ["User ID", "Username", "Real Name", "AC", "Total Submission", "Total Time"] + titles
+
+
+def _row(contest, item, column_map):
+    cells = [""] * len(column_map)
+    for problem_id, info in item["submission_info"].items():
+        column = column_map.get(int(problem_id))
+        # 已经被隐藏或者删除的题目不导出
+        if column is None:
+            continue
+        cells[column] = str(info) if contest.rule_type == ContestRuleType.OI else str(info["is_ac"])
+    user = item["user"]
+    if contest.rule_type == ContestRuleType.OI:
+        head = [str(item["total_score"])]
+    else:
+        head = [str(item["accepted_number"]), str(item["submission_number"]), str(item["total_time"])]
+    return [str(user["id"]), user["username"], user["real_name"] or ""] + head + cells
+
+
+def write_rank(contest, board, path, file_format, on_progress=None):
+    """
+    按照排名顺序分批读取并写入文件, 题目所在的列预先计算好, 只有排名顺序 (用户 id) 需要全部读入内存
+    """
+    problems = Problem.objects.filter(contest=contest, visible=True).order_by("_id").values_list("id", "title")
+    column_map = {}
+    titles = []
+    for index, (problem_id, title) in enumerate(problems):
+        column_map[problem_id] = index
+        titles.append(title)
+
+    if isinstance(board, scoreboard.Scoreboard):
+        # 导出期间排名仍然在变化, 按照开始时的排名顺序分批读取
+        board = board.snapshot()
+    total = board.count()
+    writer = WRITERS[file_format](path)
+    try:
+        writer.write_row(_header(contest, titles))
+        for start in range(0, total, CHUNK_SIZE):
+            for item in board[start:start + CHUNK_SIZE]:
+                writer.write_row(_row(contest, item, column_map))
+            if on_progress:
+                on_progress(min(start + CHUNK_SIZE, total), total)
+    finally:
+        writer.close()
+
+
+def start(contest, user, is_contest_admin, file_format):
+    token = rand_str()
+    pipe = cache.pipeline()
+    pipe.hset(_key(token), mapping={"status": ExportStatus.PENDING, "progress": 0, "total": 0,
+                                    "contest_id": contest.id, "user_id": user.id,
+                                    "is_contest_admin": int(is_contest_admin), "format": file_format})
+    pipe.expire(_key(token), EXPORT_TTL)
+    pipe.execute()
+    from contest.tasks import export_contest_rank
+    export_contest_rank.send(token)
+    return token
+
+
+def get_status(token):
+    data = cache.hgetall(_key(token))
+    if not data:
+        return None
+    data = {k.decode("utf-8"): v.decode("utf-8") for k, v in data.items()}
+    for field in ("progress", "total", "contest_id", "user_id", "is_contest_admin"):
+        data[field] = int(data[field])
+    return data
+
+
+def run(token):
+    status = get_status(token)
+    if not status:
+        return
+    key = _key(token)
+    try:
+        contest = Contest.objects.get(id=status["contest_id"])
+        board = scoreboard.get_scoreboard(contest, is_contest_admin=bool(status["is_contest_admin"]), stream=True)
+        if board is None:
+            raise RuntimeError("Scoreboard is being rebuilt")
+        cache.hset(key, "status", ExportStatus.RUNNING)
+        write_rank(contest, board, file_path(token, status["format"]), status["format"],
+                   on_progress=lambda progress, total: cache.hset(key, mapping={"progress": progress, "total": total}))
+    except Exception as e:
+        logger.exception(f"Failed to export rank of contest {status['contest_id']}")
+        cache.hset(key, mapping={"status": ExportStatus.FAILED, "error": str(e)})
+        return
+    cache.hset(key, "status", ExportStatus.FINISHED)
+    from utils.tasks import delete_files
+    delete_files.send_with_options(args=(file_path(token, status["format"]),), delay=EXPORT_TTL * 1000)
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contest', '0010_auto_20190326_0201'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='rank_freeze_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='contest',
+            name='rank_unfrozen',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -24,6 +24,10 @@ class Contest(models.Model):
     # 是否可见 false的话相当于删除
     visible = models.BooleanField(default=True)
     allowed_ip_ranges = JSONField(default=list)
+    # 封榜时间, 之后普通用户只能看到封榜时的排名; 为空且 real_time_rank 为 false 时从比赛开始封榜
+    rank_freeze_time = models.DateTimeField(null=True)
+    # 管理员解除封榜后公布最终排名
+    rank_unfrozen = models.BooleanField(default=False)
 
     @property
     def status(self):
@@ -43,6 +47,19 @@ class Contest(models.Model):
             return ContestType.PASSWORD_PROTECTED_CONTEST
         return ContestType.PUBLIC_CONTEST
 
+    @property
+    def rank_freeze_start(self):
+        if self.rank_freeze_time:
+            return self.rank_freeze_time
+        # 没有实时排名的 ACM 比赛从开始就封榜; OI 比赛期间本来就不能查看排名, 结束后直接显示完整的排名
+        if not self.real_time_rank and self.rule_type == ContestRuleType.ACM:
+            return self.start_time
+        return None
+
+    def is_rank_frozen(self, at=None):
+        freeze_start = self.rank_freeze_start
+        return not self.rank_unfrozen and freeze_start is not None and (at or now()) >= freeze_start
+
     # 是否有权查看problem 的一些统计信息 诸如submission_number, accepted_number 等
     def problem_details_permission(self, user):
         return self.rule_type == ContestRuleType.ACM or \
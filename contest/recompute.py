@@ -0,0 +1,219 @@
+import time
+from array import array
+
+from django.db import connection, transaction
+
+from account.models import AdminType, User
+from problem.models import Problem
+from submission.models import JudgeStatus, Submission
+from utils.constants import ContestRuleType
+from . import scoreboard
+from .models import ACMContestRank, OIContestRank
+
+# 判题还没有结束的提交不参与计算, 判题结束后由 JudgeDispatcher 增量更新
+UNJUDGED_RESULTS = (JudgeStatus.PENDING, JudgeStatus.JUDGING)
+# 每次从数据库读取的提交数量
+CHUNK_SIZE = 2000
+# 比赛排名的 advisory lock 的第一个 key, 第二个 key 是比赛 id
+RANK_LOCK_NAMESPACE = 1001
+
+
+def lock_contest_ranks(contest_id, shared=False):
+    """
+    在事务中持有比赛排名的 advisory lock, 事务结束时释放.
+    JudgeDispatcher 增量更新排名时持有共享锁, 重新计算时持有排他锁: 重新计算读取提交之前,
+    正在进行的增量更新都已经提交; 之后的增量更新等待重新计算完成, 在新的排名上累加
+    """
+    func = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {func}(%s, %s)", [RANK_LOCK_NAMESPACE, contest_id])
+
+
+def _load_submissions(contest):
+    """
+    按照提交时间顺序读取比赛中需要计入排名的提交, 比赛管理员和比赛时间之外的提交和 JudgeDispatcher 一样不计入排名
+    """
+    excluded_users = set(User.objects.filter(admin_type=AdminType.SUPER_ADMIN).values_list("id", flat=True))
+    excluded_users.add(contest.created_by_id)
+    submissions = Submission.objects.filter(contest=contest,
+                                            create_time__gte=contest.start_time,
+                                            create_time__lte=contest.end_time) \
+        .exclude(result__in=UNJUDGED_RESULTS) \
+        .order_by("create_time") \
+        .values_list("user_id", "problem_id", "result", "create_time", "statistic_info")
+    for item in submissions.iterator(chunk_size=CHUNK_SIZE):
+        if item[0] not in excluded_users:
+            yield item
+
+
+def _problem_index(contest):
+    problem_ids = Problem.objects.filter(contest=contest).order_by("id").values_list("id", flat=True)
+    return {problem_id: index for index, problem_id in enumerate(problem_ids)}
+
+
+class _Accumulator:
+    """
+    每个 (用户, 题目) 对应定长数组中 user_index * problem_count + problem_index 的位置,
+    新用户出现时所有数组一次扩展 problem_count 个元素
+    """
+    def __init__(self, problem_index):
+        self.problem_index = problem_index
+        self.problem_count = len(problem_index)
+        self.user_index = {}
+        self.tried = bytearray()
+        self.count = 0
+
+    def _extend(self):
+        self.tried.extend(bytes(self.problem_count))
+
+    def cell(self, user_id, problem_id):
+        self.count += 1
+        u = self.user_index.get(user_id)
+        if u is None:
+            u = self.user_index[user_id] = len(self.user_index)
+            self._extend()
+        cell = u * self.problem_count + self.problem_index[problem_id]
+        self.tried[cell] = 1
+        return u, cell
+
+    def rows(self):
+        """
+        按照用户遍历, 返回 (user_id, 用户的下标, [(problem_id, 位置)]), 只包含提交过的题目
+        """
+        problems = sorted(self.problem_index.items(), key=lambda item: item[1])
+        for user_id, u in self.user_index.items():
+            base = u * self.problem_count
+            yield user_id, u, [(problem_id, base + p) for problem_id, p in problems if self.tried[base + p]]
+
+
+class ACMAccumulator(_Accumulator):
+    def __init__(self, problem_index, start_time):
+        super().__init__(problem_index)
+        self.start_time = start_time
+        self.is_ac = bytearray()
+        self.error_number = array("l")
+        self.ac_time = array("d")
+        self.submission_number = array("l")
+        self.accepted_number = array("l")
+        self.total_time = array("d")
+        # 每个题目第一个通过的位置
+        self.first_ac = set()
+        self.first_ac_problems = set()
+        self._zero_l = array("l", [0]) * self.problem_count
+        self._zero_d = array("d", [0]) * self.problem_count
+
+    def _extend(self):
+        super()._extend()
+        self.is_ac.extend(bytes(self.problem_count))
+        self.error_number.extend(self._zero_l)
+        self.ac_time.extend(self._zero_d)
+        self.submission_number.append(0)
+        self.accepted_number.append(0)
+        self.total_time.append(0)
+
+    def add(self, user_id, problem_id, result, create_time, statistic_info):
+        u, cell = self.cell(user_id, problem_id)
+        # 已经通过的题目之后的提交不计入排名
+        if self.is_ac[cell]:
+            return
+        self.submission_number[u] += 1
+        if result == JudgeStatus.ACCEPTED:
+            self.is_ac[cell] = 1
+            self.ac_time[cell] = (create_time - self.start_time).total_seconds()
+            self.accepted_number[u] += 1
+            self.total_time[u] += self.ac_time[cell] + self.error_number[cell] * 20 * 60
+            if problem_id not in self.first_ac_problems:
+                self.first_ac_problems.add(problem_id)
+                self.first_ac.add(cell)
+        elif result != JudgeStatus.COMPILE_ERROR:
+            self.error_number[cell] += 1
+
+    def ranks(self):
+        for user_id, u, cells in self.rows():
+            submission_info = {str(problem_id): {"is_ac": bool(self.is_ac[cell]), "ac_time": self.ac_time[cell],
+                                                 "error_number": self.error_number[cell],
+                                                 "is_first_ac": cell in self.first_ac}
+                               for problem_id, cell in cells}
+            yield user_id, {"submission_number": self.submission_number[u],
+                            "accepted_number": self.accepted_number[u],
+                            "total_time": int(self.total_time[u]),
+                            "submission_info": submission_info}
+
+
+class OIAccumulator(_Accumulator):
+    def __init__(self, problem_index):
+        super().__init__(problem_index)
+        self.score = array("l")
+        self._zero_l = array("l", [0]) * self.problem_count
+
+    def _extend(self):
+        super()._extend()
+        self.score.extend(self._zero_l)
+
+    def add(self, user_id, problem_id, result, create_time, statistic_info):
+        # 和 JudgeDispatcher 一致, 使用最后一次提交的分数
+        u, cell = self.cell(user_id, problem_id)
+        self.score[cell] = statistic_info.get("score", 0)
+
+    def ranks(self):
+        for user_id, u, cells in self.rows():
+            submission_info = {str(problem_id): self.score[cell] for problem_id, cell in cells}
+            yield user_id, {"total_score": sum(submission_info.values()), "submission_info": submission_info}
+
+
+def _write_ranks(contest, model, ranks, fields):
+    # 在 recompute 持有排他锁的事务中调用, 同时锁住比赛中所有的排名
+    existing = {rank.user_id: rank for rank in model.objects.select_for_update().filter(contest=contest)}
+    to_create, to_update = [], []
+    for user_id, values in ranks.items():
+        rank = existing.pop(user_id, None)
+        if rank is None:
+            to_create.append(model(user_id=user_id, contest=contest, **values))
+            continue
+        if model is ACMContestRank:
+            # 保留管理员在 ACMContestHelper 中标记的 checked
+            for problem_id, info in values["submission_info"].items():
+                old = rank.submission_info.get(problem_id)
+                if old and "checked" in old:
+                    info["checked"] = old["checked"]
+        for field, value in values.items():
+            setattr(rank, field, value)
+        to_update.append(rank)
+    # 没有计入排名的提交的用户, 排名清零
+    for rank in existing.values():
+        for field in fields:
+            setattr(rank, field, {} if field == "submission_info" else 0)
+        to_update.append(rank)
+    model.objects.bulk_update(to_update, fields, batch_size=1000)
+    model.objects.bulk_create(to_create, batch_size=1000)
+    return len(to_create) + len(to_update)
+
+
+def recompute(contest):
+    """
+    用一次按照提交时间排序的查询读取比赛的提交, 重新计算所有的排名并批量写回, 用于重判或者修改罚时规则之后修复排名
+    """
+    start = time.time()
+    problem_index = _problem_index(contest)
+    if contest.rule_type == ContestRuleType.ACM:
+        accumulator = ACMAccumulator(problem_index, contest.start_time)
+        model, fields = ACMContestRank, ["submission_number", "accepted_number", "total_time", "submission_info"]
+    else:
+        accumulator = OIAccumulator(problem_index)
+        model, fields = OIContestRank, ["total_score", "submission_info"]
+
+    with transaction.atomic():
+        # 先持有锁再读取提交, 否则读取之后、写回之前完成的增量更新会被覆盖
+        lock_contest_ranks(contest.id)
+        for item in _load_submissions(contest):
+            if item[1] in problem_index:
+                accumulator.add(*item)
+        rank_number = _write_ranks(contest, model, dict(accumulator.ranks()), fields)
+    scoreboard.rebuild(contest)
+    if contest.rank_unfrozen:
+        # 已经解除封榜的比赛用户看到的是最终排名, 需要按照新的排名重新生成
+        scoreboard.publish_final(contest)
+
+    elapsed = time.time() - start
+    return {"submissions": accumulator.count, "ranks": rank_number, "time": round(elapsed, 3),
+            "time_per_100k_submissions": round(elapsed / accumulator.count * 100_000, 3) if accumulator.count else 0}
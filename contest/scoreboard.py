@@ -0,0 +1,278 @@
+import json
+
+from account.models import AdminType
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType
+from .models import ACMContestRank, OIContestRank
+from .serializers import ACMContestRankSerializer, OIContestRankSerializer
+
+# ACM 排名的复合分数 = 通过数 * ACM_ACCEPTED_WEIGHT - 罚时, 罚时(秒)不会超过该值
+ACM_ACCEPTED_WEIGHT = 10 ** 10
+# 从数据库重建排名时的锁, 防止多个请求同时重建
+REBUILD_LOCK_TIMEOUT = 30
+# 序列化后的排名 (封榜快照, 最终排名, 实时排名的缓存) 保存在 hash 的该字段中
+ROWS_FIELD = "rows"
+# 实时排名的缓存对应的排名版本, 每次更新排名时版本加一
+VERSION_FIELD = "version"
+
+
+def _rank_key(contest_id):
+    return f"{CacheKey.contest_scoreboard}:{contest_id}"
+
+
+def _rows_key(contest_id):
+    return f"{CacheKey.contest_scoreboard_rows}:{contest_id}"
+
+
+def _ready_key(contest_id):
+    return f"{CacheKey.contest_scoreboard_ready}:{contest_id}"
+
+
+def _frozen_key(contest_id):
+    return f"{CacheKey.contest_scoreboard_frozen}:{contest_id}"
+
+
+def _final_key(contest_id):
+    return f"{CacheKey.contest_scoreboard_final}:{contest_id}"
+
+
+def _version_key(contest_id):
+    return f"{CacheKey.contest_scoreboard_version}:{contest_id}"
+
+
+def _page_key(contest_id, is_contest_admin):
+    view = "admin" if is_contest_admin else "public"
+    return f"{CacheKey.contest_scoreboard_page}:{contest_id}:{view}"
+
+
+def _score(contest, rank):
+    if contest.rule_type == ContestRuleType.ACM:
+        return rank.accepted_number * ACM_ACCEPTED_WEIGHT - rank.total_time
+    return rank.total_score
+
+
+def _serializer(contest):
+    if contest.rule_type == ContestRuleType.ACM:
+        return ACMContestRankSerializer
+    return OIContestRankSerializer
+
+
+def get_rank_queryset(contest):
+    if contest.rule_type == ContestRuleType.ACM:
+        return ACMContestRank.objects.filter(contest=contest,
+                                             user__admin_type=AdminType.REGULAR_USER,
+                                             user__is_disabled=False). \
+            select_related("user", "user__userprofile").order_by("-accepted_number", "total_time")
+    else:
+        return OIContestRank.objects.filter(contest=contest,
+                                            user__admin_type=AdminType.REGULAR_USER,
+                                            user__is_disabled=False). \
+            select_related("user", "user__userprofile").order_by("-total_score")
+
+
+def _add_row(pipe, contest, rank, row):
+    pipe.zadd(_rank_key(contest.id), {rank.user_id: _score(contest, rank)})
+    pipe.hset(_rows_key(contest.id), rank.user_id, json.dumps(row))
+
+
+def update(contest, rank, user=None):
+    """
+    将一行排名写入 redis, 在持有该行的行锁时调用, 保证同一用户的更新按照顺序写入; 时间复杂度 O(log n)
+    :param user: 已经读取的 rank.user, 需要包含 userprofile, 为空时从数据库读取
+    """
+    if user is None:
+        user = rank.user
+    else:
+        rank.user = user
+    if user.admin_type != AdminType.REGULAR_USER or user.is_disabled:
+        return
+    row = _serializer(contest)(rank, is_contest_admin=True).data
+    pipe = cache.pipeline()
+    _add_row(pipe, contest, rank, row)
+    pipe.incr(_version_key(contest.id))
+    pipe.execute()
+
+
+def is_ready(contest_id):
+    return bool(cache.exists(_ready_key(contest_id)))
+
+
+def rebuild(contest):
+    """
+    从数据库重建比赛的排名, 用于 redis 数据丢失后的恢复; 删除和写入在同一个事务中执行
+    """
+    pipe = cache.pipeline()
+    pipe.delete(_rank_key(contest.id), _rows_key(contest.id))
+    serializer = _serializer(contest)
+    for rank in get_rank_queryset(contest):
+        _add_row(pipe, contest, rank, serializer(rank, is_contest_admin=True).data)
+    pipe.set(_ready_key(contest.id), 1)
+    pipe.incr(_version_key(contest.id))
+    pipe.execute()
+
+
+def ensure_ready(contest):
+    if is_ready(contest.id):
+        return True
+    lock_key = f"{CacheKey.contest_scoreboard_rebuild_lock}:{contest.id}"
+    if not cache.set(lock_key, 1, timeout=REBUILD_LOCK_TIMEOUT, nx=True):
+        return False
+    try:
+        rebuild(contest)
+    finally:
+        cache.delete(lock_key)
+    return True
+
+
+def _strip_real_name(rows):
+    for row in rows:
+        row["user"]["real_name"] = None
+    return rows
+
+
+class Scoreboard:
+    """
+    按照排名顺序读取 redis 中的排名, 支持切片和 count, 可以直接传给 APIView.paginate_data
+    """
+    def __init__(self, contest_id, is_contest_admin=False):
+        self.contest_id = contest_id
+        self.is_contest_admin = is_contest_admin
+
+    def _load_rows(self, user_ids):
+        if not user_ids:
+            return []
+        rows = []
+        for data in cache.hmget(_rows_key(self.contest_id), user_ids):
+            if data is None:
+                continue
+            rows.append(json.loads(data))
+        return rows if self.is_contest_admin else _strip_real_name(rows)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("Scoreboard only supports slicing without step")
+        start = item.start or 0
+        stop = -1 if item.stop is None else item.stop - 1
+        if item.stop is not None and stop < start:
+            return []
+        return self._load_rows(cache.zrevrange(_rank_key(self.contest_id), start, stop))
+
+    def __iter__(self):
+        return iter(self[0:None])
+
+    def count(self):
+        return cache.zcard(_rank_key(self.contest_id))
+
+    def snapshot(self):
+        return ScoreboardSnapshot(self.contest_id, is_contest_admin=self.is_contest_admin)
+
+
+class ScoreboardSnapshot(Scoreboard):
+    """
+    一次 ZREVRANGE 读取所有用户的排名顺序, 之后按照切片读取每一行; 分批读取期间排名变化时不会重复或者遗漏用户
+    """
+    def __init__(self, contest_id, is_contest_admin=False):
+        super().__init__(contest_id, is_contest_admin=is_contest_admin)
+        self.user_ids = cache.zrevrange(_rank_key(contest_id), 0, -1)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("Scoreboard only supports slicing without step")
+        return self._load_rows(self.user_ids[item])
+
+    def count(self):
+        return len(self.user_ids)
+
+    def snapshot(self):
+        return self
+
+
+class SerializedScoreboard:
+    """
+    整个排名序列化为一个字符串, 管理员和普通用户分别保存; 读取一页只需要一次 GET 和切片
+    """
+    def __init__(self, data):
+        self.rows = json.loads(data) if data else []
+
+    def __getitem__(self, item):
+        return self.rows[item]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def count(self):
+        return len(self.rows)
+
+
+def _serialize(contest_id, is_contest_admin=False):
+    return json.dumps(list(Scoreboard(contest_id, is_contest_admin=is_contest_admin)))
+
+
+def _get_live(contest, is_contest_admin):
+    """
+    实时排名的缓存, 版本和排名版本一致时直接使用, 否则从 redis 中的排名重新生成
+    """
+    page_key = _page_key(contest.id, is_contest_admin)
+    pipe = cache.pipeline(transaction=False)
+    pipe.get(_version_key(contest.id))
+    pipe.hmget(page_key, VERSION_FIELD, ROWS_FIELD)
+    version, (cached_version, data) = pipe.execute()
+    version = version or b"0"
+    if data is not None and cached_version == version:
+        return SerializedScoreboard(data)
+    if not ensure_ready(contest):
+        return None
+    # ensure_ready 重建排名时会增加版本号, 需要重新读取;
+    # 生成期间排名被更新时, 写入的是旧的版本号, 下一次读取会重新生成
+    version = cache.get(_version_key(contest.id)) or 0
+    data = _serialize(contest.id, is_contest_admin)
+    cache.hset(page_key, mapping={VERSION_FIELD: version, ROWS_FIELD: data})
+    return SerializedScoreboard(data)
+
+
+def ensure_frozen(contest):
+    """
+    封榜后第一次更新或者读取排名时写入封榜快照, 只写入一次; 之后的判题结果只更新实时排名.
+    所有的更新都在快照写入之后才会执行, 所以快照中不会包含封榜后的判题结果
+    """
+    if cache.exists(_frozen_key(contest.id)):
+        return True
+    if not ensure_ready(contest):
+        return False
+    cache.hsetnx(_frozen_key(contest.id), ROWS_FIELD, _serialize(contest.id))
+    return True
+
+
+def publish_final(contest):
+    """
+    解除封榜, 在同一个事务中写入最终排名并删除封榜快照
+    """
+    ensure_ready(contest)
+    pipe = cache.pipeline()
+    pipe.hset(_final_key(contest.id), ROWS_FIELD, _serialize(contest.id))
+    pipe.delete(_frozen_key(contest.id))
+    pipe.execute()
+
+
+def clear_snapshots(contest_id):
+    cache.delete_many([_frozen_key(contest_id), _final_key(contest_id)])
+
+
+def get_scoreboard(contest, is_contest_admin=False, stream=False):
+    """
+    管理员总是看到实时排名; 封榜期间其他用户看到封榜快照, 解除封榜后看到最终排名.
+    stream 为 true 时实时排名按照切片分批从 redis 中读取, 不一次性加载整个排名.
+    排名正在从数据库重建时返回 None
+    """
+    if not is_contest_admin:
+        if contest.is_rank_frozen():
+            if not ensure_frozen(contest):
+                return None
+            return SerializedScoreboard(cache.hget(_frozen_key(contest.id), ROWS_FIELD))
+        if contest.rank_unfrozen:
+            data = cache.hget(_final_key(contest.id), ROWS_FIELD)
+            if data:
+                return SerializedScoreboard(data)
+    if stream:
+        return Scoreboard(contest.id, is_contest_admin=is_contest_admin) if ensure_ready(contest) else None
+    return _get_live(contest, is_contest_admin)
@@ -14,6 +14,7 @@ class CreateConetestSeriaizer(serializers.Serializer):
     visible = serializers.BooleanField()
     real_time_rank = serializers.BooleanField()
     allowed_ip_ranges = serializers.ListField(child=serializers.CharField(max_length=32), allow_empty=True)
+    rank_freeze_time = serializers.DateTimeField(required=False, allow_null=True)
 
 
 class EditConetestSeriaizer(serializers.Serializer):
@@ -26,6 +27,7 @@ class EditConetestSeriaizer(serializers.Serializer):
     visible = serializers.BooleanField()
     real_time_rank = serializers.BooleanField()
     allowed_ip_ranges = serializers.ListField(child=serializers.CharField(max_length=32))
+    rank_freeze_time = serializers.DateTimeField(required=False, allow_null=True)
 
 
 class ContestAdminSerializer(serializers.ModelSerializer):
@@ -101,6 +103,19 @@ class OIContestRankSerializer(serializers.ModelSerializer):
         return UsernameSerializer(obj.user, need_real_name=self.is_contest_admin).data
 
 
+class ContestRankExportSerializer(serializers.Serializer):
+    contest_id = serializers.IntegerField()
+    format = serializers.ChoiceField(choices=["xlsx", "csv"], default="xlsx")
+
+
+class ContestRankUnfreezeSerializer(serializers.Serializer):
+    contest_id = serializers.IntegerField()
+
+
+class ContestRankRecomputeSerializer(serializers.Serializer):
+    contest_id = serializers.IntegerField()
+
+
 class ACMContesHelperSerializer(serializers.Serializer):
     contest_id = serializers.IntegerField()
     problem_id = serializers.CharField()
@@ -0,0 +1,9 @@
+import dramatiq
+
+from contest import export
+from utils.shortcuts import DRAMATIQ_WORKER_ARGS
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def export_contest_rank(token):
+    export.run(token)
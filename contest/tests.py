@@ -1,11 +1,18 @@
 import copy
 from datetime import datetime, timedelta
+from unittest import mock
 
 from django.utils import timezone
 
+from problem.models import Problem
+from submission.models import JudgeStatus, Submission
+from submission.tests import DEFAULT_PROBLEM_DATA
 from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey
 
-from .models import ContestAnnouncement, ContestRuleType, Contest
+from . import export, scoreboard
+from .models import ACMContestRank, ContestAnnouncement, ContestRuleType, Contest
 
 DEFAULT_CONTEST_DATA = {"title": "test title", "description": "test description",
                         "start_time": timezone.localtime(timezone.now()),
@@ -160,3 +167,181 @@ class ContestRankAPITest(APITestCase):
     def get_contest_rank(self):
         resp = self.client.get(self.url + "?contest_id=" + self.acm_contest.id)
         self.assertSuccess(resp)
+
+
+class ContestScoreboardTest(APITestCase):
+    def setUp(self):
+        admin = self.create_admin()
+        self.contest = Contest.objects.create(created_by=admin, **DEFAULT_CONTEST_DATA)
+        self.url = self.reverse("contest_rank_api") + "?contest_id=" + str(self.contest.id)
+        self.clear_scoreboard()
+
+    def tearDown(self):
+        self.clear_scoreboard()
+
+    def clear_scoreboard(self):
+        cache.delete_many([f"{CacheKey.contest_scoreboard}:{self.contest.id}",
+                           f"{CacheKey.contest_scoreboard_rows}:{self.contest.id}",
+                           f"{CacheKey.contest_scoreboard_ready}:{self.contest.id}",
+                           f"{CacheKey.contest_scoreboard_frozen}:{self.contest.id}",
+                           f"{CacheKey.contest_scoreboard_final}:{self.contest.id}",
+                           f"{CacheKey.contest_scoreboard_version}:{self.contest.id}"])
+        cache.delete_pattern(f"{CacheKey.contest_scoreboard_page}:{self.contest.id}:*")
+
+    def create_rank(self, username, accepted_number, total_time):
+        user = self.create_user(username, "test123", login=False)
+        return ACMContestRank.objects.create(user=user, contest=self.contest, submission_number=accepted_number,
+                                             accepted_number=accepted_number, total_time=total_time)
+
+    def get_usernames(self, query=""):
+        resp = self.client.get(self.url + query)
+        self.assertSuccess(resp)
+        return [item["user"]["username"] for item in resp.data["data"]["results"]], resp.data["data"]["total"]
+
+    def test_rebuild_and_update(self):
+        self.create_rank("a", 1, 100)
+        rank = self.create_rank("b", 1, 50)
+        self.assertEqual(self.get_usernames(), (["b", "a"], 2))
+        self.assertTrue(scoreboard.is_ready(self.contest.id))
+
+        rank.accepted_number, rank.total_time = 0, 0
+        rank.save()
+        scoreboard.update(self.contest, rank)
+        # 新用户的排名在 redis 中增量更新
+        scoreboard.update(self.contest, self.create_rank("c", 2, 500))
+        self.assertEqual(self.get_usernames(), (["c", "a", "b"], 3))
+        self.assertEqual(self.get_usernames("&offset=1&limit=1"), (["a"], 3))
+
+    def test_snapshot(self):
+        self.create_rank("a", 1, 100)
+        rank = self.create_rank("b", 1, 50)
+        self.assertTrue(scoreboard.ensure_ready(self.contest))
+        board = scoreboard.Scoreboard(self.contest.id).snapshot()
+        first = board[0:1]
+        # 分批读取期间排名变化, 按照快照中的顺序读取, 不会重复或者遗漏用户
+        rank.accepted_number = 0
+        rank.save()
+        scoreboard.update(self.contest, rank)
+        rows = first + board[1:2]
+        self.assertEqual([row["user"]["username"] for row in rows], ["b", "a"])
+        self.assertEqual(board.count(), 2)
+
+    def test_cached_page(self):
+        self.create_rank("a", 1, 100)
+        self.assertEqual(self.get_usernames(), (["a"], 1))
+        # 排名没有更新时直接使用序列化后的缓存
+        with mock.patch("contest.scoreboard.Scoreboard") as board:
+            self.assertEqual(self.get_usernames(), (["a"], 1))
+            board.assert_not_called()
+        scoreboard.update(self.contest, self.create_rank("b", 2, 100))
+        self.assertEqual(self.get_usernames(), (["b", "a"], 2))
+
+    def test_recover_after_redis_lost(self):
+        self.create_rank("a", 1, 100)
+        self.assertEqual(self.get_usernames(), (["a"], 1))
+        self.clear_scoreboard()
+        self.assertEqual(self.get_usernames(), (["a"], 1))
+
+    def test_freeze_and_unfreeze(self):
+        self.create_rank("a", 1, 100)
+        self.contest.rank_freeze_time = timezone.now()
+        self.contest.save()
+        self.assertTrue(scoreboard.ensure_frozen(self.contest))
+        scoreboard.update(self.contest, self.create_rank("b", 2, 100))
+
+        public = [row["user"]["username"] for row in scoreboard.get_scoreboard(self.contest)]
+        self.assertEqual(public, ["a"])
+        # 管理员仍然看到实时排名
+        self.assertEqual(self.get_usernames(), (["b", "a"], 2))
+
+        resp = self.client.post(self.reverse("contest_rank_unfreeze_api"), {"contest_id": self.contest.id})
+        self.assertSuccess(resp)
+        self.contest.refresh_from_db()
+        public = [row["user"]["username"] for row in scoreboard.get_scoreboard(self.contest)]
+        self.assertEqual(public, ["b", "a"])
+
+        # 设置新的封榜时间之后重新封榜
+        data = copy.deepcopy(DEFAULT_CONTEST_DATA)
+        data.update({"id": self.contest.id, "rank_freeze_time": timezone.localtime(timezone.now())})
+        self.assertSuccess(self.client.put(self.reverse("contest_admin_api"), data=data))
+        self.contest.refresh_from_db()
+        self.assertFalse(self.contest.rank_unfrozen)
+        self.assertTrue(self.contest.is_rank_frozen())
+
+    def test_implicit_freeze_only_for_acm(self):
+        self.contest.real_time_rank = False
+        self.assertTrue(self.contest.is_rank_frozen())
+        # OI 比赛期间不能查看排名, 结束之后显示完整的排名, 不需要封榜
+        self.contest.rule_type = ContestRuleType.OI
+        self.assertFalse(self.contest.is_rank_frozen())
+
+    def test_frozen_while_rebuilding(self):
+        self.create_rank("a", 1, 100)
+        self.contest.rank_freeze_time = timezone.now()
+        self.contest.save()
+        lock_key = f"{CacheKey.contest_scoreboard_rebuild_lock}:{self.contest.id}"
+        cache.set(lock_key, 1, timeout=10)
+        try:
+            # 封榜快照还没有写入并且排名正在重建, 按照重建中处理而不是返回空的快照
+            self.assertIsNone(scoreboard.get_scoreboard(self.contest))
+            # 普通用户不能看到数据库中的实时排名
+            self.create_user("test", "test123")
+            self.assertSuccess(self.client.post(self.reverse("contest_password_api"),
+                                                {"contest_id": self.contest.id,
+                                                 "password": DEFAULT_CONTEST_DATA["password"]}))
+            resp = self.client.get(self.url)
+            self.assertFailed(resp, "Scoreboard is being rebuilt, please try again later")
+        finally:
+            cache.delete(lock_key)
+
+    @mock.patch("utils.tasks.delete_files.send_with_options")
+    @mock.patch("contest.tasks.export_contest_rank.send")
+    def test_export(self, send, delete_files):
+        self.create_rank("a", 1, 100)
+        resp = self.client.post(self.reverse("contest_rank_export_api"), {"contest_id": self.contest.id, "format": "csv"})
+        self.assertSuccess(resp)
+        token = resp.data["data"]["token"]
+        send.assert_called_once_with(token)
+
+        export.run(token)
+        url = self.reverse("contest_rank_export_api") + "?token=" + token
+        resp = self.client.get(url)
+        self.assertSuccess(resp)
+        self.assertEqual((resp.data["data"]["status"], resp.data["data"]["progress"]), (export.ExportStatus.FINISHED, 1))
+        resp = self.client.get(url + "&download=1")
+        lines = b"".join(resp.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[0], "User ID,Username,Real Name,AC,Total Submission,Total Time")
+        self.assertEqual(lines[1].split(",")[1:], ["a", "", "1", "1", "100"])
+
+    def test_recompute(self):
+        problem_data = copy.deepcopy(DEFAULT_PROBLEM_DATA)
+        problem_data.pop("tags")
+        problem = Problem.objects.create(created_by=self.contest.created_by, contest=self.contest, **problem_data)
+        a = self.create_user("a", "test123", login=False)
+        b = self.create_user("b", "test123", login=False)
+        for user, result, seconds in [(a, JudgeStatus.WRONG_ANSWER, 10), (b, JudgeStatus.ACCEPTED, 50),
+                                      (a, JudgeStatus.COMPILE_ERROR, 60), (a, JudgeStatus.ACCEPTED, 100),
+                                      (a, JudgeStatus.WRONG_ANSWER, 200)]:
+            submission = Submission.objects.create(contest=self.contest, problem=problem, user_id=user.id,
+                                                   username=user.username, code="", language="C", result=result)
+            Submission.objects.filter(id=submission.id).update(
+                create_time=self.contest.start_time + timedelta(seconds=seconds))
+        # 旧的排名会被覆盖
+        ACMContestRank.objects.create(user=a, contest=self.contest, submission_number=10, accepted_number=0,
+                                      submission_info={str(problem.id): {"is_ac": False, "checked": True}})
+        # 已经解除封榜的比赛, 旧的最终排名也会被覆盖
+        self.contest.rank_unfrozen = True
+        self.contest.save()
+        scoreboard.publish_final(self.contest)
+
+        resp = self.client.post(self.reverse("contest_rank_recompute_api"), {"contest_id": self.contest.id})
+        self.assertSuccess(resp)
+        self.assertEqual((resp.data["data"]["submissions"], resp.data["data"]["ranks"]), (5, 2))
+        rank = ACMContestRank.objects.get(user=a, contest=self.contest)
+        self.assertEqual((rank.submission_number, rank.accepted_number, rank.total_time), (3, 1, 100 + 20 * 60))
+        self.assertEqual(rank.submission_info[str(problem.id)],
+                         {"is_ac": True, "ac_time": 100, "error_number": 1, "is_first_ac": False, "checked": True})
+        self.assertTrue(ACMContestRank.objects.get(user=b, contest=self.contest).submission_info[str(problem.id)]["is_first_ac"])
+        self.assertEqual(self.get_usernames(), (["b", "a"], 2))
+        public = [row["user"]["username"] for row in scoreboard.get_scoreboard(self.contest)]
+        self.assertEqual(public, ["b", "a"])
@@ -10,15 +10,15 @@ from account.decorators import check_contest_permission, ensure_created_by
 from account.models import User
 from submission.models import Submission, JudgeStatus
 from utils.api import APIView, validate_serializer
-from utils.cache import cache
-from utils.constants import CacheKey
 from utils.shortcuts import rand_str
 from utils.tasks import delete_files
+from .. import recompute, scoreboard
 from ..models import Contest, ContestAnnouncement, ACMContestRank
 from ..serializers import (ContestAnnouncementSerializer, ContestAdminSerializer,
                            CreateConetestSeriaizer, CreateContestAnnouncementSerializer,
                            EditConetestSeriaizer, EditContestAnnouncementSerializer,
-                           ACMContesHelperSerializer, )
+                           ACMContesHelperSerializer, ContestRankUnfreezeSerializer,
+                           ContestRankRecomputeSerializer, )
 
 
 class ContestAPI(APIView):
@@ -30,6 +30,10 @@ class ContestAPI(APIView):
         data["created_by"] = request.user
         if data["end_time"] <= data["start_time"]:
             return self.error("Start time must occur earlier than end time")
+        if data.get("rank_freeze_time"):
+            data["rank_freeze_time"] = dateutil.parser.parse(data["rank_freeze_time"])
+            if not data["start_time"] <= data["rank_freeze_time"] <= data["end_time"]:
+                return self.error("Rank freeze time must be between start time and end time")
         if data.get("password") and data["password"] == "":
             data["password"] = None
         for ip_range in data["allowed_ip_ranges"]:
@@ -52,6 +56,10 @@ class ContestAPI(APIView):
         data["end_time"] = dateutil.parser.parse(data["end_time"])
         if data["end_time"] <= data["start_time"]:
             return self.error("Start time must occur earlier than end time")
+        if data.get("rank_freeze_time"):
+            data["rank_freeze_time"] = dateutil.parser.parse(data["rank_freeze_time"])
+            if not data["start_time"] <= data["rank_freeze_time"] <= data["end_time"]:
+                return self.error("Rank freeze time must be between start time and end time")
         if not data["password"]:
             data["password"] = None
         for ip_range in data["allowed_ip_ranges"]:
@@ -59,9 +67,11 @@ class ContestAPI(APIView):
                 ip_network(ip_range, strict=False)
             except ValueError:
                 return self.error(f"{ip_range} is not a valid cidr network")
-        if not contest.real_time_rank and data.get("real_time_rank"):
-            cache_key = f"{CacheKey.contest_rank_cache}:{contest.id}"
-            cache.delete(cache_key)
+        if contest.real_time_rank != data["real_time_rank"] or \
+                contest.rank_freeze_time != data.get("rank_freeze_time", contest.rank_freeze_time):
+            scoreboard.clear_snapshots(contest.id)
+            # 修改了封榜设置, 之前的解除封榜不再有效, 按照新的封榜时间重新封榜
+            contest.rank_unfrozen = False
 
         for k, v in data.items():
             setattr(contest, k, v)
@@ -192,9 +202,37 @@ class ACMContestHelper(APIView):
             return self.error("Problem id does not exist")
         problem_rank_status["checked"] = data["checked"]
         rank.save(update_fields=("submission_info",))
+        scoreboard.update(self.contest, rank)
         return self.success()
 
 
+class ContestRankUnfreezeAPI(APIView):
+    @validate_serializer(ContestRankUnfreezeSerializer)
+    def post(self, request):
+        try:
+            contest = Contest.objects.get(id=request.data["contest_id"])
+            ensure_created_by(contest, request.user)
+        except Contest.DoesNotExist:
+            return self.error("Contest does not exist")
+        if contest.rank_freeze_start is None:
+            return self.error("Contest rank is not frozen")
+        contest.rank_unfrozen = True
+        contest.save(update_fields=["rank_unfrozen"])
+        scoreboard.publish_final(contest)
+        return self.success(ContestAdminSerializer(contest).data)
+
+
+class ContestRankRecomputeAPI(APIView):
+    @validate_serializer(ContestRankRecomputeSerializer)
+    def post(self, request):
+        try:
+            contest = Contest.objects.get(id=request.data["contest_id"])
+            ensure_created_by(contest, request.user)
+        except Contest.DoesNotExist:
+            return self.error("Contest does not exist")
+        return self.success(recompute.recompute(contest))
+
+
 class DownloadContestSubmissions(APIView):
     def _dump_submissions(self, contest, exclude_admin=True):
         problem_ids = contest.problem_set.all().values_list("id", "_id")
@@ -209,7 +247,8 @@ class DownloadContestSubmissions(APIView):
                 if user.is_admin_role() and exclude_admin:
                     continue
                 user_ac_map = copy.deepcopy(ac_map)
-                user_submissions = submissions.filter(user_id=user.id)
+                user_submissions = list(submissions.filter(user_id=user.id))
+                Submission.load_code(user_submissions)
                 for submission in user_submissions:
                     problem_id = submission.problem_id
                     if user_ac_map[problem_id]:
@@ -1,21 +1,17 @@
-import io
-
-import xlsxwriter
-from django.http import HttpResponse
+from django.http import FileResponse
 from django.utils.timezone import now
-from django.core.cache import cache
 
-from problem.models import Problem
 from utils.api import APIView, validate_serializer
-from utils.constants import CacheKey, CONTEST_PASSWORD_SESSION_KEY
-from utils.shortcuts import datetime2str, check_is_id
-from account.models import AdminType
+from utils.constants import CONTEST_PASSWORD_SESSION_KEY
+from utils.shortcuts import datetime2str, check_is_id, rand_str
+from utils.tasks import delete_files
 from account.decorators import login_required, check_contest_permission, check_contest_password
 
 from utils.constants import ContestRuleType, ContestStatus
-from ..models import ContestAnnouncement, Contest, OIContestRank, ACMContestRank
+from .. import export, scoreboard
+from ..models import ContestAnnouncement, Contest
 from ..serializers import ContestAnnouncementSerializer
-from ..serializers import ContestSerializer, ContestPasswordVerifySerializer
+from ..serializers import ContestSerializer, ContestPasswordVerifySerializer, ContestRankExportSerializer
 from ..serializers import OIContestRankSerializer, ACMContestRankSerializer
 
 
@@ -104,89 +100,65 @@ class ContestAccessAPI(APIView):
 
 class ContestRankAPI(APIView):
     def get_rank(self):
-        if self.contest.rule_type == ContestRuleType.ACM:
-            return ACMContestRank.objects.filter(contest=self.contest,
-                                                 user__admin_type=AdminType.REGULAR_USER,
-                                                 user__is_disabled=False).\
-                select_related("user").order_by("-accepted_number", "total_time")
-        else:
-            return OIContestRank.objects.filter(contest=self.contest,
-                                                user__admin_type=AdminType.REGULAR_USER,
-                                                user__is_disabled=False). \
-                select_related("user").order_by("-total_score")
-
-    def column_string(self, n):
-        string = ""
-        while n > 0:
-            n, remainder = divmod(n - 1, 26)
-            string = chr(65 + remainder) + string
-        return string
+        return scoreboard.get_rank_queryset(self.contest)
 
     @check_contest_permission(check_type="ranks")
     def get(self, request):
         download_csv = request.GET.get("download_csv")
-        force_refresh = request.GET.get("force_refresh")
         is_contest_admin = request.user.is_authenticated and request.user.is_contest_admin(self.contest)
         if self.contest.rule_type == ContestRuleType.OI:
             serializer = OIContestRankSerializer
         else:
             serializer = ACMContestRankSerializer
 
-        if force_refresh == "1" and is_contest_admin:
+        board = scoreboard.get_scoreboard(self.contest, is_contest_admin=is_contest_admin, stream=bool(download_csv))
+        if board is None:
+            # 其他请求正在从数据库重建排名; 数据库中是实时排名, 封榜期间不能给普通用户看
+            if not is_contest_admin and self.contest.is_rank_frozen():
+                return self.error("Scoreboard is being rebuilt, please try again later")
             qs = self.get_rank()
-        else:
-            cache_key = f"{CacheKey.contest_rank_cache}:{self.contest.id}"
-            qs = cache.get(cache_key)
-            if not qs:
-                qs = self.get_rank()
-                cache.set(cache_key, qs)
 
         if download_csv:
-            data = serializer(qs, many=True, is_contest_admin=is_contest_admin).data
-            contest_problems = Problem.objects.filter(contest=self.contest, visible=True).order_by("_id")
-            problem_ids = [item.id for item in contest_problems]
-
-            f = io.BytesIO()
-            workbook = xlsxwriter.Workbook(f)
-            worksheet = workbook.add_worksheet()
-            worksheet.write("A1", "User ID")
-            worksheet.write("B1", "Username")
-            worksheet.write("C1", "Real Name")
-            if self.contest.rule_type == ContestRuleType.OI:
-                worksheet.write("D1", "Total Score")
-                for item in range(contest_problems.count()):
-                    worksheet.write(self.column_string(5 + item) + "1", f"{contest_problems[item].title}")
-                for index, item in enumerate(data):
-                    worksheet.write_string(index + 1, 0, str(item["user"]["id"]))
-                    worksheet.write_string(index + 1, 1, item["user"]["username"])
-                    worksheet.write_string(index + 1, 2, item["user"]["real_name"] or "")
-                    worksheet.write_string(index + 1, 3, str(item["total_score"]))
-                    for k, v in item["submission_info"].items():
-                        worksheet.write_string(index + 1, 4 + problem_ids.index(int(k)), str(v))
-            else:
-                worksheet.write("D1", "AC")
-                worksheet.write("E1", "Total Submission")
-                worksheet.write("F1", "Total Time")
-                for item in range(contest_problems.count()):
-                    worksheet.write(self.column_string(7 + item) + "1", f"{contest_problems[item].title}")
-
-                for index, item in enumerate(data):
-                    worksheet.write_string(index + 1, 0, str(item["user"]["id"]))
-                    worksheet.write_string(index + 1, 1, item["user"]["username"])
-                    worksheet.write_string(index + 1, 2, item["user"]["real_name"] or "")
-                    worksheet.write_string(index + 1, 3, str(item["accepted_number"]))
-                    worksheet.write_string(index + 1, 4, str(item["submission_number"]))
-                    worksheet.write_string(index + 1, 5, str(item["total_time"]))
-                    for k, v in item["submission_info"].items():
-                        worksheet.write_string(index + 1, 6 + problem_ids.index(int(k)), str(v["is_ac"]))
-
-            workbook.close()
-            f.seek(0)
-            response = HttpResponse(f.read())
+            # 兼容旧的同步导出, 大的排名请使用 ContestRankExportAPI 在后台导出
+            if board is None:
+                return self.error("Scoreboard is being rebuilt, please try again later")
+            path = export.file_path(rand_str(), export.ExportFormat.XLSX)
+            export.write_rank(self.contest, board, path, export.ExportFormat.XLSX)
+            delete_files.send_with_options(args=(path,), delay=300_000)
+            response = FileResponse(open(path, "rb"))
             response["Content-Disposition"] = f"attachment; filename=content-{self.contest.id}-rank.xlsx"
             response["Content-Type"] = "application/xlsx"
             return response
 
+        if board is not None:
+            return self.success(self.paginate_data(request, board))
         page_qs = self.paginate_data(request, qs)
         page_qs["results"] = serializer(page_qs["results"], many=True, is_contest_admin=is_contest_admin).data
         return self.success(page_qs)
+
+
+class ContestRankExportAPI(APIView):
+    @validate_serializer(ContestRankExportSerializer)
+    @check_contest_permission(check_type="ranks")
+    def post(self, request):
+        is_contest_admin = request.user.is_contest_admin(self.contest)
+        token = export.start(self.contest, request.user, is_contest_admin, request.data["format"])
+        return self.success({"token": token})
+
+    @login_required
+    def get(self, request):
+        token = request.GET.get("token")
+        if not token:
+            return self.error("Parameter error, token is required")
+        status = export.get_status(token)
+        if not status or status["user_id"] != request.user.id:
+            return self.error("Export does not exist or has expired")
+        if request.GET.get("download") != "1":
+            return self.success({k: status.get(k) for k in ("status", "progress", "total", "format", "error")})
+        if status["status"] != export.ExportStatus.FINISHED:
+            return self.error("Export is not finished")
+        response = FileResponse(open(export.file_path(token, status["format"]), "rb"))
+        response["Content-Disposition"] = \
+            f"attachment; filename=contest-{status['contest_id']}-rank.{status['format']}"
+        response["Content-Type"] = f"application/{status['format']}"
+        return response
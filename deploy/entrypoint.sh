@@ -32,9 +32,9 @@ else
 fi
 
 if [ ! -z "$LOWER_IP_HEADER" ]; then
-    sed -i "s/__IP_HEADER__/\$http_$LOWER_IP_HEADER/g" api_proxy.conf;
+    sed -i "s/__IP_HEADER__/\$http_$LOWER_IP_HEADER/g" api_proxy.conf events_proxy.conf;
 else
-    sed -i "s/__IP_HEADER__/\$remote_addr/g" api_proxy.conf;
+    sed -i "s/__IP_HEADER__/\$remote_addr/g" api_proxy.conf events_proxy.conf;
 fi
 
 if [ -z "$MAX_WORKER_NUM" ]; then
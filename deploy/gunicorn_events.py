@@ -0,0 +1,7 @@
+# 处理 /api/submission_events 的 gevent worker 的配置, 见 supervisord.conf 中的 gunicorn_events
+
+
+def post_fork(server, worker):
+    # gunicorn 已经 patch 了标准库, psycopg2 是 C 扩展, 需要单独 patch, 否则查询数据库时会阻塞整个进程
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -0,0 +1,216 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from conf.models import JudgeServer
+from judge.cost import DEFAULT_COST
+from judge.heartbeat import alive_key
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# KEYS: capacity, tasks, service_url, load, affinity stats
+# ARGV: alive key prefix, cost, affinity key, affinity servers
+# 在一次调用内选出仍有空闲槽位的健康服务器中, 加上本次任务后单位槽位未完成工作量 (预估判题耗时之和) 最小的一个,
+# 占用一个槽位并累加工作量.
+# affinity key (test_case_id) 不为空时, 通过 rendezvous hashing 为其选出固定的几台首选服务器,
+# 首选服务器都没有空闲槽位时才使用其他服务器, 这样同一题目的测试用例尽量留在少数服务器的 page cache 中
+_ACQUIRE_SCRIPT = """
+local servers = redis.call("HGETALL", KEYS[1])
+local alive_prefix = ARGV[1]
+local cost = tonumber(ARGV[2])
+local affinity_key = ARGV[3]
+local affinity_servers = tonumber(ARGV[4])
+local healthy = {}
+for i = 1, #servers, 2 do
+    local hostname = servers[i]
+    local capacity = tonumber(servers[i + 1])
+    if capacity > 0 and redis.call("EXISTS", alive_prefix .. hostname) == 1 then
+        local tasks = tonumber(redis.call("HGET", KEYS[2], hostname) or "0")
+        local load = (tonumber(redis.call("HGET", KEYS[4], hostname) or "0") + cost) / capacity
+        healthy[#healthy + 1] = {hostname = hostname, free = tasks < capacity, load = load,
+                                 weight = redis.sha1hex(affinity_key .. hostname)}
+    end
+end
+local preferred = {}
+if affinity_key ~= "" and affinity_servers > 0 then
+    table.sort(healthy, function(a, b) return a.weight > b.weight end)
+    for i = 1, math.min(affinity_servers, #healthy) do
+        preferred[healthy[i].hostname] = true
+    end
+end
+local function choose(candidates)
+    local best
+    for _, server in ipairs(candidates) do
+        if server.free and (best == nil or server.load < best.load) then
+            best = server
+        end
+    end
+    return best
+end
+local best
+if next(preferred) ~= nil then
+    local candidates = {}
+    for _, server in ipairs(healthy) do
+        if preferred[server.hostname] then
+            candidates[#candidates + 1] = server
+        end
+    end
+    best = choose(candidates)
+    redis.call("HINCRBY", KEYS[5], best and "hit" or "miss", 1)
+end
+best = best or choose(healthy)
+if best == nil then
+    return nil
+end
+redis.call("HINCRBY", KEYS[2], best.hostname, 1)
+redis.call("HINCRBYFLOAT", KEYS[4], best.hostname, cost)
+return {best.hostname, redis.call("HGET", KEYS[3], best.hostname)}
+"""
+
+# KEYS: tasks, load
+# ARGV: hostname, cost
+# 释放槽位和工作量, 都不会小于 0
+_RELEASE_SCRIPT = """
+local tasks = redis.call("HINCRBY", KEYS[1], ARGV[1], -1)
+if tasks < 0 then
+    redis.call("HSET", KEYS[1], ARGV[1], 0)
+end
+local load = tonumber(redis.call("HINCRBYFLOAT", KEYS[2], ARGV[1], -tonumber(ARGV[2])))
+if tasks <= 0 or load < 0 then
+    redis.call("HSET", KEYS[2], ARGV[1], 0)
+end
+return tasks
+"""
+
+
+def server_capacity(server):
+    # 和原先 task_number <= cpu_core * 2 的判断保持一致
+    if server.is_disabled:
+        return 0
+    return server.cpu_core * 2 + 1
+
+
+class DBSlotAllocator:
+    """
+    通过对 judge_server 表加行锁来分配槽位, 适用于单机部署
+    """
+    def acquire(self, cost=DEFAULT_COST, affinity_key=None):
+        with transaction.atomic():
+            servers = JudgeServer.objects.select_for_update().filter(is_disabled=False).order_by("task_number")
+            servers = [s for s in servers if s.status == "normal"]
+            for server in servers:
+                if server.task_number <= server.cpu_core * 2:
+                    server.task_number = F("task_number") + 1
+                    server.save(update_fields=["task_number"])
+                    return server
+        return None
+
+    def release(self, server, cost=DEFAULT_COST):
+        JudgeServer.objects.filter(id=server.id).update(task_number=F("task_number") - 1)
+
+    def task_numbers(self):
+        return dict(JudgeServer.objects.values_list("hostname", "task_number"))
+
+    def free_slots(self):
+        servers = JudgeServer.objects.filter(is_disabled=False)
+        return sum(max(server_capacity(s) - s.task_number, 0) for s in servers if s.status == "normal")
+
+    def affinity_stats(self):
+        return None
+
+
+class RedisSlotAllocator:
+    """
+    每个判题服务器在 redis 中维护一个槽位计数, 通过 lua 脚本原子地选择服务器并占用槽位,
+    不再需要对数据库中的 judge_server 加锁
+    """
+    def __init__(self):
+        self._acquire = cache.register_script(_ACQUIRE_SCRIPT)
+        self._release = cache.register_script(_RELEASE_SCRIPT)
+
+    def acquire(self, cost=DEFAULT_COST, affinity_key=None):
+        """
+        cost 为本次任务的预估判题耗时, 见 judge.cost; affinity_key 为题目的 test_case_id
+        """
+        ret = self._acquire(keys=[CacheKey.judge_server_capacity, CacheKey.judge_server_tasks,
+                                  CacheKey.judge_server_url, CacheKey.judge_server_load,
+                                  CacheKey.judge_server_affinity_stats],
+                            args=[alive_key(""), cost, affinity_key or "", settings.JUDGE_AFFINITY_SERVERS])
+        if not ret:
+            return None
+        hostname, service_url = [item.decode("utf-8") if item else None for item in ret]
+        return JudgeServer(hostname=hostname, service_url=service_url)
+
+    def release(self, server, cost=DEFAULT_COST):
+        self._release(keys=[CacheKey.judge_server_tasks, CacheKey.judge_server_load], args=[server.hostname, cost])
+
+    def task_numbers(self):
+        return {k.decode("utf-8"): int(v) for k, v in cache.hgetall(CacheKey.judge_server_tasks).items()}
+
+    def free_slots(self):
+        """
+        所有健康服务器的空闲槽位总数
+        """
+        pipe = cache.pipeline()
+        pipe.hgetall(CacheKey.judge_server_capacity)
+        pipe.hgetall(CacheKey.judge_server_tasks)
+        capacity, tasks = pipe.execute()
+        if not capacity:
+            return 0
+        hostnames = list(capacity.keys())
+        alive = cache.mget([alive_key(hostname.decode("utf-8")) for hostname in hostnames])
+        return sum(max(int(capacity[hostname]) - int(tasks.get(hostname, 0)), 0)
+                   for hostname, flag in zip(hostnames, alive) if flag)
+
+    def affinity_stats(self):
+        """
+        任务被分配到首选服务器的比例
+        """
+        ret = {k.decode("utf-8"): int(v) for k, v in cache.hgetall(CacheKey.judge_server_affinity_stats).items()}
+        ret.setdefault("hit", 0)
+        ret.setdefault("miss", 0)
+        total = ret["hit"] + ret["miss"]
+        ret["hit_rate"] = ret["hit"] / total if total else None
+        return ret
+
+    @staticmethod
+    def sync_server(server):
+        """
+        心跳或者管理员修改服务器状态后, 将服务器信息同步到 redis; 服务器是否存活由 judge.heartbeat 中的存活标记决定
+        """
+        pipe = cache.pipeline()
+        pipe.hset(CacheKey.judge_server_capacity, server.hostname, server_capacity(server))
+        pipe.hset(CacheKey.judge_server_url, server.hostname, server.service_url or "")
+        pipe.hsetnx(CacheKey.judge_server_tasks, server.hostname, 0)
+        pipe.execute()
+
+    @staticmethod
+    def remove_server(hostname):
+        pipe = cache.pipeline()
+        for key in (CacheKey.judge_server_capacity, CacheKey.judge_server_tasks,
+                    CacheKey.judge_server_url, CacheKey.judge_server_load):
+            pipe.hdel(key, hostname)
+        pipe.execute()
+
+
+_allocator = None
+
+
+def get_slot_allocator():
+    global _allocator
+    if _allocator is None:
+        if settings.JUDGE_SLOT_ALLOCATOR == "db":
+            _allocator = DBSlotAllocator()
+        else:
+            _allocator = RedisSlotAllocator()
+    return _allocator
+
+
+def sync_judge_server(server):
+    if isinstance(get_slot_allocator(), RedisSlotAllocator):
+        RedisSlotAllocator.sync_server(server)
+
+
+def remove_judge_server(hostname):
+    if isinstance(get_slot_allocator(), RedisSlotAllocator):
+        RedisSlotAllocator.remove_server(hostname)
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import dramatiq
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# 和同步模式下的请求超时时间保持一致
+REQUEST_TIMEOUT = 30
+
+
+class AsyncJudgeRunner:
+    """
+    JUDGE_DISPATCH_MODE = async 时使用.
+    dramatiq 的 worker 线程只负责占用槽位并把判题请求交给本进程内的事件循环, 然后立即返回;
+    事件循环同时等待所有正在进行的判题请求, 返回结果后释放槽位, 再交给线程池完成数据库相关的后续处理.
+    这样单个进程的判题并发数只受判题服务器槽位数和 JUDGE_ASYNC_MAX_INFLIGHT 限制, 而不是 worker 线程数
+    """
+    def __init__(self, max_inflight=None, bookkeeping_threads=None):
+        self._max_inflight = max_inflight or settings.JUDGE_ASYNC_MAX_INFLIGHT
+        self._bookkeeping_threads = bookkeeping_threads or settings.JUDGE_ASYNC_BOOKKEEPING_THREADS
+        self._inflight = threading.BoundedSemaphore(self._max_inflight)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._session = None
+        self._executor = None
+        self._futures = set()
+
+    def _start(self):
+        with self._lock:
+            if self._loop:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self._bookkeeping_threads,
+                                                thread_name_prefix="judge-bookkeeping")
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name="judge-dispatch-loop", daemon=True).start()
+            asyncio.run_coroutine_threadsafe(self._create_session(), self._loop).result()
+
+    async def _create_session(self):
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=self._max_inflight)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+    def submit(self, dispatcher, server, url, data):
+        """
+        在 worker 线程中调用; 本进程中正在进行的请求数达到上限时阻塞, 避免无限制地占用槽位
+        """
+        self._start()
+        self._inflight.acquire()
+        future = asyncio.run_coroutine_threadsafe(self._judge(dispatcher, server, url, data), self._loop)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        self._inflight.release()
+
+    async def _judge(self, dispatcher, server, url, data):
+        import aiohttp
+        resp = None
+        start = time.time()
+        try:
+            async with self._session.post(url, json=data, headers={"X-Judge-Server-Token": dispatcher.token}) as response:
+                response.raise_for_status()
+                resp = await response.json(content_type=None)
+        except asyncio.TimeoutError:
+            logger.error(f"Judge server request timeout: {url}")
+        except aiohttp.ClientError as e:
+            logger.error(f"Judge server request error: {url}, error: {str(e)}")
+        except ValueError as e:
+            logger.error(f"Judge server response is not valid JSON: {url}, error: {str(e)}")
+        except Exception as e:
+            logger.exception(f"Unexpected error when calling judge server {url}: {str(e)}")
+        dispatcher.judge_time = time.time() - start
+        await self._loop.run_in_executor(self._executor, self._bookkeeping, dispatcher, server, resp)
+
+    @staticmethod
+    def _bookkeeping(dispatcher, server, resp):
+        from judge.allocator import get_slot_allocator
+        close_old_connections()
+        try:
+            get_slot_allocator().release(server, dispatcher.estimated_cost)
+            dispatcher.process_judge_response(resp)
+        except Exception as e:
+            logger.exception(f"Failed to process judge response of submission {dispatcher.submission.id}: {str(e)}")
+        finally:
+            close_old_connections()
+
+    def shutdown(self, timeout=None):
+        """
+        等待正在进行的判题请求和后续处理全部完成
+        """
+        with self._lock:
+            if not self._loop:
+                return
+            futures = list(self._futures)
+        wait(futures, timeout=timeout)
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._loop = None
+
+
+class AsyncJudgeMiddleware(dramatiq.Middleware):
+    """
+    worker 退出前等待本进程中异步进行的判题请求完成
+    """
+    def before_worker_shutdown(self, broker, worker):
+        async_judge_runner.shutdown(timeout=REQUEST_TIMEOUT)
+
+
+async_judge_runner = AsyncJudgeRunner()
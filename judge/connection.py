@@ -0,0 +1,103 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+logger = logging.getLogger(__name__)
+
+# 每个判题服务器最多保持的空闲长连接数
+POOL_SIZE = 8
+# 每处理多少个请求汇总一次连接复用情况
+REPORT_INTERVAL = 100
+
+
+class _PooledSession:
+    def __init__(self, service_url):
+        self.service_url = service_url
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.requests = 0
+        self.reported_requests = 0
+        self.reported_connections = 0
+
+    @property
+    def connections(self):
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def close(self):
+        self.session.close()
+
+
+class JudgeServerSessionPool:
+    """
+    进程内为每个判题服务器维护一个 requests.Session, 复用 TCP/TLS 连接;
+    服务器的 service_url 变化后 (心跳中上报了新的地址), 旧的连接会被关闭
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _get(self, server):
+        with self._lock:
+            pooled = self._sessions.get(server.hostname)
+            if pooled and pooled.service_url != server.service_url:
+                logger.info(f"Judge server {server.hostname} service_url changed, evict connections")
+                pooled.close()
+                pooled = None
+            if not pooled:
+                pooled = _PooledSession(server.service_url)
+                self._sessions[server.hostname] = pooled
+            return pooled
+
+    def post(self, server, url, **kwargs):
+        pooled = self._get(server)
+        try:
+            return pooled.session.post(url, **kwargs)
+        finally:
+            pooled.requests += 1
+            if pooled.requests - pooled.reported_requests >= REPORT_INTERVAL:
+                self._report(server.hostname, pooled)
+
+    def evict(self, hostname):
+        with self._lock:
+            pooled = self._sessions.pop(hostname, None)
+        if pooled:
+            pooled.close()
+
+    def _report(self, hostname, pooled):
+        connections = pooled.connections
+        request_delta = pooled.requests - pooled.reported_requests
+        connection_delta = connections - pooled.reported_connections
+        pooled.reported_requests, pooled.reported_connections = pooled.requests, connections
+        logger.info(f"Judge server {hostname}: {pooled.requests} requests, {connections} connections, "
+                    f"reuse rate {1 - connections / pooled.requests:.2%}")
+        try:
+            pipe = cache.pipeline()
+            pipe.hincrby(CacheKey.judge_server_connection_stats, f"{hostname}:requests", request_delta)
+            pipe.hincrby(CacheKey.judge_server_connection_stats, f"{hostname}:connections", connection_delta)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to report judge server connection stats: {e}")
+
+
+def connection_reuse_rate():
+    """
+    所有 dispatcher 进程汇总后的连接复用率, {hostname: rate}
+    """
+    stats = {k.decode("utf-8"): int(v) for k, v in cache.hgetall(CacheKey.judge_server_connection_stats).items()}
+    ret = {}
+    for key, value in stats.items():
+        hostname, field = key.rsplit(":", 1)
+        if field == "requests" and value:
+            ret[hostname] = 1 - stats.get(f"{hostname}:connections", 0) / value
+    return ret
+
+
+session_pool = JudgeServerSessionPool()
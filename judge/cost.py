@@ -0,0 +1,34 @@
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 没有历史数据时每次判题的预估耗时 (秒)
+DEFAULT_COST = 1.0
+# EWMA 中本次耗时的权重
+ALPHA = 0.3
+
+# KEYS: cost
+# ARGV: problem_id, elapsed, alpha
+_RECORD_SCRIPT = """
+local old = redis.call("HGET", KEYS[1], ARGV[1])
+local elapsed = tonumber(ARGV[2])
+local value = elapsed
+if old then
+    local alpha = tonumber(ARGV[3])
+    value = alpha * elapsed + (1 - alpha) * tonumber(old)
+end
+redis.call("HSET", KEYS[1], ARGV[1], tostring(value))
+return tostring(value)
+"""
+
+
+def estimate(problem_id):
+    """
+    题目每次判题的预估耗时, 为历史判题耗时的指数加权移动平均
+    """
+    value = cache.hget(CacheKey.judge_problem_cost, problem_id)
+    return float(value) if value else DEFAULT_COST
+
+
+def record(problem_id, elapsed):
+    return float(cache.register_script(_RECORD_SCRIPT)(keys=[CacheKey.judge_problem_cost],
+                                                       args=[problem_id, elapsed, ALPHA]))
@@ -1,73 +1,88 @@
 import hashlib
-import json
 import logging
+import time
 from urllib.parse import urljoin
 
 import requests
+from django.conf import settings
 from django.db import transaction, IntegrityError
 from django.db.models import F
 
-from account.models import User
+from account.models import User, UserProfile
 from conf.models import JudgeServer
+from contest import recompute, scoreboard
 from contest.models import ContestRuleType, ACMContestRank, OIContestRank, ContestStatus
+from judge import cost, verdict_cache, waiting_queue
+from judge.allocator import get_slot_allocator
+from judge.connection import session_pool
 from options.options import SysOptions
-from problem.models import Problem, ProblemRuleType
+from problem import counters
+from problem.models import Problem, ProblemRuleType, UserProblemStatus
 from problem.utils import parse_problem_template
+from submission import events
 from submission.models import JudgeStatus, Submission
-from utils.cache import cache
-from utils.constants import CacheKey
+from utils.cache import acquire_lock, release_lock
+from utils.constants import CacheKey, JudgePriority
 
 logger = logging.getLogger(__name__)
 
 
-# 继续处理在队列中的问题
+# 继续处理在队列中的问题, 按照所有判题服务器的空闲槽位数一次性取出任务并重新发送
 def process_pending_task():
-    if cache.llen(CacheKey.waiting_queue):
+    if not any(waiting_queue.depth().values()):
+        return
+    # 同一时间只有一个进程在分发, 防止多个进程按照同样的空闲槽位数重复取任务
+    token = acquire_lock(CacheKey.waiting_queue_drain_lock, timeout=5)
+    if not token:
+        return
+    try:
+        free_slots = get_slot_allocator().free_slots()
+        if free_slots <= 0:
+            return
         # 防止循环引入
         from judge.tasks import judge_task
-        tmp_data = cache.rpop(CacheKey.waiting_queue)
-        if tmp_data:
-            data = json.loads(tmp_data.decode("utf-8"))
-            judge_task.send(**data)
+        for item in waiting_queue.pop(free_slots):
+            judge_task.send(**item)
+    finally:
+        release_lock(CacheKey.waiting_queue_drain_lock, token)
+
 
-# 选择一个可用的JudgeServer并进行任务调度
+# 选择一个可用的JudgeServer并进行任务调度, 具体的槽位分配策略见 judge.allocator
 class ChooseJudgeServer:
-    def __init__(self):
+    def __init__(self, estimated_cost=cost.DEFAULT_COST, affinity_key=None):
         self.server = None
+        self.estimated_cost = estimated_cost
+        self.affinity_key = affinity_key
+        self.allocator = get_slot_allocator()
 
     def __enter__(self) -> [JudgeServer, None]:
-        with transaction.atomic():
-            servers = JudgeServer.objects.select_for_update().filter(is_disabled=False).order_by("task_number")
-            servers = [s for s in servers if s.status == "normal"]
-            for server in servers:
-                if server.task_number <= server.cpu_core * 2:
-                    server.task_number = F("task_number") + 1
-                    server.save(update_fields=["task_number"])
-                    self.server = server
-                    return server
-        return None
+        self.server = self.allocator.acquire(self.estimated_cost, self.affinity_key)
+        return self.server
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.server:
-            JudgeServer.objects.filter(id=self.server.id).update(task_number=F("task_number") - 1)
+            self.allocator.release(self.server, self.estimated_cost)
+
 
 # 基础的调度类，负责和judge服务器进行通信
 class DispatcherBase(object):
     def __init__(self):
         self.token = hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest()
 
-    def _request(self, url, data=None):
+    def _request(self, server, url, data=None):
         kwargs = {"headers": {"X-Judge-Server-Token": self.token}}
         if data:
             kwargs["json"] = data
         try:
-            response = requests.post(url, **kwargs, timeout=30)
+            response = session_pool.post(server, url, **kwargs, timeout=30)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.Timeout:
             logger.error(f"Judge server request timeout: {url}")
             return None
         except requests.exceptions.ConnectionError as e:
+            # 丢弃该服务器的长连接, 下次请求重新建立
+            session_pool.evict(server.hostname)
             logger.error(f"Judge server connection error: {url}, error: {str(e)}")
             return None
         except requests.exceptions.RequestException as e:
@@ -96,7 +111,7 @@ class SPJCompiler(DispatcherBase):
         with ChooseJudgeServer() as server:
             if not server:
                 return "No available judge_server"
-            result = self._request(urljoin(server.service_url, "compile_spj"), data=self.data)
+            result = self._request(server, urljoin(server.service_url, "compile_spj"), data=self.data)
             if not result:
                 return "Failed to call judge server"
             if result["err"]:
@@ -104,8 +119,15 @@ class SPJCompiler(DispatcherBase):
 
 # 判题调度类
 class JudgeDispatcher(DispatcherBase):
-    def __init__(self, submission_id, problem_id):
+    def __init__(self, submission_id, problem_id, priority=JudgePriority.PRACTICE, queued_at=None):
         super().__init__()
+        self.priority = priority
+        self.verdict_cache_key = None
+        # 预估的判题耗时, 和实际调用判题服务器的耗时
+        self.estimated_cost = cost.DEFAULT_COST
+        self.judge_time = None
+        # 不为空说明该任务是从等待队列中取出的
+        self.queued_at = queued_at
         self.submission = Submission.objects.get(id=submission_id)
         self.contest_id = self.submission.contest_id
         self.last_result = self.submission.result if self.submission.info else None
@@ -137,8 +159,8 @@ class JudgeDispatcher(DispatcherBase):
                 return
             self.submission.statistic_info["score"] = score
 
-    def judge(self):
-        # 判题流程，包括语言选择、SPJ处理、请求judge server等
+    def _build_judge_data(self):
+        # 判题流程，包括语言选择、SPJ处理等
         language = self.submission.language
         sub_config = list(filter(lambda item: language == item["name"], SysOptions.languages))[0]
         spj_config = {}
@@ -147,7 +169,7 @@ class JudgeDispatcher(DispatcherBase):
                 if lang["name"] == self.problem.spj_language:
                     spj_config = lang["spj"]
                     break
-        
+
         # 根据问题模板和语言构建代码
         if language in self.problem.template:
             template = parse_problem_template(self.problem.template[language])
@@ -156,7 +178,7 @@ class JudgeDispatcher(DispatcherBase):
             code = self.submission.code
 
         # 构造请求数据
-        data = {
+        return {
             "language_config": sub_config["config"],
             "src": code,
             "max_cpu_time": self.problem.time_limit,
@@ -170,19 +192,68 @@ class JudgeDispatcher(DispatcherBase):
             "io_mode": self.problem.io_mode
         }
 
+    def judge(self):
+        data = self._build_judge_data()
+
+        # 完全相同的代码在题目未修改时直接复用之前的判题结果, 不需要占用判题服务器;
+        # 重判一定要重新运行, 结果仍然写入缓存
+        self.verdict_cache_key = verdict_cache.make_key(self.problem.id, data)
+        resp = None if self.priority == JudgePriority.REJUDGE else verdict_cache.lookup(self.verdict_cache_key)
+        if resp:
+            self.verdict_cache_key = None
+            return self.process_judge_response(resp)
+
+        # 优先级不低于当前任务的队列中还有任务在等待时, 新任务排到队尾, 保证高优先级的任务先被处理
+        if self.queued_at is None and waiting_queue.has_backlog(self.priority):
+            waiting_queue.push(self.submission.id, self.problem.id, self.priority)
+            process_pending_task()
+            return
+
+        self.estimated_cost = cost.estimate(self.problem.id)
+        if settings.JUDGE_DISPATCH_MODE == "async":
+            return self._judge_async(data)
+
         # 调用判题服务器进行判题
-        with ChooseJudgeServer() as server:
+        with ChooseJudgeServer(self.estimated_cost, self.problem.test_case_id) as server:
             if not server:
-                data = {"submission_id": self.submission.id, "problem_id": self.problem.id}
-                cache.lpush(CacheKey.waiting_queue, json.dumps(data))
+                waiting_queue.push(self.submission.id, self.problem.id, self.priority, self.queued_at)
                 return
-            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
-            resp = self._request(urljoin(server.service_url, "/judge"), data=data)
+            self._set_result(JudgeStatus.JUDGING)
+            start = time.time()
+            resp = self._request(server, urljoin(server.service_url, "/judge"), data=data)
+            self.judge_time = time.time() - start
+        self.process_judge_response(resp)
+
+    def _judge_async(self, data):
+        # 槽位在判题服务器返回结果后由 async_judge_runner 释放, worker 线程不等待判题结束
+        from judge.async_dispatcher import async_judge_runner
+        allocator = get_slot_allocator()
+        server = allocator.acquire(self.estimated_cost, self.problem.test_case_id)
+        if not server:
+            waiting_queue.push(self.submission.id, self.problem.id, self.priority, self.queued_at)
+            return
+        try:
+            self._set_result(JudgeStatus.JUDGING)
+            async_judge_runner.submit(self, server, urljoin(server.service_url, "/judge"), data)
+        except Exception:
+            allocator.release(server, self.estimated_cost)
+            raise
 
+    def _set_result(self, result):
+        Submission.objects.filter(id=self.submission.id).update(result=result)
+        events.publish(self.submission.id, result)
+
+    def process_judge_response(self, resp):
         if not resp:
-            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.SYSTEM_ERROR)
+            self._set_result(JudgeStatus.SYSTEM_ERROR)
             return
 
+        if self.verdict_cache_key:
+            verdict_cache.store(self.verdict_cache_key, resp)
+        # 编译错误的耗时不能代表该题的判题耗时
+        if self.judge_time is not None and not resp["err"]:
+            cost.record(self.problem.id, self.judge_time)
+
         if resp["err"]:
             self.submission.result = JudgeStatus.COMPILE_ERROR
             self.submission.statistic_info["err_info"] = resp["data"]
@@ -201,16 +272,19 @@ class JudgeDispatcher(DispatcherBase):
             else:
                 self.submission.result = JudgeStatus.PARTIALLY_ACCEPTED
         self.submission.save()
+        # 结果写入之后立即通知等待的客户端, 不需要等排名和统计更新完
+        events.publish(self.submission.id, self.submission.result, self.submission.statistic_info)
 
         if self.contest_id:
-            if self.contest.status != ContestStatus.CONTEST_UNDERWAY or \
-                    User.objects.get(id=self.submission.user_id).is_contest_admin(self.contest):
+            # 排名写入 redis 时需要用户名和真实姓名, 一起读取
+            user = User.objects.select_related("userprofile").get(id=self.submission.user_id)
+            if self.contest.status != ContestStatus.CONTEST_UNDERWAY or user.is_contest_admin(self.contest):
                 logger.info(
                     "Contest debug mode, id: " + str(self.contest_id) + ", submission id: " + self.submission.id)
                 return
             with transaction.atomic():
                 self.update_contest_problem_status()
-                self.update_contest_rank()
+                self.update_contest_rank(user)
         else:
             if self.last_result:
                 self.update_problem_status_rejudge()
@@ -220,137 +294,83 @@ class JudgeDispatcher(DispatcherBase):
         # 至此判题结束，尝试处理任务队列中剩余的任务
         process_pending_task()
 
-    def update_problem_status_rejudge(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem.id)
-        with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            if self.last_result != JudgeStatus.ACCEPTED and self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[self.last_result] = problem_info.get(self.last_result, 1) - 1
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "statistic_info"])
-
-            profile = User.objects.select_for_update().get(id=self.submission.user_id).userprofile
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = profile.acm_problems_status.get("problems", {})
-                if acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.acm_problems_status["problems"] = acm_problems_status
-                profile.save(update_fields=["accepted_number", "acm_problems_status"])
+    def _get_problem_status(self, **defaults):
+        """
+        获取并锁定用户在该题目上的做题状态, 返回 (status, created); 不存在时按照 defaults 创建
+        """
+        def get_status():
+            return UserProblemStatus.objects.select_for_update().get(user_id=self.submission.user_id,
+                                                                     problem_id=self.problem.id)
 
-            else:
-                oi_problems_status = profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this tim score
-                    profile.add_score(this_time_score=score,
-                                      last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.oi_problems_status["problems"] = oi_problems_status
-                profile.save(update_fields=["accepted_number", "oi_problems_status"])
+        try:
+            return get_status(), False
+        except UserProblemStatus.DoesNotExist:
+            try:
+                with transaction.atomic():
+                    return UserProblemStatus.objects.create(user_id=self.submission.user_id, problem_id=self.problem.id,
+                                                            contest_id=self.contest_id, **defaults), True
+            except IntegrityError:
+                return get_status(), False
 
-    def update_problem_status(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem.id)
+    def _update_user_problem_status(self, submission_number):
+        is_ac = self.submission.result == JudgeStatus.ACCEPTED
+        score = self.submission.statistic_info.get("score", 0) if self.problem.rule_type == ProblemRuleType.OI else 0
         with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            problem.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "submission_number", "statistic_info"])
-
-            # update_userprofile
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            user_profile.submission_number += 1
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = user_profile.acm_problems_status.get("problems", {})
-                if problem_id not in acm_problems_status:
-                    acm_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.acm_problems_status["problems"] = acm_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "acm_problems_status"])
+            status, created = self._get_problem_status(status=self.submission.result, score=score,
+                                                       first_ac_time=self.submission.create_time if is_ac else None)
+            accepted_number = score_delta = 0
+            if created:
+                accepted_number, score_delta = int(is_ac), score
+            elif status.status != JudgeStatus.ACCEPTED:
+                # minus last time score, add this time score
+                accepted_number, score_delta = int(is_ac), score - status.score
+                status.status = self.submission.result
+                status.score = score
+                if is_ac:
+                    status.first_ac_time = self.submission.create_time
+                status.save(update_fields=["status", "score", "first_ac_time"])
+            UserProfile.objects.filter(user_id=self.submission.user_id).update(
+                submission_number=F("submission_number") + submission_number,
+                accepted_number=F("accepted_number") + accepted_number,
+                total_score=F("total_score") + score_delta)
+
+    def _incr_counters(self, **kwargs):
+        # 在事务中调用时, 事务回滚后 redis 中不能留下没有写入数据库的计数, 所以在提交之后再累加
+        transaction.on_commit(lambda: counters.incr(self.problem.id, **kwargs))
 
-            else:
-                oi_problems_status = user_profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in oi_problems_status:
-                    user_profile.add_score(score)
-                    oi_problems_status[problem_id] = {"status": self.submission.result,
-                                                      "_id": self.problem._id,
-                                                      "score": score}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this time score
-                    user_profile.add_score(this_time_score=score,
-                                           last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.oi_problems_status["problems"] = oi_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "oi_problems_status"])
+    def update_problem_status_rejudge(self):
+        # update problem status
+        self._incr_counters(result=str(self.submission.result), last_result=self.last_result,
+                            accepted_number=int(self.last_result != JudgeStatus.ACCEPTED and
+                                                self.submission.result == JudgeStatus.ACCEPTED))
+        self._update_user_problem_status(submission_number=0)
+
+    def update_problem_status(self):
+        # update problem status
+        self._incr_counters(result=str(self.submission.result), submission_number=1,
+                            accepted_number=int(self.submission.result == JudgeStatus.ACCEPTED))
+        self._update_user_problem_status(submission_number=1)
 
     def update_contest_problem_status(self):
+        is_ac = self.submission.result == JudgeStatus.ACCEPTED
+        score = self.submission.statistic_info.get("score", 0) if self.contest.rule_type == ContestRuleType.OI else 0
         with transaction.atomic():
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            problem_id = str(self.problem.id)
-            if self.contest.rule_type == ContestRuleType.ACM:
-                contest_problems_status = user_profile.acm_problems_status.get("contest_problems", {})
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                elif contest_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                else:
+            status, created = self._get_problem_status(status=self.submission.result, score=score,
+                                                       first_ac_time=self.submission.create_time if is_ac else None)
+            if not created:
+                if self.contest.rule_type == ContestRuleType.ACM and status.status == JudgeStatus.ACCEPTED:
                     # 如果已AC， 直接跳过 不计入任何计数器
                     return
-                user_profile.acm_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["acm_problems_status"])
-
-            elif self.contest.rule_type == ContestRuleType.OI:
-                contest_problems_status = user_profile.oi_problems_status.get("contest_problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result,
-                                                           "_id": self.problem._id,
-                                                           "score": score}
-                else:
-                    contest_problems_status[problem_id]["score"] = score
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                user_profile.oi_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["oi_problems_status"])
-
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            result = str(self.submission.result)
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem.save(update_fields=["submission_number", "accepted_number", "statistic_info"])
+                status.status = self.submission.result
+                status.score = score
+                if is_ac and not status.first_ac_time:
+                    status.first_ac_time = self.submission.create_time
+                status.save(update_fields=["status", "score", "first_ac_time"])
 
-    def update_contest_rank(self):
-        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank:
-            cache.delete(f"{CacheKey.contest_rank_cache}:{self.contest.id}")
+            self._incr_counters(result=str(self.submission.result), submission_number=1,
+                                accepted_number=int(is_ac))
 
+    def update_contest_rank(self, user):
         def get_rank(model):
             return model.objects.select_for_update().get(user_id=self.submission.user_id, contest=self.contest)
 
@@ -361,6 +381,8 @@ class JudgeDispatcher(DispatcherBase):
             model = OIContestRank
             func = self._update_oi_contest_rank
 
+        # 和重新计算排名互斥, 不同用户的增量更新之间不互斥
+        recompute.lock_contest_ranks(self.contest_id, shared=True)
         try:
             rank = get_rank(model)
         except model.DoesNotExist:
@@ -370,11 +392,22 @@ class JudgeDispatcher(DispatcherBase):
             except IntegrityError:
                 rank = get_rank(model)
         func(rank)
+        # 事务回滚时 redis 中不能留下没有写入数据库的排名, 所以在提交之后再写入
+        is_rank_frozen = self.contest.is_rank_frozen(self.submission.create_time)
+
+        def write_scoreboard():
+            # 封榜后的提交在写入实时排名之前先保存封榜快照
+            if is_rank_frozen:
+                scoreboard.ensure_frozen(self.contest)
+            # 同一用户的多个回调的执行顺序可能和事务提交的顺序不同, 重新加行锁读取已经提交的排名,
+            # 持有行锁写入 redis, 最后一次写入的总是最新的排名
+            with transaction.atomic():
+                scoreboard.update(self.contest, get_rank(model), user=user)
+
+        transaction.on_commit(write_scoreboard)
 
     def _update_acm_contest_rank(self, rank):
         info = rank.submission_info.get(str(self.submission.problem_id))
-        # 因前面更改过，这里需要重新获取
-        problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
         # 此题提交过
         if info:
             if info["is_ac"]:
@@ -387,7 +420,7 @@ class JudgeDispatcher(DispatcherBase):
                 info["ac_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
                 rank.total_time += info["ac_time"] + info["error_number"] * 20 * 60
 
-                if problem.accepted_number == 1:
+                if counters.is_first_accepted(self.problem.id):
                     info["is_first_ac"] = True
             elif self.submission.result != JudgeStatus.COMPILE_ERROR:
                 info["error_number"] += 1
@@ -402,7 +435,7 @@ class JudgeDispatcher(DispatcherBase):
                 info["ac_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
                 rank.total_time += info["ac_time"]
 
-                if problem.accepted_number == 1:
+                if counters.is_first_accepted(self.problem.id):
                     info["is_first_ac"] = True
 
             elif self.submission.result != JudgeStatus.COMPILE_ERROR:
@@ -0,0 +1,126 @@
+import time
+from datetime import datetime
+
+from django.utils import timezone
+
+from conf.models import JudgeServer
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 超过该时间没有心跳的判题服务器视为不可用, 与 JudgeServer.status 保持一致
+HEARTBEAT_TIMEOUT = 6
+# 心跳数据写回数据库的最小间隔
+FLUSH_INTERVAL = 30
+
+# 写回数据库的字段
+STATS_FIELDS = ("judger_version", "cpu_core", "memory_usage", "cpu_usage", "service_url", "ip")
+
+
+def alive_key(hostname):
+    return f"{CacheKey.judge_server_alive}:{hostname}"
+
+
+def _stats_key(hostname):
+    return f"{CacheKey.judge_server_stats}:{hostname}"
+
+
+def mark_alive(pipe, hostname, last_heartbeat):
+    """
+    存活标记的过期时间为 last_heartbeat + HEARTBEAT_TIMEOUT, 过期即说明服务器不可用
+    """
+    ttl = HEARTBEAT_TIMEOUT - (time.time() - last_heartbeat.timestamp())
+    if ttl > 0:
+        pipe.set(alive_key(hostname), 1, px=int(ttl * 1000))
+    else:
+        pipe.delete(alive_key(hostname))
+
+
+def set_disabled(hostname, is_disabled):
+    if is_disabled:
+        cache.sadd(CacheKey.judge_server_disabled, hostname)
+    else:
+        cache.srem(CacheKey.judge_server_disabled, hostname)
+
+
+def record(hostname, **stats):
+    """
+    记录一次心跳, 只写 redis; 返回未保存的 JudgeServer, 用于同步槽位分配器
+    """
+    server = JudgeServer(hostname=hostname, last_heartbeat=timezone.now(),
+                         is_disabled=bool(cache.sismember(CacheKey.judge_server_disabled, hostname)), **stats)
+    pipe = cache.pipeline()
+    pipe.hset(_stats_key(hostname), mapping=dict({k: "" if stats[k] is None else stats[k] for k in STATS_FIELDS},
+                                                 last_heartbeat=server.last_heartbeat.timestamp()))
+    pipe.sadd(CacheKey.judge_server_hosts, hostname)
+    mark_alive(pipe, hostname, server.last_heartbeat)
+    pipe.execute()
+
+    # 每 FLUSH_INTERVAL 秒最多写一次数据库
+    if cache.set(CacheKey.judge_server_flush_lock, 1, timeout=FLUSH_INTERVAL, nx=True):
+        # 防止循环引入
+        from judge.tasks import flush_judge_server_heartbeat
+        flush_judge_server_heartbeat.send()
+    return server
+
+
+def alive_hostnames():
+    hostnames = sorted(item.decode("utf-8") for item in cache.smembers(CacheKey.judge_server_hosts))
+    if not hostnames:
+        return []
+    alive = cache.mget([alive_key(hostname) for hostname in hostnames])
+    return [hostname for hostname, flag in zip(hostnames, alive) if flag]
+
+
+def last_heartbeats():
+    hostnames = [item.decode("utf-8") for item in cache.smembers(CacheKey.judge_server_hosts)]
+    pipe = cache.pipeline()
+    for hostname in hostnames:
+        pipe.hget(_stats_key(hostname), "last_heartbeat")
+    return {hostname: datetime.fromtimestamp(float(value), tz=timezone.utc)
+            for hostname, value in zip(hostnames, pipe.execute()) if value}
+
+
+def remove(hostname):
+    pipe = cache.pipeline()
+    pipe.srem(CacheKey.judge_server_hosts, hostname)
+    pipe.srem(CacheKey.judge_server_disabled, hostname)
+    pipe.delete(_stats_key(hostname), alive_key(hostname))
+    pipe.execute()
+
+
+def flush():
+    """
+    将 redis 中的心跳数据写回 judge_server 表, 供管理后台展示; 同时以数据库为准同步服务器的禁用状态
+    """
+    hostnames = [item.decode("utf-8") for item in cache.smembers(CacheKey.judge_server_hosts)]
+    pipe = cache.pipeline()
+    for hostname in hostnames:
+        pipe.hgetall(_stats_key(hostname))
+    for hostname, stats in zip(hostnames, pipe.execute()):
+        if not stats:
+            continue
+        stats = {k.decode("utf-8"): v.decode("utf-8") for k, v in stats.items()}
+        data = {"judger_version": stats["judger_version"],
+                "cpu_core": int(stats["cpu_core"]),
+                "memory_usage": float(stats["memory_usage"]),
+                "cpu_usage": float(stats["cpu_usage"]),
+                "service_url": stats["service_url"],
+                "ip": stats["ip"] or None,
+                "last_heartbeat": datetime.fromtimestamp(float(stats["last_heartbeat"]), tz=timezone.utc)}
+        # 如果存在多个相同hostname的记录，删除旧的，只保留最新的
+        servers = JudgeServer.objects.filter(hostname=hostname).order_by("-create_time")
+        server = servers.first()
+        if server:
+            JudgeServer.objects.filter(hostname=hostname).exclude(id=server.id).delete()
+            for k, v in data.items():
+                setattr(server, k, v)
+            server.save(update_fields=list(data.keys()))
+        else:
+            JudgeServer.objects.create(hostname=hostname, **data)
+
+    disabled = list(JudgeServer.objects.filter(is_disabled=True).values_list("hostname", flat=True))
+    pipe = cache.pipeline()
+    pipe.delete(CacheKey.judge_server_disabled)
+    if disabled:
+        pipe.sadd(CacheKey.judge_server_disabled, *disabled)
+    pipe.execute()
@@ -2,13 +2,20 @@ import dramatiq
 
 from account.models import User
 from submission.models import Submission
+from judge import heartbeat
 from judge.dispatcher import JudgeDispatcher
+from utils.constants import JudgePriority
 from utils.shortcuts import DRAMATIQ_WORKER_ARGS
 
 
 @dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
-def judge_task(submission_id, problem_id):
+def judge_task(submission_id, problem_id, priority=JudgePriority.PRACTICE, queued_at=None):
     uid = Submission.objects.get(id=submission_id).user_id
     if User.objects.get(id=uid).is_disabled:
         return
-    JudgeDispatcher(submission_id, problem_id).judge()
+    JudgeDispatcher(submission_id, problem_id, priority, queued_at).judge()
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def flush_judge_server_heartbeat():
+    heartbeat.flush()
@@ -0,0 +1,427 @@
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from account.models import UserProfile
+from account.serializers import UserProfileSerializer
+from conf.models import JudgeServer
+from problem.models import UserProblemStatus
+from submission.models import JudgeStatus, Submission
+from submission.tests import SubmissionPrepare
+from utils.cache import acquire_lock, cache, release_lock
+from utils.constants import CacheKey, JudgePriority
+from . import cost, heartbeat, verdict_cache, waiting_queue
+from .allocator import DBSlotAllocator, RedisSlotAllocator
+from .async_dispatcher import AsyncJudgeRunner
+from .connection import JudgeServerSessionPool
+from .dispatcher import JudgeDispatcher, process_pending_task
+
+DEFAULT_JUDGE_SERVER_DATA = {"hostname": "testhostname", "judger_version": "1.0.4", "cpu_core": 1,
+                             "cpu_usage": 90.5, "memory_usage": 80.3, "service_url": "http://127.0.0.1:8080"}
+
+
+class JudgeServerTestMixin:
+    def clear_judge_server_cache(self):
+        cache.delete_many([CacheKey.judge_server_capacity, CacheKey.judge_server_tasks, CacheKey.judge_server_url,
+                           CacheKey.judge_server_load, CacheKey.judge_server_affinity_stats,
+                           CacheKey.judge_server_hosts, CacheKey.judge_server_disabled,
+                           CacheKey.judge_server_flush_lock])
+        cache.delete_pattern(f"{CacheKey.judge_server_alive}:*")
+        cache.delete_pattern(f"{CacheKey.judge_server_stats}:*")
+
+    def create_judge_server(self, **kwargs):
+        data = dict(DEFAULT_JUDGE_SERVER_DATA, last_heartbeat=timezone.now())
+        data.update(kwargs)
+        server = JudgeServer.objects.create(**data)
+        pipe = cache.pipeline()
+        heartbeat.mark_alive(pipe, server.hostname, server.last_heartbeat)
+        pipe.execute()
+        RedisSlotAllocator.sync_server(server)
+        return server
+
+
+class RedisSlotAllocatorTest(JudgeServerTestMixin, TestCase):
+    def setUp(self):
+        self.clear_judge_server_cache()
+        self.allocator = RedisSlotAllocator()
+
+    def tearDown(self):
+        self.clear_judge_server_cache()
+
+    def test_acquire_and_release(self):
+        self.create_judge_server()
+        # cpu_core = 1, 最多同时运行 3 个任务
+        servers = [self.allocator.acquire() for _ in range(3)]
+        self.assertTrue(all(s.service_url == DEFAULT_JUDGE_SERVER_DATA["service_url"] for s in servers))
+        self.assertIsNone(self.allocator.acquire())
+        self.allocator.release(servers[0])
+        self.assertIsNotNone(self.allocator.acquire())
+        self.assertEqual(self.allocator.task_numbers(), {"testhostname": 3})
+
+    def test_choose_least_busy_server(self):
+        self.create_judge_server()
+        self.create_judge_server(hostname="testhostname2", service_url="http://127.0.0.2:8080")
+        first = self.allocator.acquire()
+        second = self.allocator.acquire()
+        self.assertNotEqual(first.hostname, second.hostname)
+
+    def test_choose_server_with_least_outstanding_cost(self):
+        self.create_judge_server()
+        self.create_judge_server(hostname="testhostname2", service_url="http://127.0.0.2:8080")
+        slow = self.allocator.acquire(10)
+        fast = [self.allocator.acquire(1) for _ in range(2)]
+        self.assertTrue(all(s.hostname != slow.hostname for s in fast))
+        self.allocator.release(slow, 10)
+        self.assertEqual(self.allocator.acquire(1).hostname, slow.hostname)
+
+    @override_settings(JUDGE_AFFINITY_SERVERS=1)
+    def test_test_case_affinity(self):
+        for i in range(3):
+            self.create_judge_server(hostname=f"testhostname{i}", service_url=f"http://127.0.0.{i}:8080")
+        # cpu_core = 1, 首选服务器最多同时运行 3 个任务, 之后使用其他服务器
+        servers = [self.allocator.acquire(affinity_key="test_case_id") for _ in range(4)]
+        self.assertEqual(len({s.hostname for s in servers[:3]}), 1)
+        self.assertNotEqual(servers[3].hostname, servers[0].hostname)
+        self.assertEqual(self.allocator.affinity_stats()["hit"], 3)
+        self.assertEqual(self.allocator.affinity_stats()["miss"], 1)
+
+    def test_skip_abnormal_and_disabled_server(self):
+        self.create_judge_server(last_heartbeat=timezone.now() - timedelta(seconds=30))
+        self.create_judge_server(hostname="testhostname2", is_disabled=True)
+        self.assertIsNone(self.allocator.acquire())
+
+    def test_release_never_below_zero(self):
+        server = self.create_judge_server()
+        self.allocator.release(server)
+        self.assertEqual(self.allocator.task_numbers(), {"testhostname": 0})
+
+    def test_remove_server(self):
+        self.create_judge_server()
+        RedisSlotAllocator.remove_server("testhostname")
+        self.assertIsNone(self.allocator.acquire())
+
+
+class DBSlotAllocatorTest(TestCase):
+    def test_acquire_and_release(self):
+        JudgeServer.objects.create(last_heartbeat=timezone.now(), **DEFAULT_JUDGE_SERVER_DATA)
+        allocator = DBSlotAllocator()
+        server = allocator.acquire()
+        self.assertEqual(JudgeServer.objects.get(id=server.id).task_number, 1)
+        allocator.release(server)
+        self.assertEqual(JudgeServer.objects.get(id=server.id).task_number, 0)
+
+
+class JudgeCostTest(TestCase):
+    def setUp(self):
+        cache.delete(CacheKey.judge_problem_cost)
+
+    def tearDown(self):
+        cache.delete(CacheKey.judge_problem_cost)
+
+    def test_ewma(self):
+        self.assertEqual(cost.estimate(1), cost.DEFAULT_COST)
+        cost.record(1, 10)
+        self.assertEqual(cost.estimate(1), 10)
+        cost.record(1, 0)
+        self.assertAlmostEqual(cost.estimate(1), 10 * (1 - cost.ALPHA))
+
+
+@mock.patch("judge.tasks.flush_judge_server_heartbeat.send")
+class HeartbeatTest(JudgeServerTestMixin, TestCase):
+    def setUp(self):
+        self.clear_judge_server_cache()
+
+    def tearDown(self):
+        self.clear_judge_server_cache()
+
+    def _record(self, **kwargs):
+        data = {"judger_version": "1.0.4", "cpu_core": 1, "memory_usage": 80.3, "cpu_usage": 90.5,
+                "service_url": "http://127.0.0.1:8080", "ip": "127.0.0.1"}
+        data.update(kwargs)
+        server = heartbeat.record("testhostname", **data)
+        RedisSlotAllocator.sync_server(server)
+        return server
+
+    def test_record_without_db_write(self, flush_task):
+        self._record()
+        self._record()
+        self.assertFalse(JudgeServer.objects.exists())
+        self.assertEqual(heartbeat.alive_hostnames(), ["testhostname"])
+        self.assertIsNotNone(RedisSlotAllocator().acquire())
+        # 两次心跳只触发一次写回
+        flush_task.assert_called_once()
+
+    def test_flush(self, flush_task):
+        self._record()
+        heartbeat.flush()
+        self._record(judger_version="2.0.0")
+        heartbeat.flush()
+        server = JudgeServer.objects.get(hostname="testhostname")
+        self.assertEqual((server.judger_version, server.ip), ("2.0.0", "127.0.0.1"))
+
+    def test_disabled_server(self, flush_task):
+        self._record()
+        heartbeat.flush()
+        JudgeServer.objects.update(is_disabled=True)
+        heartbeat.flush()
+        self._record()
+        self.assertIsNone(RedisSlotAllocator().acquire())
+
+    def test_expired(self, flush_task):
+        self._record()
+        cache.delete(heartbeat.alive_key("testhostname"))
+        self.assertEqual(heartbeat.alive_hostnames(), [])
+        self.assertIsNone(RedisSlotAllocator().acquire())
+
+
+class WaitingQueueTestMixin:
+    def clear_waiting_queue(self):
+        cache.delete_many([f"{CacheKey.waiting_queue}:{p}" for p in JudgePriority.choices()] +
+                          [CacheKey.waiting_queue_drain_lock])
+
+
+class WaitingQueueTest(WaitingQueueTestMixin, TestCase):
+    def setUp(self):
+        self.clear_waiting_queue()
+
+    def tearDown(self):
+        self.clear_waiting_queue()
+
+    def test_higher_priority_first(self):
+        waiting_queue.push("1", 1, JudgePriority.REJUDGE)
+        waiting_queue.push("2", 1, JudgePriority.PRACTICE)
+        waiting_queue.push("3", 1, JudgePriority.CONTEST)
+        waiting_queue.push("4", 1, JudgePriority.CONTEST)
+        self.assertEqual([item["submission_id"] for item in waiting_queue.pop(3)], ["3", "4", "2"])
+        self.assertEqual(waiting_queue.depth()[JudgePriority.REJUDGE], 1)
+
+    def test_starvation_protection(self):
+        waiting_queue.push("1", 1, JudgePriority.SELF_TEST, queued_at=time.time() - waiting_queue.STARVATION_TIMEOUT - 1)
+        waiting_queue.push("2", 1, JudgePriority.CONTEST)
+        self.assertEqual([item["submission_id"] for item in waiting_queue.pop(1)], ["1"])
+
+    def test_requeue_to_front(self):
+        waiting_queue.push("1", 1, JudgePriority.PRACTICE)
+        item = waiting_queue.pop(1)[0]
+        waiting_queue.push("2", 1, JudgePriority.PRACTICE)
+        waiting_queue.push(item["submission_id"], 1, JudgePriority.PRACTICE, queued_at=item["queued_at"])
+        self.assertEqual(waiting_queue.pop(1)[0]["submission_id"], "1")
+
+    def test_has_backlog(self):
+        waiting_queue.push("1", 1, JudgePriority.PRACTICE)
+        self.assertFalse(waiting_queue.has_backlog(JudgePriority.CONTEST))
+        self.assertTrue(waiting_queue.has_backlog(JudgePriority.PRACTICE))
+        self.assertTrue(waiting_queue.has_backlog(JudgePriority.REJUDGE))
+
+
+@mock.patch("judge.tasks.judge_task.send")
+class ProcessPendingTaskTest(JudgeServerTestMixin, WaitingQueueTestMixin, TestCase):
+    def setUp(self):
+        self.clear_judge_server_cache()
+        self.clear_waiting_queue()
+        for i in range(5):
+            waiting_queue.push(str(i), i, JudgePriority.PRACTICE)
+
+    def tearDown(self):
+        self.clear_judge_server_cache()
+        self.clear_waiting_queue()
+
+    def test_drain_up_to_free_slots(self, judge_task):
+        self.create_judge_server()
+        process_pending_task()
+        self.assertEqual([c.kwargs["submission_id"] for c in judge_task.call_args_list], ["0", "1", "2"])
+        self.assertEqual(waiting_queue.depth()[JudgePriority.PRACTICE], 2)
+
+    def test_no_free_slots(self, judge_task):
+        process_pending_task()
+        judge_task.assert_not_called()
+        self.assertEqual(waiting_queue.depth()[JudgePriority.PRACTICE], 5)
+
+    def test_skip_when_another_worker_is_draining(self, judge_task):
+        self.create_judge_server()
+        cache.set(CacheKey.waiting_queue_drain_lock, 1, timeout=5)
+        process_pending_task()
+        judge_task.assert_not_called()
+
+    def test_release_only_own_drain_lock(self, judge_task):
+        token = acquire_lock(CacheKey.waiting_queue_drain_lock, timeout=5)
+        # 锁过期之后被其他进程重新获取, 原先的持有者不能删除
+        cache.set(CacheKey.waiting_queue_drain_lock, token + 1, timeout=5)
+        release_lock(CacheKey.waiting_queue_drain_lock, token)
+        self.assertEqual(cache.get(CacheKey.waiting_queue_drain_lock), token + 1)
+        release_lock(CacheKey.waiting_queue_drain_lock, token + 1)
+        self.assertIsNone(cache.get(CacheKey.waiting_queue_drain_lock))
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b'{"err": null, "data": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class JudgeServerSessionPoolTest(TestCase):
+    def setUp(self):
+        self.http_server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        self.service_url = f"http://127.0.0.1:{self.http_server.server_address[1]}/"
+        self.pool = JudgeServerSessionPool()
+
+    def tearDown(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def test_reuse_connection(self):
+        server = JudgeServer(hostname="testhostname", service_url=self.service_url)
+        for _ in range(3):
+            self.assertEqual(self.pool.post(server, self.service_url + "judge", json={}).json()["err"], None)
+        pooled = self.pool._sessions["testhostname"]
+        self.assertEqual((pooled.requests, pooled.connections), (3, 1))
+
+    def test_evict_when_service_url_changed(self):
+        server = JudgeServer(hostname="testhostname", service_url=self.service_url)
+        self.pool.post(server, self.service_url + "judge", json={})
+        old = self.pool._sessions["testhostname"]
+        server.service_url = self.service_url.replace("127.0.0.1", "localhost")
+        self.pool.post(server, server.service_url + "judge", json={})
+        self.assertIsNot(self.pool._sessions["testhostname"], old)
+
+
+@mock.patch("judge.allocator.get_slot_allocator")
+class AsyncJudgeRunnerTest(TestCase):
+    def setUp(self):
+        self.http_server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        self.service_url = f"http://127.0.0.1:{self.http_server.server_address[1]}/"
+        self.runner = AsyncJudgeRunner(max_inflight=2, bookkeeping_threads=1)
+        self.server = JudgeServer(hostname="testhostname", service_url=self.service_url)
+
+    def tearDown(self):
+        self.runner.shutdown()
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def test_judge_and_release(self, get_slot_allocator):
+        dispatchers = [mock.Mock(token="token") for _ in range(5)]
+        for dispatcher in dispatchers:
+            self.runner.submit(dispatcher, self.server, self.service_url + "judge", {})
+        self.runner.shutdown()
+        for dispatcher in dispatchers:
+            dispatcher.process_judge_response.assert_called_once_with({"err": None, "data": []})
+        self.assertEqual(get_slot_allocator.return_value.release.call_count, 5)
+
+    def test_request_error(self, get_slot_allocator):
+        dispatcher = mock.Mock(token="token", estimated_cost=2.0)
+        self.runner.submit(dispatcher, self.server, "http://127.0.0.1:1/judge", {}).result()
+        dispatcher.process_judge_response.assert_called_once_with(None)
+        get_slot_allocator.return_value.release.assert_called_once_with(self.server, 2.0)
+
+
+@mock.patch("problem.tasks.flush_problem_counters.send_with_options", mock.Mock())
+@mock.patch("judge.dispatcher.JudgeDispatcher._request")
+class VerdictCacheTest(JudgeServerTestMixin, WaitingQueueTestMixin, SubmissionPrepare):
+    def setUp(self):
+        self.clear_judge_server_cache()
+        self.clear_waiting_queue()
+        cache.delete_many([CacheKey.judge_verdict_cache_version, CacheKey.judge_verdict_cache_stats])
+        cache.delete_pattern(f"{CacheKey.judge_verdict_cache}:*")
+        self._create_problem_and_submission()
+        self.create_judge_server()
+
+    def tearDown(self):
+        self.clear_judge_server_cache()
+        self.clear_waiting_queue()
+
+    def _judge_new_submission(self):
+        data = dict(self.submission_data, user_id=self.problem.created_by_id)
+        submission = Submission.objects.create(**data)
+        JudgeDispatcher(submission.id, self.problem.id).judge()
+        return Submission.objects.get(id=submission.id)
+
+    def test_reuse_verdict(self, request):
+        request.return_value = {"err": None, "data": [{"test_case": "1", "result": 0, "cpu_time": 1, "memory": 1}]}
+        self.assertEqual(self._judge_new_submission().result, JudgeStatus.ACCEPTED)
+        self.assertEqual(self._judge_new_submission().result, JudgeStatus.ACCEPTED)
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(verdict_cache.stats()["hit"], 1)
+
+    def test_invalidate_when_problem_changed(self, request):
+        request.return_value = {"err": None, "data": [{"test_case": "1", "result": 0, "cpu_time": 1, "memory": 1}]}
+        self._judge_new_submission()
+        verdict_cache.invalidate(self.problem.id)
+        self._judge_new_submission()
+        self.assertEqual(request.call_count, 2)
+
+    def test_skip_system_error(self, request):
+        request.return_value = {"err": None, "data": [{"test_case": "1", "result": 5, "cpu_time": 1, "memory": 1}]}
+        self._judge_new_submission()
+        self._judge_new_submission()
+        self.assertEqual(request.call_count, 2)
+
+    def test_skip_time_limit_exceeded(self, request):
+        request.return_value = {"err": None, "data": [{"test_case": "1", "result": JudgeStatus.CPU_TIME_LIMIT_EXCEEDED,
+                                                       "cpu_time": 1000, "memory": 1}]}
+        self._judge_new_submission()
+        self._judge_new_submission()
+        self.assertEqual(request.call_count, 2)
+
+    def test_rejudge_skips_cache(self, request):
+        request.return_value = {"err": None, "data": [{"test_case": "1", "result": 0, "cpu_time": 1, "memory": 1}]}
+        submission = self._judge_new_submission()
+        JudgeDispatcher(submission.id, self.problem.id, priority=JudgePriority.REJUDGE).judge()
+        self.assertEqual(request.call_count, 2)
+
+
+@mock.patch("problem.tasks.flush_problem_counters.send_with_options", mock.Mock())
+@mock.patch("judge.dispatcher.JudgeDispatcher._request")
+class UserProblemStatusTest(JudgeServerTestMixin, WaitingQueueTestMixin, SubmissionPrepare):
+    def setUp(self):
+        self.clear_judge_server_cache()
+        self.clear_waiting_queue()
+        cache.delete_pattern(f"{CacheKey.judge_verdict_cache}:*")
+        self._create_problem_and_submission()
+        self.create_judge_server()
+        self.user = self.problem.created_by
+
+    def tearDown(self):
+        self.clear_judge_server_cache()
+        self.clear_waiting_queue()
+
+    def _judge_with_result(self, request, result, code):
+        request.return_value = {"err": None, "data": [{"test_case": "1", "result": result, "cpu_time": 1, "memory": 1}]}
+        data = dict(self.submission_data, user_id=self.user.id, code=code)
+        submission = Submission.objects.create(**data)
+        JudgeDispatcher(submission.id, self.problem.id).judge()
+        return submission
+
+    def test_update_status(self, request):
+        self._judge_with_result(request, JudgeStatus.WRONG_ANSWER, "wa")
+        status = UserProblemStatus.objects.get(user=self.user, problem=self.problem)
+        self.assertEqual((status.status, status.first_ac_time), (JudgeStatus.WRONG_ANSWER, None))
+
+        submission = self._judge_with_result(request, JudgeStatus.ACCEPTED, "ac")
+        self._judge_with_result(request, JudgeStatus.WRONG_ANSWER, "wa again")
+        status = UserProblemStatus.objects.get(user=self.user, problem=self.problem)
+        self.assertEqual((status.status, status.first_ac_time), (JudgeStatus.ACCEPTED, submission.create_time))
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.submission_number, profile.accepted_number), (3, 1))
+
+    def test_profile_problems_status(self, request):
+        self._judge_with_result(request, JudgeStatus.ACCEPTED, "ac")
+        data = UserProfileSerializer(UserProfile.objects.get(user=self.user)).data
+        self.assertEqual(data["acm_problems_status"]["problems"],
+                         {str(self.problem.id): {"status": JudgeStatus.ACCEPTED, "_id": self.problem._id}})
@@ -0,0 +1,52 @@
+import hashlib
+import json
+
+from submission.models import JudgeStatus
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 判题结果缓存的过期时间
+CACHE_TIMEOUT = 3600 * 24 * 7
+# 和判题服务器的负载无关的测试点结果, 超时、超内存、运行错误可能是判题服务器繁忙导致的, 不缓存
+DETERMINISTIC_RESULTS = (JudgeStatus.ACCEPTED, JudgeStatus.WRONG_ANSWER)
+
+
+def _version(problem_id):
+    return int(cache.hget(CacheKey.judge_verdict_cache_version, problem_id) or 0)
+
+
+def make_key(problem_id, data):
+    """
+    data 为发送给判题服务器的请求数据, 包含拼接模板后的代码、语言配置、时间和内存限制、test_case_id、spj_version、io_mode 等;
+    题目被修改后版本号增加, 之前的缓存全部失效
+    """
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{CacheKey.judge_verdict_cache}:{problem_id}:{_version(problem_id)}:{digest}"
+
+
+def lookup(key):
+    resp = cache.get(key)
+    cache.hincrby(CacheKey.judge_verdict_cache_stats, "hit" if resp else "miss", 1)
+    return resp
+
+
+def store(key, resp):
+    # 只缓存确定性的结果: 编译错误, 或者所有测试点都是通过或答案错误
+    if not resp or resp["err"] not in (None, "CompileError"):
+        return
+    if not resp["err"] and any(item["result"] not in DETERMINISTIC_RESULTS for item in resp["data"]):
+        return
+    cache.set(key, resp, timeout=CACHE_TIMEOUT)
+
+
+def invalidate(problem_id):
+    cache.hincrby(CacheKey.judge_verdict_cache_version, problem_id, 1)
+
+
+def stats():
+    ret = {k.decode("utf-8"): int(v) for k, v in cache.hgetall(CacheKey.judge_verdict_cache_stats).items()}
+    ret.setdefault("hit", 0)
+    ret.setdefault("miss", 0)
+    total = ret["hit"] + ret["miss"]
+    ret["hit_rate"] = ret["hit"] / total if total else None
+    return ret
@@ -0,0 +1,80 @@
+import json
+import time
+
+from utils.cache import cache
+from utils.constants import CacheKey, JudgePriority
+
+# 低优先级的任务等待超过该时间后, 会在下一次分发时优先于高优先级的任务
+STARVATION_TIMEOUT = 120
+
+# KEYS: 按照优先级从高到低排列的等待队列
+# ARGV: count, now, starvation timeout
+# 原子地取出 count 个任务, 高优先级的先出队, 同一优先级先进先出;
+# 若某个队列最早的任务已经等待超过 starvation timeout, 则优先取出该任务, 防止低优先级任务饿死
+_POP_SCRIPT = """
+local count = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local timeout = tonumber(ARGV[3])
+local ret = {}
+for _ = 1, count do
+    local chosen
+    for i = 1, #KEYS do
+        local head = redis.call("LINDEX", KEYS[i], -1)
+        if head then
+            if chosen == nil then
+                chosen = KEYS[i]
+            end
+            if now - cjson.decode(head)["queued_at"] > timeout then
+                chosen = KEYS[i]
+                break
+            end
+        end
+    end
+    if chosen == nil then
+        break
+    end
+    ret[#ret + 1] = redis.call("RPOP", chosen)
+end
+return ret
+"""
+
+
+def _key(priority):
+    return f"{CacheKey.waiting_queue}:{priority}"
+
+
+def push(submission_id, problem_id, priority, queued_at=None):
+    """
+    将任务放入对应优先级的等待队列, queued_at 不为空说明任务是从等待队列中取出后又放回的, 放回队首
+    """
+    data = json.dumps({"submission_id": submission_id, "problem_id": problem_id,
+                       "priority": priority, "queued_at": queued_at or time.time()})
+    if queued_at:
+        cache.rpush(_key(priority), data)
+    else:
+        cache.lpush(_key(priority), data)
+
+
+def pop(count):
+    items = cache.register_script(_POP_SCRIPT)(keys=[_key(p) for p in JudgePriority.choices()],
+                                               args=[count, time.time(), STARVATION_TIMEOUT])
+    return [json.loads(item.decode("utf-8")) for item in items]
+
+
+def has_backlog(priority):
+    """
+    优先级不低于 priority 的队列中是否还有任务在等待
+    """
+    priorities = JudgePriority.choices()
+    pipe = cache.pipeline()
+    for item in priorities[:priorities.index(priority) + 1]:
+        pipe.llen(_key(item))
+    return any(pipe.execute())
+
+
+def depth():
+    priorities = JudgePriority.choices()
+    pipe = cache.pipeline()
+    for item in priorities:
+        pipe.llen(_key(item))
+    return dict(zip(priorities, pipe.execute()))
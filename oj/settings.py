@@ -225,7 +225,8 @@ DRAMATIQ_BROKER = {
         "dramatiq.middleware.Callbacks",
         "dramatiq.middleware.Retries",
         # "django_dramatiq.middleware.AdminMiddleware",
-        "django_dramatiq.middleware.DbConnectionsMiddleware"
+        "django_dramatiq.middleware.DbConnectionsMiddleware",
+        "judge.async_dispatcher.AsyncJudgeMiddleware"
     ]
 }
 
@@ -245,4 +246,20 @@ RAVEN_CONFIG = {
 
 IP_HEADER = "HTTP_X_REAL_IP"
 
+# redis: 通过 redis 原子操作分配判题槽位; db: 对 judge_server 加行锁, 适用于单机部署
+JUDGE_SLOT_ALLOCATOR = get_env("JUDGE_SLOT_ALLOCATOR", "redis")
+# 每个题目 (test_case_id) 优先分配到的判题服务器数量, 0 表示不按照题目选择服务器
+JUDGE_AFFINITY_SERVERS = int(get_env("JUDGE_AFFINITY_SERVERS", "2"))
+
+# sync: worker 线程同步等待判题结果; async: 由每个 worker 进程内的事件循环并发等待判题结果
+JUDGE_DISPATCH_MODE = get_env("JUDGE_DISPATCH_MODE", "sync")
+# async 模式下单个 worker 进程最多同时进行的判题请求数
+JUDGE_ASYNC_MAX_INFLIGHT = int(get_env("JUDGE_ASYNC_MAX_INFLIGHT", "256"))
+# async 模式下处理判题结果 (写数据库) 的线程数
+JUDGE_ASYNC_BOOKKEEPING_THREADS = int(get_env("JUDGE_ASYNC_BOOKKEEPING_THREADS", "4"))
+
+# 每个进程同时保持的判题状态推送 (SSE 和长轮询) 连接数. gthread 进程中每个连接占用一个线程, 只能很少;
+# 由单独的 gevent 进程处理 /api/submission_events 时可以很大, 见 deploy/supervisord.conf
+SUBMISSION_EVENT_MAX_CONNECTIONS = int(get_env("SUBMISSION_EVENT_MAX_CONNECTIONS", "2"))
+
 DEFAULT_AUTO_FIELD='django.db.models.AutoField'
\ No newline at end of file
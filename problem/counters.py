@@ -0,0 +1,143 @@
+import logging
+
+from django.db import transaction
+from django.db.models import F
+
+from utils.cache import acquire_lock, cache, release_lock
+from utils.constants import CacheKey
+from .models import Problem
+
+logger = logging.getLogger(__name__)
+
+# 计数写回数据库的间隔 (秒)
+FLUSH_INTERVAL = 10
+
+SUBMISSION_NUMBER = "submission_number"
+ACCEPTED_NUMBER = "accepted_number"
+RESULT_PREFIX = "result:"
+
+
+def _key(problem_id):
+    return f"{CacheKey.problem_counter}:{problem_id}"
+
+
+def incr(problem_id, result=None, last_result=None, submission_number=0, accepted_number=0):
+    """
+    在 redis 中累加题目的提交数、通过数和各个判题结果的数量, 由 flush_problem_counters 批量写回数据库;
+    last_result 不为空说明是重判, 对应判题结果的数量减一
+    """
+    key = _key(problem_id)
+    pipe = cache.pipeline()
+    if accepted_number:
+        pipe.hincrby(key, ACCEPTED_NUMBER, accepted_number)
+    if submission_number:
+        pipe.hincrby(key, SUBMISSION_NUMBER, submission_number)
+    if result is not None:
+        pipe.hincrby(key, f"{RESULT_PREFIX}{result}", 1)
+    if last_result is not None:
+        pipe.hincrby(key, f"{RESULT_PREFIX}{last_result}", -1)
+    pipe.sadd(CacheKey.problem_counter_dirty, problem_id)
+    pipe.execute()
+
+    # 第一次累加后延迟 FLUSH_INTERVAL 秒写回, 期间的累加合并为一次数据库更新
+    if cache.set(CacheKey.problem_counter_flush_lock, 1, timeout=FLUSH_INTERVAL, nx=True):
+        _schedule_flush()
+
+
+def _schedule_flush():
+    from problem.tasks import flush_problem_counters
+    flush_problem_counters.send_with_options(delay=FLUSH_INTERVAL * 1000)
+
+
+def _parse(delta):
+    return {k.decode("utf-8"): int(v) for k, v in delta.items()}
+
+
+def get_deltas(problem_ids):
+    pipe = cache.pipeline()
+    for problem_id in problem_ids:
+        pipe.hgetall(_key(problem_id))
+    return {problem_id: _parse(delta) for problem_id, delta in zip(problem_ids, pipe.execute())}
+
+
+def _apply(data, delta):
+    data[SUBMISSION_NUMBER] += delta.get(SUBMISSION_NUMBER, 0)
+    data[ACCEPTED_NUMBER] += delta.get(ACCEPTED_NUMBER, 0)
+    statistic_info = data["statistic_info"]
+    for field, value in delta.items():
+        if field.startswith(RESULT_PREFIX):
+            result = field[len(RESULT_PREFIX):]
+            statistic_info[result] = statistic_info.get(result, 0) + value
+
+
+def merge(items):
+    """
+    将未写回数据库的增量合并到序列化后的题目数据中, 不包含统计信息的数据不做处理
+    """
+    items = [item for item in items if SUBMISSION_NUMBER in item]
+    if not items:
+        return
+    deltas = get_deltas([item["id"] for item in items])
+    for item in items:
+        _apply(item, deltas[item["id"]])
+
+
+def accepted_number(problem_id):
+    """
+    包含未写回数据库的增量的通过数
+    """
+    value = Problem.objects.filter(id=problem_id).values_list(ACCEPTED_NUMBER, flat=True).first() or 0
+    return value + int(cache.hget(_key(problem_id), ACCEPTED_NUMBER) or 0)
+
+
+def is_first_accepted(problem_id):
+    """
+    题目的第一次通过, 在本次提交的 incr 写入之前判断 (JudgeDispatcher 在事务提交之后才调用 incr);
+    setnx 保证并发的情况下只有一次提交被认为是第一次通过
+    """
+    return accepted_number(problem_id) == 0 and \
+        bool(cache.set(f"{CacheKey.problem_first_accepted}:{problem_id}", 1, nx=True))
+
+
+def flush():
+    problem_ids = [int(item) for item in cache.smembers(CacheKey.problem_counter_dirty)]
+    for problem_id in problem_ids:
+        # 读取增量到减去增量之间要持有锁, 否则并发的 flush 会把同一份增量重复写回数据库;
+        # 没有拿到锁的题目留在 dirty 集合中, 由下一次 flush 处理
+        lock_key = f"{CacheKey.problem_counter_flush_lock}:{problem_id}"
+        token = acquire_lock(lock_key, timeout=FLUSH_INTERVAL * 6)
+        if not token:
+            continue
+        try:
+            _flush_problem(problem_id)
+        finally:
+            release_lock(lock_key, token)
+    # 被跳过或者写回失败的题目留在 dirty 集合中, 之后可能没有新的提交触发写回, 需要再安排一次
+    if cache.scard(CacheKey.problem_counter_dirty):
+        _schedule_flush()
+
+
+def _flush_problem(problem_id):
+    cache.srem(CacheKey.problem_counter_dirty, problem_id)
+    delta = _parse(cache.hgetall(_key(problem_id)))
+    if not any(delta.values()):
+        return
+    try:
+        with transaction.atomic():
+            problem = Problem.objects.select_for_update().only("statistic_info").filter(id=problem_id).first()
+            if problem:
+                data = {SUBMISSION_NUMBER: 0, ACCEPTED_NUMBER: 0, "statistic_info": problem.statistic_info}
+                _apply(data, delta)
+                Problem.objects.filter(id=problem_id).update(
+                    submission_number=F(SUBMISSION_NUMBER) + delta.get(SUBMISSION_NUMBER, 0),
+                    accepted_number=F(ACCEPTED_NUMBER) + delta.get(ACCEPTED_NUMBER, 0),
+                    statistic_info=data["statistic_info"])
+    except Exception:
+        logger.exception(f"Failed to flush counters of problem {problem_id}")
+        cache.sadd(CacheKey.problem_counter_dirty, problem_id)
+        return
+    # 写回成功后减去已经写回的部分, 期间新增的累加保留在 redis 中
+    pipe = cache.pipeline()
+    for field, value in delta.items():
+        pipe.hincrby(_key(problem_id), field, -value)
+    pipe.execute()
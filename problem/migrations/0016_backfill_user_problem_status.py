@@ -0,0 +1,54 @@
+from django.db import migrations
+from django.db.models import Min
+
+BATCH_SIZE = 1000
+
+
+def _backfill(UserProblemStatus, Submission, problem_contest, profiles):
+    first_ac_time = {(item["user_id"], item["problem_id"]): item["first_ac_time"]
+                     for item in Submission.objects.filter(result=0, user_id__in=[p.user_id for p in profiles])
+                     .values("user_id", "problem_id").annotate(first_ac_time=Min("create_time"))}
+    rows = []
+    for profile in profiles:
+        for problems_status in (profile.acm_problems_status, profile.oi_problems_status):
+            for key in ("problems", "contest_problems"):
+                for problem_id, info in (problems_status or {}).get(key, {}).items():
+                    problem_id = int(problem_id)
+                    # 题目已经被删除
+                    if problem_id not in problem_contest:
+                        continue
+                    rows.append(UserProblemStatus(user_id=profile.user_id, problem_id=problem_id,
+                                                  contest_id=problem_contest[problem_id],
+                                                  status=info["status"], score=info.get("score") or 0,
+                                                  first_ac_time=first_ac_time.get((profile.user_id, problem_id))
+                                                  if info["status"] == 0 else None))
+    UserProblemStatus.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def backfill_user_problem_status(apps, schema_editor):
+    UserProfile = apps.get_model("account", "UserProfile")
+    Problem = apps.get_model("problem", "Problem")
+    Submission = apps.get_model("submission", "Submission")
+    UserProblemStatus = apps.get_model("problem", "UserProblemStatus")
+
+    problem_contest = dict(Problem.objects.values_list("id", "contest_id"))
+    profiles = []
+    for profile in UserProfile.objects.only("user_id", "acm_problems_status", "oi_problems_status") \
+            .order_by("id").iterator(chunk_size=BATCH_SIZE):
+        profiles.append(profile)
+        if len(profiles) >= BATCH_SIZE:
+            _backfill(UserProblemStatus, Submission, problem_contest, profiles)
+            profiles = []
+    _backfill(UserProblemStatus, Submission, problem_contest, profiles)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('account', '0012_userprofile_language'),
+        ('problem', '0015_userproblemstatus'),
+        ('submission', '0012_auto_20180501_0436'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_user_problem_status, reverse_code=migrations.RunPython.noop)
+    ]
@@ -94,3 +94,22 @@ class Problem(models.Model):
     def add_ac_number(self):
         self.accepted_number = models.F("accepted_number") + 1
         self.save(update_fields=["accepted_number"])
+
+
+class UserProblemStatus(models.Model):
+    """
+    用户在每道题目上的做题状态, 取代 UserProfile.acm_problems_status 和 oi_problems_status
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    # 比赛中的题目, 与 problem.contest 相同
+    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
+    # JudgeStatus
+    status = models.IntegerField()
+    # for OI
+    score = models.IntegerField(default=0)
+    first_ac_time = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = "user_problem_status"
+        unique_together = (("user", "problem"),)
@@ -110,6 +110,15 @@ class BaseProblemSerializer(serializers.ModelSerializer):
             ret[lang] = parse_problem_template(code)["template"]
         return ret
 
+    @classmethod
+    def setup_query(cls, query_set):
+        """
+        列表只读取输出的字段, 不读取测试用例和 SPJ 代码, 创建者只读取 UsernameSerializer 需要的字段
+        """
+        exclude = getattr(cls.Meta, "exclude", ())
+        fields = [field.name for field in Problem._meta.concrete_fields if field.name not in exclude]
+        return query_set.select_related("created_by").only(*fields, "created_by__username").prefetch_related("tags")
+
 
 class ProblemAdminSerializer(BaseProblemSerializer):
     class Meta:
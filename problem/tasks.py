@@ -0,0 +1,9 @@
+import dramatiq
+
+from problem import counters
+from utils.shortcuts import DRAMATIQ_WORKER_ARGS
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def flush_problem_counters():
+    counters.flush()
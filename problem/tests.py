@@ -3,17 +3,21 @@ import hashlib
 import os
 import shutil
 from datetime import timedelta
+from unittest import mock
 from zipfile import ZipFile
 
 from django.conf import settings
 
 from utils.api.tests import APITestCase
+from utils.cache import acquire_lock, cache, release_lock
+from utils.constants import CacheKey
 
 from .models import ProblemTag, ProblemIOMode
 from .models import Problem, ProblemRuleType
 from contest.models import Contest
 from contest.tests import DEFAULT_CONTEST_DATA
 
+from . import counters
 from .views.admin import TestCaseAPI
 from .utils import parse_problem_template
 
@@ -193,6 +197,66 @@ class ProblemAPITest(ProblemCreateTestBase):
         self.assertSuccess(resp)
 
 
+@mock.patch("problem.tasks.flush_problem_counters.send_with_options")
+class ProblemCounterTest(ProblemCreateTestBase):
+    def setUp(self):
+        self.url = self.reverse("problem_api")
+        admin = self.create_admin(login=False)
+        self.problem = self.add_problem(DEFAULT_PROBLEM_DATA, admin)
+        self.create_user("test", "test123")
+        cache.delete_many([f"{CacheKey.problem_counter}:{self.problem.id}", CacheKey.problem_counter_dirty,
+                           CacheKey.problem_counter_flush_lock, f"{CacheKey.problem_first_accepted}:{self.problem.id}"])
+
+    def _get_problem(self):
+        resp = self.client.get(self.url + "?problem_id=" + self.problem._id)
+        self.assertSuccess(resp)
+        data = resp.data["data"]
+        return data["submission_number"], data["accepted_number"], data["statistic_info"]
+
+    def test_merge_and_flush(self, flush_task):
+        counters.incr(self.problem.id, result="0", submission_number=1, accepted_number=1)
+        counters.incr(self.problem.id, result="-1", submission_number=1)
+        flush_task.assert_called_once()
+        self.assertEqual(Problem.objects.get(id=self.problem.id).submission_number, 0)
+        self.assertEqual(self._get_problem(), (2, 1, {"0": 1, "-1": 1}))
+
+        counters.flush()
+        problem = Problem.objects.get(id=self.problem.id)
+        self.assertEqual((problem.submission_number, problem.accepted_number, problem.statistic_info),
+                         (2, 1, {"0": 1, "-1": 1}))
+        # 写回后的数据不会被重复计算
+        self.assertEqual(self._get_problem(), (2, 1, {"0": 1, "-1": 1}))
+
+    def test_rejudge(self, flush_task):
+        counters.incr(self.problem.id, result="-1", submission_number=1)
+        counters.flush()
+        counters.incr(self.problem.id, result="0", last_result=-1, accepted_number=1)
+        self.assertEqual(self._get_problem(), (1, 1, {"0": 1, "-1": 0}))
+
+    def test_skip_locked_problem(self, flush_task):
+        counters.incr(self.problem.id, result="0", submission_number=1, accepted_number=1)
+        lock_key = f"{CacheKey.problem_counter_flush_lock}:{self.problem.id}"
+        token = acquire_lock(lock_key, timeout=10)
+        try:
+            counters.flush()
+        finally:
+            release_lock(lock_key, token)
+        # 正在被其他 flush 写回的题目不会被重复写回, 留给下一次 flush
+        self.assertEqual(Problem.objects.get(id=self.problem.id).submission_number, 0)
+        self.assertEqual(flush_task.call_count, 2)
+        counters.flush()
+        self.assertEqual(Problem.objects.get(id=self.problem.id).submission_number, 1)
+        self.assertEqual(self._get_problem(), (1, 1, {"0": 1}))
+
+    def test_first_accepted(self, flush_task):
+        self.assertTrue(counters.is_first_accepted(self.problem.id))
+        self.assertFalse(counters.is_first_accepted(self.problem.id))
+        counters.incr(self.problem.id, result="0", submission_number=1, accepted_number=1)
+        # 已经有通过的提交时, 即使 setnx 的 key 丢失也不是第一次通过
+        cache.delete(f"{CacheKey.problem_first_accepted}:{self.problem.id}")
+        self.assertFalse(counters.is_first_accepted(self.problem.id))
+
+
 class ContestProblemAdminTest(APITestCase):
     def setUp(self):
         self.url = self.reverse("contest_problem_admin_api")
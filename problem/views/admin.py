@@ -14,10 +14,11 @@ from django.http import StreamingHttpResponse, FileResponse
 from account.decorators import problem_permission_required, ensure_created_by
 from contest.models import Contest, ContestStatus
 from fps.parser import FPSHelper, FPSParser
+from judge import verdict_cache
 from judge.dispatcher import SPJCompiler
 from options.options import SysOptions
 from submission.models import Submission, JudgeStatus
-from utils.api import APIView, CSRFExemptAPIView, validate_serializer, APIError
+from utils.api import APIView, CSRFExemptAPIView, validate_serializer, APIError, invalidate_counts
 from utils.constants import Difficulty
 from utils.shortcuts import rand_str, natural_sort_key
 from utils.tasks import delete_files
@@ -279,6 +280,8 @@ class ProblemAPI(ProblemBase):
         for k, v in data.items():
             setattr(problem, k, v)
         problem.save()
+        # 测试用例、时间和内存限制等可能已经改变, 之前的判题结果缓存失效
+        verdict_cache.invalidate(problem.id)
 
         problem.tags.remove(*problem.tags.all())
         for tag in tags:
@@ -304,6 +307,8 @@ class ProblemAPI(ProblemBase):
         # if os.path.isdir(d):
         #     shutil.rmtree(d, ignore_errors=True)
         problem.delete()
+        # 题目的提交被级联删除
+        invalidate_counts(Submission)
         return self.success()
 
 
@@ -409,6 +414,8 @@ class ContestProblemAPI(ProblemBase):
         for k, v in data.items():
             setattr(problem, k, v)
         problem.save()
+        # 测试用例、时间和内存限制等可能已经改变, 之前的判题结果缓存失效
+        verdict_cache.invalidate(problem.id)
 
         problem.tags.remove(*problem.tags.all())
         for tag in tags:
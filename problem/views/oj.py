@@ -2,9 +2,9 @@ import random
 from django.db.models import Q, Count
 from utils.api import APIView
 from account.decorators import check_contest_permission
-from ..models import ProblemTag, Problem, ProblemRuleType
+from ..models import ProblemTag, Problem, UserProblemStatus
 from ..serializers import ProblemSerializer, TagSerializer, ProblemSafeSerializer
-from contest.models import ContestRuleType
+from .. import counters
 
 
 class ProblemTagAPI(APIView):
@@ -26,24 +26,26 @@ class PickOneAPI(APIView):
         return self.success(problems[random.randint(0, count - 1)]._id)
 
 
+def add_problem_status(user, problems):
+    # 根据做题状态为做过的题目添加标记
+    if not user.is_authenticated:
+        return
+    problems_status = dict(UserProblemStatus.objects.filter(user=user, problem_id__in=[p["id"] for p in problems])
+                           .values_list("problem_id", "status"))
+    for problem in problems:
+        problem["my_status"] = problems_status.get(problem["id"])
+
+
 class ProblemAPI(APIView):
     @staticmethod
     def _add_problem_status(request, queryset_values):
-        if request.user.is_authenticated:
-            profile = request.user.userprofile
-            acm_problems_status = profile.acm_problems_status.get("problems", {})
-            oi_problems_status = profile.oi_problems_status.get("problems", {})
-            # paginate data
-            results = queryset_values.get("results")
-            if results is not None:
-                problems = results
-            else:
-                problems = [queryset_values, ]
-            for problem in problems:
-                if problem["rule_type"] == ProblemRuleType.ACM:
-                    problem["my_status"] = acm_problems_status.get(str(problem["id"]), {}).get("status")
-                else:
-                    problem["my_status"] = oi_problems_status.get(str(problem["id"]), {}).get("status")
+        # paginate data
+        results = queryset_values.get("results")
+        if results is not None:
+            problems = results
+        else:
+            problems = [queryset_values, ]
+        add_problem_status(request.user, problems)
 
     def get(self, request):
         # 问题详情页
@@ -53,6 +55,7 @@ class ProblemAPI(APIView):
                 problem = Problem.objects.select_related("created_by") \
                     .get(_id=problem_id, contest_id__isnull=True, visible=True)
                 problem_data = ProblemSerializer(problem).data
+                counters.merge([problem_data])
                 self._add_problem_status(request, problem_data)
                 return self.success(problem_data)
             except Problem.DoesNotExist:
@@ -62,7 +65,7 @@ class ProblemAPI(APIView):
         if not limit:
             return self.error("Limit is needed")
 
-        problems = Problem.objects.select_related("created_by").filter(contest_id__isnull=True, visible=True)
+        problems = ProblemSerializer.setup_query(Problem.objects.filter(contest_id__isnull=True, visible=True))
         # 按照标签筛选
         tag_text = request.GET.get("tag")
         if tag_text:
@@ -79,20 +82,14 @@ class ProblemAPI(APIView):
             problems = problems.filter(difficulty=difficulty)
         # 根据profile 为做过的题目添加标记
         data = self.paginate_data(request, problems, ProblemSerializer)
+        counters.merge(data["results"])
         self._add_problem_status(request, data)
         return self.success(data)
 
 
 class ContestProblemAPI(APIView):
     def _add_problem_status(self, request, queryset_values):
-        if request.user.is_authenticated:
-            profile = request.user.userprofile
-            if self.contest.rule_type == ContestRuleType.ACM:
-                problems_status = profile.acm_problems_status.get("contest_problems", {})
-            else:
-                problems_status = profile.oi_problems_status.get("contest_problems", {})
-            for problem in queryset_values:
-                problem["my_status"] = problems_status.get(str(problem["id"]), {}).get("status")
+        add_problem_status(request.user, queryset_values)
 
     @check_contest_permission(check_type="problems")
     def get(self, request):
@@ -106,15 +103,17 @@ class ContestProblemAPI(APIView):
                 return self.error("Problem does not exist.")
             if self.contest.problem_details_permission(request.user):
                 problem_data = ProblemSerializer(problem).data
+                counters.merge([problem_data])
                 self._add_problem_status(request, [problem_data, ])
             else:
                 problem_data = ProblemSafeSerializer(problem).data
             return self.success(problem_data)
 
-        contest_problems = Problem.objects.select_related("created_by").filter(contest=self.contest, visible=True)
+        contest_problems = Problem.objects.filter(contest=self.contest, visible=True)
         if self.contest.problem_details_permission(request.user):
-            data = ProblemSerializer(contest_problems, many=True).data
+            data = ProblemSerializer(ProblemSerializer.setup_query(contest_problems), many=True).data
+            counters.merge(data)
             self._add_problem_status(request, data)
         else:
-            data = ProblemSafeSerializer(contest_problems, many=True).data
+            data = ProblemSafeSerializer(ProblemSafeSerializer.setup_query(contest_problems), many=True).data
         return self.success(data)
@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+from .models import JudgeStatus
+
+# 判题还没有结束的状态, 离开这些状态之后不会再有新的消息
+UNFINISHED_RESULTS = (JudgeStatus.PENDING, JudgeStatus.JUDGING)
+# 一个 SSE 连接最长保持的时间 (秒), 超时之后浏览器的 EventSource 会自动重连
+STREAM_TIMEOUT = 60
+# 长轮询最长等待的时间 (秒)
+LONG_POLL_TIMEOUT = 25
+# SSE 连接数已满时建议客户端等待的时间 (秒)
+STREAM_RETRY_AFTER = 5
+# SSE 没有消息时发送心跳的间隔 (秒), 防止连接被代理服务器断开
+HEARTBEAT_INTERVAL = 15
+# EventSource 断开之后重连的等待时间 (毫秒)
+RETRY_INTERVAL = 3000
+# 保留最近多少个提交的状态变化版本号, 更早的变化无法判断时按照全部变化处理
+CHANGE_LOG_SIZE = 100_000
+
+
+# 版本号加一和记录变化在一个脚本中执行, 否则客户端在两者之间读到新的版本号后会永远错过这次变化
+# KEYS: version, changes, channel
+# ARGV: submission_id, change_log_size, message
+_PUBLISH_SCRIPT = """
+local version = redis.call("INCR", KEYS[1])
+redis.call("ZADD", KEYS[2], version, ARGV[1])
+redis.call("ZREMRANGEBYRANK", KEYS[2], 0, -tonumber(ARGV[2]) - 1)
+redis.call("PUBLISH", KEYS[3], ARGV[3])
+return version
+"""
+
+
+def _channel(submission_id):
+    return f"{CacheKey.submission_event}:{submission_id}"
+
+
+def publish(submission_id, result, statistic_info=None):
+    """
+    JudgeDispatcher 修改判题状态之后调用, 通知订阅的客户端并记录这次变化的版本号
+    """
+    message = json.dumps({"id": submission_id, "result": result, "statistic_info": statistic_info or {}})
+    cache.register_script(_PUBLISH_SCRIPT)(
+        keys=[CacheKey.submission_status_version, CacheKey.submission_status_changes, _channel(submission_id)],
+        args=[submission_id, CHANGE_LOG_SIZE, message])
+
+
+def current_version():
+    return cache.get(CacheKey.submission_status_version) or 0
+
+
+def changed_since(submission_ids, version, current):
+    """
+    :param current: 读取提交状态之前的 current_version()
+    :return: 在 version 之后状态变化过的提交 id, 无法判断时 (记录已经被清理或者 Redis 的数据丢失) 返回 None
+    """
+    if version > current:
+        return None
+    key = CacheKey.submission_status_changes
+    if cache.zcard(key) >= CHANGE_LOG_SIZE:
+        oldest = cache.zrange(key, 0, 0, withscores=True)
+        # 被清理的记录的版本号都小于剩下的最小的版本号
+        if oldest and version < oldest[0][1] - 1:
+            return None
+    pipe = cache.pipeline()
+    for submission_id in submission_ids:
+        pipe.zscore(key, submission_id)
+    return {submission_id for submission_id, score in zip(submission_ids, pipe.execute())
+            if score is not None and score > version}
+
+
+class Subscription:
+    """
+    订阅一个提交的状态变化. 需要在从数据库读取当前状态之前订阅, 否则会错过两者之间发布的消息
+    """
+    def __init__(self, submission_id):
+        self.pubsub = cache.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(_channel(submission_id))
+
+    def get(self, timeout):
+        """
+        等待下一条消息, 超时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # 订阅成功的确认消息会被忽略, 此时 get_message 在超时之前就返回 None
+            message = self.pubsub.get_message(timeout=remaining)
+            if message:
+                return json.loads(message["data"])
+
+    def wait_finished(self, state, timeout):
+        """
+        长轮询: 等到判题结束或者超时, 返回最新的状态
+        """
+        deadline = time.monotonic() + timeout
+        while state["result"] in UNFINISHED_RESULTS:
+            message = self.get(deadline - time.monotonic())
+            if message is None:
+                break
+            state = message
+        return state
+
+    def close(self):
+        self.pubsub.close()
+
+
+def _event(state):
+    return f"event: status\ndata: {json.dumps(state)}\n\n"
+
+
+def stream(subscription, state):
+    """
+    SSE: 先发送当前的状态, 之后每次状态变化发送一次, 判题结束或者超时之后关闭连接
+    """
+    yield f"retry: {RETRY_INTERVAL}\n\n"
+    yield _event(state)
+    deadline = time.monotonic() + STREAM_TIMEOUT
+    while state["result"] in UNFINISHED_RESULTS:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        message = subscription.get(min(HEARTBEAT_INTERVAL, remaining))
+        if message is None:
+            yield ": heartbeat\n\n"
+            continue
+        state = message
+        yield _event(state)
+
+
+# 本进程中 SSE 和长轮询同时保持的连接数, 每个连接占用一个 redis 连接
+_slots = threading.BoundedSemaphore(settings.SUBMISSION_EVENT_MAX_CONNECTIONS)
+
+
+@contextmanager
+def subscribe(submission_id):
+    """
+    长轮询: 占用一个连接名额并订阅提交的状态变化, 连接数已满时得到 None
+    """
+    if not _slots.acquire(blocking=False):
+        yield None
+        return
+    subscription = None
+    try:
+        subscription = Subscription(submission_id)
+        yield subscription
+    finally:
+        if subscription is not None:
+            subscription.close()
+        _slots.release()
+
+
+class Stream:
+    """
+    SSE: 占用一个连接名额. StreamingHttpResponse 在请求结束时调用 close,
+    客户端在收到第一条消息之前断开时也会释放名额和订阅
+    """
+    def __init__(self, subscription):
+        self.subscription = subscription
+        self.iterator = None
+        self.closed = False
+
+    @classmethod
+    def open(cls, submission_id):
+        """
+        订阅提交的状态变化, 本进程的连接数已满时返回 None
+        """
+        if not _slots.acquire(blocking=False):
+            return None
+        try:
+            return cls(Subscription(submission_id))
+        except Exception:
+            _slots.release()
+            raise
+
+    def start(self, state):
+        self.iterator = stream(self.subscription, state)
+        return self
+
+    def __iter__(self):
+        return self.iterator
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.iterator is not None:
+            self.iterator.close()
+        self.subscription.close()
+        _slots.release()
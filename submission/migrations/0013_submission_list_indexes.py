@@ -0,0 +1,53 @@
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # 提交表很大, 使用 CREATE INDEX CONCURRENTLY 建索引, 不锁表, 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('submission', '0012_auto_20180501_0436'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(condition=models.Q(contest__isnull=True), fields=['-create_time', '-id'],
+                               name='sub_public_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(condition=models.Q(contest__isnull=True), fields=['result', '-create_time'],
+                               name='sub_public_result_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['problem', '-create_time'], name='sub_problem_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['user_id', '-create_time'], name='sub_user_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['contest', '-create_time'], name='sub_contest_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['contest', 'user_id', '-create_time'], name='sub_contest_user_time_idx'),
+        ),
+        # username__icontains 生成的是 UPPER("username"::text) LIKE UPPER(%s), 索引建在同样的表达式上
+        migrations.RunSQL(
+            sql='CREATE INDEX CONCURRENTLY IF NOT EXISTS sub_username_trgm_idx '
+                'ON submission USING gin (UPPER(username) gin_trgm_ops)',
+            reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS sub_username_trgm_idx',
+        ),
+        # 已经被 sub_user_time_idx 覆盖
+        migrations.AlterField(
+            model_name='submission',
+            name='user_id',
+            field=models.IntegerField(),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # 只修改表结构, 代码在 0015 中分批转换, 在 0016 中删除旧的 code 字段
+
+    dependencies = [
+        ('submission', '0013_submission_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionCode',
+            fields=[
+                ('hash', models.TextField(primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'submission_code',
+            },
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='code_hash',
+            field=models.TextField(null=True),
+        ),
+        # 回滚时先恢复 code 再改回 not null, 所以这里先允许为空
+        migrations.AlterField(
+            model_name='submission',
+            name='code',
+            field=models.TextField(null=True),
+        ),
+    ]
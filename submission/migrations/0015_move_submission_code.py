@@ -0,0 +1,66 @@
+import hashlib
+import zlib
+
+from django.db import migrations
+from psycopg2.extras import execute_values
+
+# 每批转换的提交数量, 每批单独提交, 中断之后重新执行会从没有转换的提交继续
+BATCH_SIZE = 1000
+
+
+def move_code(apps, schema_editor):
+    Submission = apps.get_model("submission", "Submission")
+    SubmissionCode = apps.get_model("submission", "SubmissionCode")
+    last_id = ""
+    while True:
+        rows = list(Submission.objects.filter(id__gt=last_id, code_hash__isnull=True)
+                    .order_by("id").values_list("id", "code")[:BATCH_SIZE])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        codes = {}
+        updates = []
+        for submission_id, code in rows:
+            raw = code.encode("utf-8")
+            code_hash = hashlib.sha256(raw).hexdigest()
+            if code_hash not in codes:
+                codes[code_hash] = SubmissionCode(hash=code_hash, data=zlib.compress(raw), size=len(raw))
+            updates.append((submission_id, code_hash))
+        SubmissionCode.objects.bulk_create(codes.values(), ignore_conflicts=True)
+        with schema_editor.connection.cursor() as cursor:
+            execute_values(cursor, "UPDATE submission SET code_hash = v.hash FROM (VALUES %s) AS v(id, hash) "
+                                   "WHERE submission.id = v.id", updates)
+
+
+def restore_code(apps, schema_editor):
+    """
+    回滚: 把代码写回 code 字段并清空 code_hash, 同样分批执行, 中断之后可以重新执行
+    """
+    Submission = apps.get_model("submission", "Submission")
+    SubmissionCode = apps.get_model("submission", "SubmissionCode")
+    last_id = ""
+    while True:
+        rows = list(Submission.objects.filter(id__gt=last_id, code_hash__isnull=False)
+                    .order_by("id").values_list("id", "code_hash")[:BATCH_SIZE])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        codes = {code_hash: zlib.decompress(data).decode("utf-8") for code_hash, data in
+                 SubmissionCode.objects.filter(hash__in={item[1] for item in rows}).values_list("hash", "data")}
+        updates = [(submission_id, codes[code_hash]) for submission_id, code_hash in rows]
+        with schema_editor.connection.cursor() as cursor:
+            execute_values(cursor, "UPDATE submission SET code = v.code, code_hash = NULL "
+                                   "FROM (VALUES %s) AS v(id, code) WHERE submission.id = v.id", updates)
+
+
+class Migration(migrations.Migration):
+    # 每批数据在自己的事务中执行
+    atomic = False
+
+    dependencies = [
+        ('submission', '0014_submission_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_code, reverse_code=restore_code),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0015_move_submission_code'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='submission',
+            name='code',
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='code_hash',
+            field=models.TextField(),
+        ),
+    ]
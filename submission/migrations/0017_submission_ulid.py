@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import utils.shortcuts
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0016_remove_submission_code'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='id',
+            field=models.TextField(db_index=True, default=utils.shortcuts.ulid, primary_key=True, serialize=False),
+        ),
+    ]
@@ -1,11 +1,14 @@
+import hashlib
+import zlib
+
 from django.db import models
+from django.utils.timezone import now
 
-from utils.constants import ContestStatus
 from utils.models import JSONField
 from problem.models import Problem
 from contest.models import Contest
 
-from utils.shortcuts import rand_str
+from utils.shortcuts import ulid
 
 
 class JudgeStatus:
@@ -22,14 +25,53 @@ class JudgeStatus:
     PARTIALLY_ACCEPTED = 8
 
 
+class SubmissionCode(models.Model):
+    """
+    按照内容的 sha256 去重存储的提交代码, 重复提交和相同的模板只存一份
+    """
+    hash = models.TextField(primary_key=True)
+    # zlib 压缩之后的代码
+    data = models.BinaryField()
+    # 压缩之前的字节数
+    size = models.IntegerField()
+
+    @staticmethod
+    def get_hash(code):
+        return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def store(cls, codes):
+        """
+        :param codes: {hash: code}, 已经存在的代码直接忽略
+        """
+        items = []
+        for code_hash, code in codes.items():
+            raw = code.encode("utf-8")
+            items.append(cls(hash=code_hash, data=zlib.compress(raw), size=len(raw)))
+        cls.objects.bulk_create(items, ignore_conflicts=True)
+
+    @classmethod
+    def load(cls, hashes):
+        """
+        :return: {hash: code}
+        """
+        return {code_hash: zlib.decompress(data).decode("utf-8")
+                for code_hash, data in cls.objects.filter(hash__in=set(hashes)).values_list("hash", "data")}
+
+    class Meta:
+        db_table = "submission_code"
+
+
 class Submission(models.Model):
-    id = models.TextField(default=rand_str, primary_key=True, db_index=True)
+    # 新的提交使用按照时间递增的 ULID, 插入集中在主键索引的一端; 原先 32 位的随机 id 保持不变
+    id = models.TextField(default=ulid, primary_key=True, db_index=True)
     contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
     create_time = models.DateTimeField(auto_now_add=True)
-    user_id = models.IntegerField(db_index=True)
+    user_id = models.IntegerField()
     username = models.TextField()
-    code = models.TextField()
+    # 代码存在 SubmissionCode 中, 通过 code 属性读写
+    code_hash = models.TextField()
     result = models.IntegerField(db_index=True, default=JudgeStatus.PENDING)
     # 从JudgeServer返回的判题详情
     info = JSONField(default=dict)
@@ -40,20 +82,94 @@ class Submission(models.Model):
     statistic_info = JSONField(default=dict)
     ip = models.TextField(null=True)
 
-    def check_user_permission(self, user, check_share=True):
-        if self.user_id == user.id or user.is_super_admin() or user.can_mgmt_all_problem() or self.problem.created_by_id == user.id:
-            return True
+    _code = None
+    _code_changed = False
 
-        if check_share:
-            if self.contest and self.contest.status != ContestStatus.CONTEST_ENDED:
-                return False
-            if self.problem.share_submission or self.shared:
-                return True
-        return False
+    @property
+    def code(self):
+        if self._code is None and self.code_hash:
+            self._code = SubmissionCode.load([self.code_hash]).get(self.code_hash)
+        return self._code
+
+    @code.setter
+    def code(self, value):
+        self._code = value
+        self.code_hash = SubmissionCode.get_hash(value)
+        self._code_changed = True
+
+    @staticmethod
+    def load_code(submissions):
+        """
+        一次查询读取多个提交的代码, 避免逐个读取 code 属性
+        """
+        submissions = [item for item in submissions if item._code is None]
+        codes = SubmissionCode.load(item.code_hash for item in submissions)
+        for item in submissions:
+            item._code = codes.get(item.code_hash)
+
+    def save(self, *args, **kwargs):
+        if self._code_changed:
+            SubmissionCode.store({self.code_hash: self._code})
+            self._code_changed = False
+        super().save(*args, **kwargs)
+
+    def check_user_permission(self, user, check_share=True):
+        return SubmissionPermission(user).check(self, check_share=check_share)
 
     class Meta:
         db_table = "submission"
         ordering = ("-create_time",)
+        # 和提交列表的过滤条件一致, 过滤之后可以直接按照索引顺序取出一页, 不需要对整个表排序
+        # username 的 icontains 查询使用的 trigram 索引见 0013_submission_list_indexes
+        indexes = [
+            models.Index(fields=["-create_time", "-id"], condition=models.Q(contest__isnull=True),
+                         name="sub_public_time_idx"),
+            models.Index(fields=["result", "-create_time"], condition=models.Q(contest__isnull=True),
+                         name="sub_public_result_idx"),
+            models.Index(fields=["problem", "-create_time"], name="sub_problem_time_idx"),
+            models.Index(fields=["user_id", "-create_time"], name="sub_user_time_idx"),
+            models.Index(fields=["contest", "-create_time"], name="sub_contest_time_idx"),
+            models.Index(fields=["contest", "user_id", "-create_time"], name="sub_contest_user_time_idx"),
+        ]
 
     def __str__(self):
         return self.id
+
+
+class SubmissionPermission:
+    """
+    判断用户能否查看提交, 用户的角色和比赛是否结束只计算一次, 提交列表中每一行的判断不再查询数据库.
+    提交的 problem 需要已经读取, 比赛的状态通过 prepare 一次读取或者在构造的时候传入
+    """
+    def __init__(self, user, contests=()):
+        self.user_id = user.id
+        self.is_manager = user.is_super_admin() or user.can_mgmt_all_problem()
+        self.now = now()
+        # contest_id -> 比赛是否已经结束
+        self.contest_ended = {}
+        self.add_contests(contests)
+
+    def add_contests(self, contests):
+        for contest in contests:
+            self.contest_ended[contest.id] = contest.end_time < self.now
+
+    def prepare(self, submissions):
+        contest_ids = {item.contest_id for item in submissions if item.contest_id} - self.contest_ended.keys()
+        if contest_ids:
+            self.add_contests(Contest.objects.filter(id__in=contest_ids).only("id", "end_time"))
+
+    def check(self, submission, check_share=True):
+        problem = submission.problem
+        if submission.user_id == self.user_id or self.is_manager or problem.created_by_id == self.user_id:
+            return True
+
+        if check_share:
+            # 比赛结束之前不能查看别人的提交
+            if submission.contest_id:
+                if submission.contest_id not in self.contest_ended:
+                    self.add_contests([submission.contest])
+                if not self.contest_ended[submission.contest_id]:
+                    return False
+            if problem.share_submission or submission.shared:
+                return True
+        return False
@@ -1,4 +1,4 @@
-from .models import Submission
+from .models import Submission, SubmissionPermission
 from utils.api import serializers
 from utils.serializers import LanguageNameChoiceField
 
@@ -11,6 +11,11 @@ class CreateSubmissionSerializer(serializers.Serializer):
     captcha = serializers.CharField(required=False)
 
 
+class SubmissionStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.CharField(max_length=32), allow_empty=False, max_length=500)
+    version = serializers.IntegerField(required=False, min_value=0)
+
+
 class ShareSubmissionSerializer(serializers.Serializer):
     id = serializers.CharField()
     shared = serializers.BooleanField()
@@ -24,35 +29,62 @@ class AIModifyCodeSerializer(serializers.Serializer):
 
 
 class SubmissionModelSerializer(serializers.ModelSerializer):
+    code = serializers.CharField(read_only=True)
 
     class Meta:
         model = Submission
-        fields = "__all__"
+        exclude = ("code_hash",)
 
 
 # 不显示submission info的serializer, 用于ACM rule_type
 class SubmissionSafeModelSerializer(serializers.ModelSerializer):
     problem = serializers.SlugRelatedField(read_only=True, slug_field="_id")
+    code = serializers.CharField(read_only=True)
 
     class Meta:
         model = Submission
-        exclude = ("info", "contest", "ip")
+        exclude = ("info", "contest", "ip", "code_hash")
+
+
+class SubmissionPermissionListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # 整页的提交一起准备权限判断需要的比赛状态
+        data = list(data)
+        if self.child.permission:
+            self.child.permission.prepare(data)
+        return super().to_representation(data)
 
 
 class SubmissionListSerializer(serializers.ModelSerializer):
     problem = serializers.SlugRelatedField(read_only=True, slug_field="_id")
     show_link = serializers.SerializerMethodField()
 
+    # 列表只读取输出的字段和 SubmissionPermission 需要的字段, 不读取 info 和 ip, 也不 join 题目的创建者
+    query_fields = ("id", "contest", "create_time", "user_id", "username", "result", "language", "shared",
+                    "statistic_info", "problem___id", "problem__created_by", "problem__share_submission")
+
+    @classmethod
+    def setup_query(cls, query_set):
+        return query_set.select_related("problem").only(*cls.query_fields)
+
     def __init__(self, *args, **kwargs):
-        self.user = kwargs.pop("user", None)
+        """
+        :param user: 查看提交的用户, 没传或者是匿名用户时 show_link 都是 false
+        :param contest: 提交所在的比赛, 传入之后不需要再查询比赛的状态
+        """
+        user = kwargs.pop("user", None)
+        contest = kwargs.pop("contest", None)
         super().__init__(*args, **kwargs)
+        self.permission = None
+        if user is not None and user.is_authenticated:
+            self.permission = SubmissionPermission(user, [contest] if contest else [])
 
     class Meta:
         model = Submission
-        exclude = ("info", "contest", "code", "ip")
+        exclude = ("info", "contest", "code_hash", "ip")
+        list_serializer_class = SubmissionPermissionListSerializer
 
     def get_show_link(self, obj):
-        # 没传user或为匿名user
-        if self.user is None or not self.user.is_authenticated:
+        if self.permission is None:
             return False
-        return obj.check_user_permission(self.user)
+        return self.permission.check(obj)
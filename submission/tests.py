@@ -1,9 +1,19 @@
 from copy import deepcopy
+from datetime import timedelta
 from unittest import mock
 
+from django.conf import settings
+from django.utils import timezone
+
+from account.models import User
+from contest.models import Contest
 from problem.models import Problem, ProblemTag
 from utils.api.tests import APITestCase
-from .models import Submission
+from utils.constants import ContestRuleType, JudgePriority
+from utils.shortcuts import ulid
+from . import events
+from .models import JudgeStatus, Submission, SubmissionCode
+from .serializers import SubmissionListSerializer
 
 DEFAULT_PROBLEM_DATA = {"_id": "A-110", "title": "test", "description": "<p>test</p>", "input_description": "test",
                         "output_description": "test", "time_limit": 1000, "memory_limit": 256, "difficulty": "Low",
@@ -56,6 +66,153 @@ class SubmissionListTest(SubmissionPrepare):
         resp = self.client.get(self.url, data={"limit": "10"})
         self.assertSuccess(resp)
 
+    def test_cursor_pagination(self):
+        for _ in range(2):
+            Submission.objects.create(**self.submission_data)
+        expected = list(Submission.objects.order_by("-create_time", "-id").values_list("id", flat=True))
+
+        resp = self.client.get(self.url, data={"limit": "2", "cursor": ""})
+        self.assertSuccess(resp)
+        data = resp.data["data"]
+        self.assertEqual([item["id"] for item in data["results"]], expected[:2])
+        self.assertIsNone(data["prev"])
+
+        resp = self.client.get(self.url, data={"limit": "2", "cursor": data["next"]})
+        data = resp.data["data"]
+        self.assertEqual([item["id"] for item in data["results"]], expected[2:])
+        self.assertIsNone(data["next"])
+
+        resp = self.client.get(self.url, data={"limit": "2", "cursor": data["prev"]})
+        self.assertEqual([item["id"] for item in resp.data["data"]["results"]], expected[:2])
+
+    def test_invalid_cursor(self):
+        resp = self.client.get(self.url, data={"limit": "2", "cursor": "invalid"})
+        self.assertFailed(resp, "Invalid cursor")
+
+    def test_no_total(self):
+        resp = self.client.get(self.url, data={"limit": "10", "no_total": "1"})
+        self.assertSuccess(resp)
+        self.assertIsNone(resp.data["data"]["total"])
+        self.assertFalse(resp.data["data"]["total_exact"])
+        self.assertEqual(len(resp.data["data"]["results"]), 1)
+
+    def test_time_ordered_id(self):
+        with mock.patch("utils.shortcuts.time.time", return_value=1700000000.001):
+            first = ulid()
+        with mock.patch("utils.shortcuts.time.time", return_value=1700000000.002):
+            second = ulid()
+        self.assertEqual(len(first), 26)
+        self.assertLess(first, second)
+        self.assertEqual(len(self.submission.id), 26)
+
+    def test_show_link_without_queries(self):
+        self.problem.share_submission = True
+        self.problem.save()
+        contest = Contest.objects.create(title="test", description="test", rule_type=ContestRuleType.ACM,
+                                         start_time=timezone.now() - timedelta(days=2),
+                                         end_time=timezone.now() - timedelta(days=1),
+                                         password="", allowed_ip_ranges=[], visible=True, real_time_rank=True,
+                                         created_by=self.problem.created_by)
+        Submission.objects.create(contest=contest, **self.submission_data)
+        submissions = list(SubmissionListSerializer.setup_query(Submission.objects.all()))
+        user = User.objects.get(username="123")
+        # 整页只查询一次比赛的状态
+        with self.assertNumQueries(1):
+            data = SubmissionListSerializer(submissions, many=True, user=user).data
+        self.assertTrue(all(item["show_link"] for item in data))
+        with self.assertNumQueries(0):
+            SubmissionListSerializer(submissions, many=True, user=user, contest=contest).data
+
+
+class SubmissionCodeTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+
+    def test_deduplicate_code(self):
+        Submission.objects.create(**self.submission_data)
+        self.assertEqual(SubmissionCode.objects.count(), 1)
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual(submission.code, self.submission_data["code"])
+
+    def test_load_code(self):
+        self.submission_data["code"] = "yyyyyyyyyyyyyy"
+        Submission.objects.create(**self.submission_data)
+        submissions = list(Submission.objects.all())
+        with self.assertNumQueries(1):
+            Submission.load_code(submissions)
+            self.assertEqual({item.code for item in submissions}, {"xxxxxxxxxxxxxx", "yyyyyyyyyyyyyy"})
+
+
+class SubmissionEventTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        self.create_super_admin()
+        self.url = self.reverse("submission_event_api")
+
+    def test_long_poll_finished(self):
+        resp = self.client.get(self.url, data={"id": self.submission.id})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["result"], JudgeStatus.COMPILE_ERROR)
+
+    def test_wait_finished(self):
+        with events.subscribe(self.submission.id) as subscription:
+            events.publish(self.submission.id, JudgeStatus.JUDGING)
+            events.publish(self.submission.id, JudgeStatus.ACCEPTED, {"time_cost": 1})
+            state = subscription.wait_finished({"result": JudgeStatus.PENDING}, timeout=5)
+        self.assertEqual(state["result"], JudgeStatus.ACCEPTED)
+        self.assertEqual(state["statistic_info"], {"time_cost": 1})
+
+    def test_stream(self):
+        stream = events.Stream.open(self.submission.id)
+        events.publish(self.submission.id, JudgeStatus.JUDGING)
+        events.publish(self.submission.id, JudgeStatus.ACCEPTED, {"time_cost": 1})
+        messages = list(stream.start({"id": self.submission.id, "result": JudgeStatus.PENDING}))
+        stream.close()
+        self.assertEqual(len(messages), 4)
+        self.assertIn(f'"result": {JudgeStatus.ACCEPTED}', messages[-1])
+
+    def test_too_many_streams(self):
+        streams = [events.Stream.open(self.submission.id) for _ in range(settings.SUBMISSION_EVENT_MAX_CONNECTIONS)]
+        try:
+            self.assertIsNone(events.Stream.open(self.submission.id))
+            resp = self.client.get(self.url, data={"id": self.submission.id}, HTTP_ACCEPT="text/event-stream")
+            self.assertEqual(resp.status_code, 503)
+            # 长轮询不等待, 直接返回当前状态
+            resp = self.client.get(self.url, data={"id": self.submission.id})
+            self.assertSuccess(resp)
+        finally:
+            for stream in streams:
+                stream.close()
+        # 连接关闭之后释放名额
+        stream = events.Stream.open(self.submission.id)
+        self.assertIsNotNone(stream)
+        stream.close()
+
+
+class SubmissionStatusTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        self.create_super_admin()
+        self.url = self.reverse("submission_status_api")
+
+    def test_get_status(self):
+        resp = self.client.post(self.url, data={"ids": [self.submission.id, "not_exist"]})
+        self.assertSuccess(resp)
+        results = resp.data["data"]["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["result"], self.submission.result)
+
+    def test_changed_since(self):
+        other = Submission.objects.create(**self.submission_data)
+        version = self.client.post(self.url, data={"ids": [self.submission.id]}).data["data"]["version"]
+        events.publish(other.id, JudgeStatus.JUDGING)
+        resp = self.client.post(self.url, data={"ids": [self.submission.id, other.id], "version": version})
+        data = resp.data["data"]
+        self.assertEqual([item["id"] for item in data["results"]], [other.id])
+
+        resp = self.client.post(self.url, data={"ids": [self.submission.id, other.id], "version": data["version"]})
+        self.assertEqual(resp.data["data"]["results"], [])
+
 
 @mock.patch("submission.views.oj.judge_task.send")
 class SubmissionAPITest(SubmissionPrepare):
@@ -69,6 +226,19 @@ class SubmissionAPITest(SubmissionPrepare):
         self.assertSuccess(resp)
         judge_task.assert_called()
 
+    def test_create_submission_invalidates_count(self, judge_task):
+        list_url = self.reverse("submission_list_api")
+        self.assertSuccess(self.client.get(list_url, data={"limit": "10"}))
+        self.assertSuccess(self.client.post(self.url, self.submission_data))
+        # 缓存的总数在创建提交之后失效
+        resp = self.client.get(list_url, data={"limit": "10"})
+        self.assertEqual(resp.data["data"]["total"], Submission.objects.filter(contest_id__isnull=True).count())
+
+    def test_create_submission_with_practice_priority(self, judge_task):
+        resp = self.client.post(self.url, self.submission_data)
+        self.assertSuccess(resp)
+        self.assertEqual(judge_task.call_args.kwargs["priority"], JudgePriority.PRACTICE)
+
     def test_create_submission_with_wrong_language(self, judge_task):
         self.submission_data.update({"language": "Python3"})
         resp = self.client.post(self.url, self.submission_data)
@@ -1,11 +1,14 @@
 from django.conf.urls import url
 
-from ..views.oj import SubmissionAPI, SubmissionListAPI, ContestSubmissionListAPI, SubmissionExistsAPI, AIModifyCodeAPI
+from ..views.oj import (SubmissionAPI, SubmissionListAPI, ContestSubmissionListAPI, SubmissionExistsAPI, AIModifyCodeAPI,
+                        SubmissionEventAPI, SubmissionStatusAPI)
 
 urlpatterns = [
     url(r"^submission/?$", SubmissionAPI.as_view(), name="submission_api"),
     url(r"^submissions/?$", SubmissionListAPI.as_view(), name="submission_list_api"),
     url(r"^submission_exists/?$", SubmissionExistsAPI.as_view(), name="submission_exists"),
+    url(r"^submission_events/?$", SubmissionEventAPI.as_view(), name="submission_event_api"),
+    url(r"^submission_status/?$", SubmissionStatusAPI.as_view(), name="submission_status_api"),
     url(r"^contest_submissions/?$", ContestSubmissionListAPI.as_view(), name="contest_submission_list_api"),
     url(r"^ai_modify_code/?$", AIModifyCodeAPI.as_view(), name="ai_modify_code_api"),
 ]
@@ -2,6 +2,7 @@ from account.decorators import super_admin_required
 from judge.tasks import judge_task
 # from judge.dispatcher import JudgeDispatcher
 from utils.api import APIView
+from utils.constants import JudgePriority
 from ..models import Submission
 
 
@@ -18,5 +19,5 @@ class SubmissionRejudgeAPI(APIView):
         submission.statistic_info = {}
         submission.save()
 
-        judge_task.send(submission.id, submission.problem.id)
+        judge_task.send(submission.id, submission.problem.id, priority=JudgePriority.REJUDGE)
         return self.success()
@@ -1,6 +1,8 @@
 import ipaddress
 import os
 import requests
+from django.db import connection
+from django.http import StreamingHttpResponse
 from openai import OpenAI
 
 from account.decorators import login_required, check_contest_permission
@@ -9,13 +11,15 @@ from judge.tasks import judge_task
 from options.options import SysOptions
 # from judge.dispatcher import JudgeDispatcher
 from problem.models import Problem, ProblemRuleType
-from utils.api import APIView, validate_serializer
+from utils.api import APIView, CountStrategy, invalidate_counts, validate_serializer
 from utils.cache import cache
 from utils.captcha import Captcha
+from utils.constants import JudgePriority
 from utils.throttling import TokenBucket
-from ..models import Submission
+from .. import events
+from ..models import Submission, SubmissionPermission
 from ..serializers import (CreateSubmissionSerializer, SubmissionModelSerializer,
-                           ShareSubmissionSerializer, AIModifyCodeSerializer)
+                           ShareSubmissionSerializer, AIModifyCodeSerializer, SubmissionStatusSerializer)
 from ..serializers import SubmissionSafeModelSerializer, SubmissionListSerializer
 
 # ============================================================================
@@ -61,6 +65,7 @@ class SubmissionAPI(APIView):
     def post(self, request):
         data = request.data
         hide_id = False
+        priority = JudgePriority.PRACTICE
         if data.get("contest_id"):
             error = self.check_contest_permission(request)
             if error:
@@ -68,6 +73,11 @@ class SubmissionAPI(APIView):
             contest = self.contest
             if not contest.problem_details_permission(request.user):
                 hide_id = True
+            # 比赛开始前或管理员的提交只是用来测试题目, 不影响比赛排名
+            if contest.status == ContestStatus.CONTEST_UNDERWAY and not request.user.is_contest_admin(contest):
+                priority = JudgePriority.CONTEST
+            else:
+                priority = JudgePriority.SELF_TEST
 
         if data.get("captcha"):
             if not Captcha(request).check(data["captcha"]):
@@ -103,6 +113,7 @@ class SubmissionAPI(APIView):
                                                problem_id=problem.id,
                                                ip=request.session["ip"],
                                                contest_id=data.get("contest_id"))
+        invalidate_counts(Submission)
         
         # ============================================================================
         # 【改进建议3】：提交后触发异步任务进行代码特征提取和用户画像更新
@@ -114,7 +125,7 @@ class SubmissionAPI(APIView):
         
         # use this for debug
         # JudgeDispatcher(submission.id, problem.id).judge()
-        judge_task.send(submission.id, problem.id)
+        judge_task.send(submission.id, problem.id, priority=priority)
         if hide_id:
             return self.success()
         else:
@@ -172,6 +183,87 @@ class SubmissionAPI(APIView):
         return self.success()
 
 
+def _release_db_connection():
+    """
+    之后只等待 redis 的消息, 提前关闭数据库连接, 否则每个等待中的连接都占用一个数据库连接
+    """
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+class SubmissionEventAPI(APIView):
+    @login_required
+    def get(self, request):
+        """
+        判题状态变化时推送给客户端, Accept 为 text/event-stream 时使用 SSE, 否则为长轮询, 判题结束或者超时后返回当前状态.
+        连接数已满时 SSE 返回 503, 客户端改为长轮询; 长轮询立即返回当前状态
+        """
+        submission_id = request.GET.get("id")
+        if not submission_id:
+            return self.error("Parameter id doesn't exist")
+        try:
+            submission = Submission.objects.select_related("problem").get(id=submission_id)
+        except Submission.DoesNotExist:
+            return self.error("Submission doesn't exist")
+        if not submission.check_user_permission(request.user):
+            return self.error("No permission for this submission")
+
+        state_query = Submission.objects.filter(id=submission.id).values("id", "result", "statistic_info")
+        if "text/event-stream" not in request.META.get("HTTP_ACCEPT", ""):
+            with events.subscribe(submission.id) as subscription:
+                # 订阅之后再读取状态, 在这之后的状态变化一定能收到
+                state = state_query.first()
+                if subscription is None:
+                    return self.success(state)
+                _release_db_connection()
+                return self.success(subscription.wait_finished(state, events.LONG_POLL_TIMEOUT))
+
+        stream = events.Stream.open(submission.id)
+        if stream is None:
+            response = self.error("Too many connections, please retry later")
+            response.status_code = 503
+            response["Retry-After"] = events.STREAM_RETRY_AFTER
+            return response
+        try:
+            # 订阅之后再读取状态, 在这之后的状态变化一定能收到
+            state = state_query.first()
+        except Exception:
+            stream.close()
+            raise
+        _release_db_connection()
+        response = StreamingHttpResponse(stream.start(state), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # 关闭 nginx 的缓冲, 每条消息立即发送给客户端
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class SubmissionStatusAPI(APIView):
+    @validate_serializer(SubmissionStatusSerializer)
+    @login_required
+    def post(self, request):
+        """
+        一次查询多个提交的判题状态, 传入上次返回的 version 时只返回在这之后状态变化过的提交
+        """
+        ids = list(dict.fromkeys(request.data["ids"]))
+        version = request.data.get("version")
+        # 在读取状态之前获取版本号, 读取期间的变化在下一次查询时还会返回
+        current = events.current_version()
+        if version is not None:
+            changed = events.changed_since(ids, version, current)
+            if changed is not None:
+                ids = [submission_id for submission_id in ids if submission_id in changed]
+
+        submissions = list(Submission.objects.filter(id__in=ids).select_related("problem")
+                           .only("id", "contest", "user_id", "shared", "result", "statistic_info",
+                                 "problem__created_by", "problem__share_submission"))
+        permission = SubmissionPermission(request.user)
+        permission.prepare(submissions)
+        results = [{"id": item.id, "result": item.result, "statistic_info": item.statistic_info}
+                   for item in submissions if permission.check(item)]
+        return self.success({"results": results, "version": current})
+
+
 class SubmissionListAPI(APIView):
     def get(self, request):
         if not request.GET.get("limit"):
@@ -179,7 +271,7 @@ class SubmissionListAPI(APIView):
         if request.GET.get("contest_id"):
             return self.error("Parameter error")
 
-        submissions = Submission.objects.filter(contest_id__isnull=True).select_related("problem__created_by")
+        submissions = SubmissionListSerializer.setup_query(Submission.objects.filter(contest_id__isnull=True))
         problem_id = request.GET.get("problem_id")
         myself = request.GET.get("myself")
         result = request.GET.get("result")
@@ -196,7 +288,11 @@ class SubmissionListAPI(APIView):
             submissions = submissions.filter(username__icontains=username)
         if result:
             submissions = submissions.filter(result=result)
-        data = self.paginate_data(request, submissions)
+        # 传入 cursor 参数时使用游标分页, 翻页的耗时和页数无关, 不返回总数
+        if "cursor" in request.GET:
+            data = self.paginate_by_cursor(request, submissions)
+        else:
+            data = self.paginate_data(request, submissions, count_strategy=CountStrategy.AUTO)
         data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user).data
         
         # ============================================================================
@@ -224,7 +320,7 @@ class ContestSubmissionListAPI(APIView):
             return self.error("Limit is needed")
 
         contest = self.contest
-        submissions = Submission.objects.filter(contest_id=contest.id).select_related("problem__created_by")
+        submissions = SubmissionListSerializer.setup_query(Submission.objects.filter(contest_id=contest.id))
         problem_id = request.GET.get("problem_id")
         myself = request.GET.get("myself")
         result = request.GET.get("result")
@@ -252,8 +348,11 @@ class ContestSubmissionListAPI(APIView):
             if not contest.real_time_rank and not request.user.is_contest_admin(contest):
                 submissions = submissions.filter(user_id=request.user.id)
 
-        data = self.paginate_data(request, submissions)
-        data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user).data
+        if "cursor" in request.GET:
+            data = self.paginate_by_cursor(request, submissions)
+        else:
+            data = self.paginate_data(request, submissions, count_strategy=CountStrategy.AUTO)
+        data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user, contest=contest).data
         return self.success(data)
 
 
@@ -1,2 +1,3 @@
 from ._serializers import *  # NOQA
 from .api import *  # NOQA
+from .counting import CountStrategy, invalidate_counts  # NOQA
@@ -12,3 +12,28 @@ class UsernameSerializer(serializers.Serializer):
 
     def get_real_name(self, obj):
         return obj.userprofile.real_name if self.need_real_name else None
+
+
+class ValuesSerializer:
+    """
+    列表接口使用的快速序列化, 直接输出 QuerySet.values() 读取的 dict, 不创建 model 实例, 也不经过 DRF 的 field.
+    子类在 fields 中列出需要读取的字段, 在 to_representation 中转换成输出的格式
+    """
+    fields = ()
+
+    def __init__(self, instance, many=False):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def values(cls, query_set):
+        return query_set.values(*cls.fields)
+
+    def to_representation(self, row):
+        return row
+
+    @property
+    def data(self):
+        if self.many:
+            return [self.to_representation(row) for row in self.instance]
+        return self.to_representation(self.instance)
@@ -1,12 +1,18 @@
+import base64
 import functools
 import json
 import logging
+from datetime import datetime
 
+from django.db.models import Q
 from django.http import HttpResponse, QueryDict
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
+from . import counting
+from .counting import CountStrategy
+
 logger = logging.getLogger("")
 
 
@@ -110,19 +116,24 @@ class APIView(View):
     def server_error(self):
         return self.error(err="server-error", msg="server error")
 
-    def paginate_data(self, request, query_set, object_serializer=None):
-        """
-        :param request: django的request
-        :param query_set: django model的query set或者其他list like objects
-        :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
-        :return:
-        """
+    def _get_limit(self, request):
         try:
             limit = int(request.GET.get("limit", "10"))
         except ValueError:
             limit = 10
         if limit < 0 or limit > 250:
             limit = 10
+        return limit
+
+    def paginate_data(self, request, query_set, object_serializer=None, count_strategy=CountStrategy.EXACT):
+        """
+        :param request: django的request, no_total=1 时不计算总数
+        :param query_set: django model的query set或者其他list like objects
+        :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
+        :param count_strategy: 计算总数的方式, 见 CountStrategy
+        :return: total_exact 为 false 说明总数是预估或者缓存的值
+        """
+        limit = self._get_limit(request)
         try:
             offset = int(request.GET.get("offset", "0"))
         except ValueError:
@@ -131,14 +142,54 @@ class APIView(View):
             offset = 0
         results = query_set[offset:offset + limit]
         if object_serializer:
-            count = query_set.count()
             results = object_serializer(results, many=True).data
+        if request.GET.get("no_total") == "1":
+            count, exact = None, False
         else:
-            count = query_set.count()
+            count, exact = counting.count(query_set, count_strategy)
         data = {"results": results,
-                "total": count}
+                "total": count,
+                "total_exact": exact}
         return data
 
+    def paginate_by_cursor(self, request, query_set, object_serializer=None, time_field="create_time"):
+        """
+        基于 (time_field, pk) 的游标分页, 按照时间倒序; 不使用 OFFSET, 也不计算总数.
+        request.GET 中的 cursor 为空时返回第一页, 否则为上一次返回的 next 或者 prev
+        :return: {"results": [], "next": 游标或者None, "prev": 游标或者None}
+        """
+        limit = self._get_limit(request)
+        cursor = request.GET.get("cursor")
+        is_prev = False
+        if cursor:
+            value, pk, is_prev = _decode_cursor(cursor)
+            if is_prev:
+                query_set = query_set.filter(Q(**{f"{time_field}__gt": value}) | Q(**{time_field: value, "pk__gt": pk})) \
+                    .order_by(time_field, "pk")
+            else:
+                query_set = query_set.filter(Q(**{f"{time_field}__lt": value}) | Q(**{time_field: value, "pk__lt": pk})) \
+                    .order_by(f"-{time_field}", "-pk")
+        else:
+            query_set = query_set.order_by(f"-{time_field}", "-pk")
+
+        # 多取一条用来判断是否还有下一页
+        results = list(query_set[:limit + 1])
+        has_more = len(results) > limit
+        results = results[:limit]
+        if is_prev:
+            results.reverse()
+
+        next_cursor = prev_cursor = None
+        if results:
+            # 从后一页向前翻时一定有下一页, 从前一页向后翻时一定有上一页
+            if has_more or is_prev:
+                next_cursor = _encode_cursor(getattr(results[-1], time_field), results[-1].pk, False)
+            if (has_more and is_prev) or (cursor and not is_prev):
+                prev_cursor = _encode_cursor(getattr(results[0], time_field), results[0].pk, True)
+        if object_serializer:
+            results = object_serializer(results, many=True).data
+        return {"results": results, "next": next_cursor, "prev": prev_cursor}
+
     def dispatch(self, request, *args, **kwargs):
         if self.request_parsers:
             try:
@@ -157,6 +208,20 @@ class APIView(View):
             return self.server_error()
 
 
+def _encode_cursor(value, pk, is_prev):
+    data = json.dumps([value.isoformat(), pk, is_prev]).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("utf-8").rstrip("=")
+
+
+def _decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, pk, is_prev = json.loads(data.decode("utf-8"))
+        return datetime.fromisoformat(value), pk, bool(is_prev)
+    except (ValueError, TypeError):
+        raise APIError(msg="Invalid cursor")
+
+
 class CSRFExemptAPIView(APIView):
     @method_decorator(csrf_exempt)
     def dispatch(self, request, *args, **kwargs):
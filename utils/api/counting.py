@@ -0,0 +1,77 @@
+import hashlib
+
+from django.db import connection
+from django.db.models.query import QuerySet
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 缓存精确总数的时间 (秒)
+CACHE_TTL = 10
+# 没有过滤条件且预估行数超过该值时, 使用数据库统计信息中的预估值
+ESTIMATE_THRESHOLD = 100_000
+
+
+class CountStrategy:
+    # 每次执行 count()
+    EXACT = "exact"
+    # 没有过滤条件的大表使用统计信息中的预估值, 否则执行 count()
+    ESTIMATE = "estimate"
+    # 按照查询语句缓存 count() 的结果, 写入时通过 invalidate_counts 失效
+    CACHED = "cached"
+    # 没有过滤条件的大表使用预估值, 否则使用缓存的结果
+    AUTO = "auto"
+
+
+def _version_key(model):
+    return f"{CacheKey.paginate_count_version}:{model._meta.db_table}"
+
+
+def invalidate_counts(*models):
+    """
+    写入数据之后调用, 使这些表上所有缓存的总数失效
+    """
+    for model in models:
+        cache.redis_incr(_version_key(model))
+
+
+def _estimate(query_set):
+    query = query_set.query
+    if query.where or query.distinct or connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [query_set.model._meta.db_table])
+        row = cursor.fetchone()
+    # 从来没有 ANALYZE 过的表 reltuples 为 -1
+    if not row or row[0] < ESTIMATE_THRESHOLD:
+        return None
+    return int(row[0])
+
+
+def _cached_count(query_set):
+    sql, params = query_set.order_by().query.sql_with_params()
+    signature = hashlib.md5(f"{sql}:{params}".encode("utf-8")).hexdigest()
+    version = cache.get(_version_key(query_set.model)) or 0
+    key = f"{CacheKey.paginate_count}:{query_set.model._meta.db_table}:{version}:{signature}"
+    count = cache.get(key)
+    if count is not None:
+        # 缓存期间可能有没有调用 invalidate_counts 的写入, 不保证精确
+        return count, False
+    count = query_set.count()
+    cache.set(key, count, timeout=CACHE_TTL)
+    return count, True
+
+
+def count(query_set, strategy=CountStrategy.EXACT):
+    """
+    :return: (总数, 是否精确)
+    """
+    if not isinstance(query_set, QuerySet) or strategy == CountStrategy.EXACT:
+        return query_set.count(), True
+    if strategy in (CountStrategy.ESTIMATE, CountStrategy.AUTO):
+        estimate = _estimate(query_set)
+        if estimate is not None:
+            return estimate, False
+        if strategy == CountStrategy.ESTIMATE:
+            return query_set.count(), True
+    return _cached_count(query_set)
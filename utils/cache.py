@@ -1,3 +1,5 @@
+import random
+
 from django.core.cache import cache, caches  # noqa
 from django.conf import settings  # noqa
 
@@ -25,3 +27,27 @@ class MyRedisCache(RedisCache):
 
     def __getattr__(self, item):
         return getattr(self.client, item)
+
+
+# 只有持有锁的进程才能释放锁, 防止锁过期之后被其他进程重新获取时被误删
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def acquire_lock(key, timeout):
+    """
+    :return: 获取成功时返回释放锁需要的 token, 否则返回 None
+    """
+    token = random.getrandbits(62) + 1
+    # int 在 django-redis 中不经过 pickle 直接存储, lua 脚本中可以直接比较
+    if cache.set(key, token, timeout=timeout, nx=True):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    cache.register_script(_RELEASE_LOCK_SCRIPT)(keys=[key], args=[token])
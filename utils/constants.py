@@ -21,10 +21,51 @@ class ContestRuleType(Choices):
     OI = "OI"
 
 
+# 判题任务的优先级, 按照从高到低的顺序定义
+class JudgePriority(Choices):
+    CONTEST = "contest"
+    PRACTICE = "practice"
+    REJUDGE = "rejudge"
+    SELF_TEST = "self_test"
+
+
 class CacheKey:
     waiting_queue = "waiting_queue"
-    contest_rank_cache = "contest_rank_cache"
+    waiting_queue_drain_lock = "waiting_queue_drain_lock"
+    contest_scoreboard = "contest_scoreboard"
+    contest_scoreboard_rows = "contest_scoreboard_rows"
+    contest_scoreboard_ready = "contest_scoreboard_ready"
+    contest_scoreboard_frozen = "contest_scoreboard_frozen"
+    contest_scoreboard_final = "contest_scoreboard_final"
+    contest_scoreboard_version = "contest_scoreboard_version"
+    contest_scoreboard_page = "contest_scoreboard_page"
+    contest_rank_export = "contest_rank_export"
+    contest_scoreboard_rebuild_lock = "contest_scoreboard_rebuild_lock"
     website_config = "website_config"
+    paginate_count = "paginate_count"
+    paginate_count_version = "paginate_count_version"
+    submission_event = "submission_event"
+    submission_status_version = "submission_status_version"
+    submission_status_changes = "submission_status_changes"
+    judge_server_capacity = "judge_server_capacity"
+    judge_server_alive = "judge_server_alive"
+    judge_server_stats = "judge_server_stats"
+    judge_server_hosts = "judge_server_hosts"
+    judge_server_disabled = "judge_server_disabled"
+    judge_server_flush_lock = "judge_server_flush_lock"
+    judge_server_tasks = "judge_server_tasks"
+    judge_server_url = "judge_server_url"
+    judge_server_connection_stats = "judge_server_connection_stats"
+    judge_server_load = "judge_server_load"
+    judge_server_affinity_stats = "judge_server_affinity_stats"
+    judge_problem_cost = "judge_problem_cost"
+    problem_counter = "problem_counter"
+    problem_counter_dirty = "problem_counter_dirty"
+    problem_counter_flush_lock = "problem_counter_flush_lock"
+    problem_first_accepted = "problem_first_accepted"
+    judge_verdict_cache = "judge_verdict_cache"
+    judge_verdict_cache_version = "judge_verdict_cache_version"
+    judge_verdict_cache_stats = "judge_verdict_cache_stats"
 
 
 class Difficulty(Choices):
@@ -0,0 +1,83 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from account.models import AdminType, UserProfile
+from account.serializers import RankInfoSerializer
+from problem.models import Problem
+from problem.serializers import ProblemSerializer
+from submission.models import Submission
+from submission.serializers import SubmissionListSerializer
+from utils.api import UsernameSerializer, serializers
+
+
+class FullRankInfoSerializer(serializers.ModelSerializer):
+    """
+    改为 values() 之前的 RankInfoSerializer
+    """
+    user = UsernameSerializer()
+
+    class Meta:
+        model = UserProfile
+        fields = "__all__"
+
+
+class Command(BaseCommand):
+    help = "Compare bytes read and time spent by the list endpoints with full rows and with projected fields"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=250)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        limit = options["limit"]
+        submissions = Submission.objects.filter(contest_id__isnull=True)
+        problems = Problem.objects.filter(contest_id__isnull=True, visible=True)
+        profiles = UserProfile.objects.filter(user__admin_type=AdminType.REGULAR_USER, user__is_disabled=False) \
+            .order_by("-accepted_number", "submission_number")
+        cases = {
+            "submission": (
+                lambda: SubmissionListSerializer(submissions.select_related("problem__created_by")[:limit], many=True).data,
+                submissions.select_related("problem__created_by")[:limit],
+                lambda: SubmissionListSerializer(SubmissionListSerializer.setup_query(submissions)[:limit], many=True).data,
+                SubmissionListSerializer.setup_query(submissions)[:limit],
+            ),
+            "problem": (
+                lambda: ProblemSerializer(problems.select_related("created_by")[:limit], many=True).data,
+                problems.select_related("created_by")[:limit],
+                lambda: ProblemSerializer(ProblemSerializer.setup_query(problems)[:limit], many=True).data,
+                ProblemSerializer.setup_query(problems)[:limit],
+            ),
+            "rank": (
+                lambda: FullRankInfoSerializer(profiles.select_related("user")[:limit], many=True).data,
+                profiles.select_related("user")[:limit],
+                lambda: RankInfoSerializer(RankInfoSerializer.values(profiles)[:limit], many=True).data,
+                RankInfoSerializer.values(profiles)[:limit],
+            ),
+        }
+        self.stdout.write(f"{'list':<12}{'bytes before':>14}{'bytes after':>14}{'time before':>14}{'time after':>14}")
+        for name, (before, before_query, after, after_query) in cases.items():
+            self.stdout.write(f"{name:<12}{self.get_bytes(before_query):>14}{self.get_bytes(after_query):>14}"
+                              f"{self.get_time(before, options['repeat']):>12.2f}ms"
+                              f"{self.get_time(after, options['repeat']):>12.2f}ms")
+
+    @staticmethod
+    def get_bytes(query):
+        """
+        查询返回的所有行在数据库中的大小, 不包括 prefetch_related 的查询
+        """
+        sql, params = query.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(SUM(pg_column_size(t.*)), 0) FROM ({sql}) t", params)
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def get_time(func, repeat):
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed.append((time.perf_counter() - start) * 1000)
+        return statistics.median(elapsed)
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
+
+from utils.shortcuts import rand_str, ulid
+
+SCHEMES = {"rand_str": rand_str, "ulid": ulid}
+# 每条 INSERT 语句写入的行数
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Compare insert throughput and primary key index size of random and time ordered submission ids"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="Rows in the table before measuring")
+        parser.add_argument("--inserts", type=int, default=100_000, help="Rows inserted while measuring")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'scheme':<12}{'rows/s':>12}{'pk index':>14}")
+        for name, func in SCHEMES.items():
+            table = f"benchmark_id_{name}"
+            with connection.cursor() as cursor:
+                # 和 submission 表一样, 主键是 text, 每行带一些数据
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+                cursor.execute(f"CREATE TABLE {table} (id text PRIMARY KEY, create_time timestamptz, user_id integer)")
+                try:
+                    self.insert(cursor, table, func, options["rows"])
+                    start = time.perf_counter()
+                    self.insert(cursor, table, func, options["inserts"])
+                    elapsed = time.perf_counter() - start
+                    cursor.execute("SELECT pg_relation_size(%s)", [f"{table}_pkey"])
+                    index_size = cursor.fetchone()[0]
+                finally:
+                    cursor.execute(f"DROP TABLE {table}")
+            self.stdout.write(f"{name:<12}{options['inserts'] / elapsed:>12.0f}{index_size / 1024 / 1024:>12.1f}MB")
+
+    @staticmethod
+    def insert(cursor, table, func, number):
+        for start in range(0, number, BATCH_SIZE):
+            rows = [(func(), i) for i in range(start, min(start + BATCH_SIZE, number))]
+            # 每批一个事务, 和提交逐条写入时一样需要更新主键索引
+            with transaction.atomic():
+                execute_values(cursor, f"INSERT INTO {table} (id, create_time, user_id) VALUES %s",
+                               rows, template="(%s, now(), %s)")
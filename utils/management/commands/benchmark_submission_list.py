@@ -0,0 +1,120 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from problem.models import Problem
+from submission.models import Submission, SubmissionCode
+
+# 造数据时使用的用户名前缀, --clean 时按照前缀删除
+USERNAME_PREFIX = "benchmark_"
+# 每条 INSERT 语句写入的提交数量
+CHUNK_SIZE = 100_000
+# 0013_submission_list_indexes 中用 RunSQL 创建的索引
+EXTRA_INDEXES = ["sub_username_trgm_idx"]
+# 0013_submission_list_indexes 之前 user_id 上的单列索引, 对比时临时建回来
+BASELINE_INDEXES = ["CREATE INDEX benchmark_user_id_idx ON submission (user_id)"]
+
+SEED_SQL = f"""
+INSERT INTO submission (id, contest_id, problem_id, create_time, user_id, username, code_hash, result,
+                        info, language, shared, statistic_info, ip)
+SELECT md5(random()::text || i::text), (%(contests)s::int[])[1 + i %% %(problem_count)s],
+       (%(problems)s::int[])[1 + i %% %(problem_count)s], now() - i * interval '1 second',
+       1 + i %% %(user_count)s, '{USERNAME_PREFIX}' || (i %% %(user_count)s)::text, %(code_hash)s,
+       (ARRAY[-2, -1, 0, 1, 2, 3, 4, 8])[1 + i %% 8], '{{}}', 'C++', false, '{{}}', NULL
+FROM generate_series(%(start)s, %(end)s) AS i
+"""
+
+
+class Command(BaseCommand):
+    help = "Seed submissions and report query plans and latencies of the submission list queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="Number of submissions to insert, e.g. 1000000")
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--compare", action="store_true",
+                            help="Also run the queries with the indexes from before 0013_submission_list_indexes")
+        parser.add_argument("--clean", action="store_true", help="Delete the seeded submissions")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            self.stdout.write(self.style.ERROR("Only postgresql is supported"))
+            exit(1)
+        if options["clean"]:
+            deleted, _ = Submission.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f"{deleted} submissions deleted"))
+            return
+
+        problems = list(Problem.objects.order_by("id").values_list("id", "contest_id"))
+        if not problems:
+            self.stdout.write(self.style.ERROR("At least one problem is required"))
+            exit(1)
+        if options["seed"]:
+            self.seed(problems, options["seed"], options["users"])
+
+        queries = self.get_queries(problems)
+        results = self.run_queries(queries, options["repeat"])
+        if options["compare"]:
+            with transaction.atomic():
+                # DROP INDEX 在事务中执行, 测试结束之后回滚, 索引不会真的被删除
+                with connection.cursor() as cursor:
+                    for name in [index.name for index in Submission._meta.indexes] + EXTRA_INDEXES:
+                        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+                    for sql in BASELINE_INDEXES:
+                        cursor.execute(sql)
+                before = self.run_queries(queries, options["repeat"])
+                transaction.set_rollback(True)
+            self.stdout.write("\nquery                             before           after")
+            for name in queries:
+                self.stdout.write(f"{name:<26}{before[name]:>12.2f}ms{results[name]:>14.2f}ms")
+
+    def seed(self, problems, number, user_count):
+        code_hash = SubmissionCode.get_hash("")
+        SubmissionCode.store({code_hash: ""})
+        params = {"problems": [item[0] for item in problems], "contests": [item[1] for item in problems],
+                  "problem_count": len(problems), "user_count": user_count, "code_hash": code_hash}
+        with connection.cursor() as cursor:
+            for start in range(1, number + 1, CHUNK_SIZE):
+                cursor.execute(SEED_SQL, dict(params, start=start, end=min(start + CHUNK_SIZE - 1, number)))
+                self.stdout.write(f"{min(start + CHUNK_SIZE - 1, number)}/{number} submissions inserted")
+            cursor.execute("ANALYZE submission")
+
+    def get_queries(self, problems):
+        """
+        和 SubmissionListAPI / ContestSubmissionListAPI 的过滤条件一致, 每个查询取第一页
+        """
+        public = Submission.objects.filter(contest_id__isnull=True)
+        queries = {"public": public,
+                   "public_user": public.filter(user_id=1),
+                   "public_result": public.filter(result=0),
+                   "public_username": public.filter(username__icontains=f"{USERNAME_PREFIX}12")}
+        public_problem = next((problem_id for problem_id, contest_id in problems if contest_id is None), None)
+        if public_problem:
+            queries["public_problem"] = public.filter(problem_id=public_problem)
+        contest_id = next((contest_id for _, contest_id in problems if contest_id), None)
+        if contest_id:
+            contest = Submission.objects.filter(contest_id=contest_id)
+            queries["contest"] = contest
+            queries["contest_user"] = contest.filter(user_id=1)
+            queries["contest_result"] = contest.filter(result=0)
+        return {name: query.order_by("-create_time")[:20] for name, query in queries.items()}
+
+    def run_queries(self, queries, repeat):
+        latencies = {}
+        with connection.cursor() as cursor:
+            for name, query in queries.items():
+                sql, params = query.query.sql_with_params()
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+                self.stdout.write(self.style.SUCCESS(f"\n{name}"))
+                self.stdout.write("\n".join(row[0] for row in cursor.fetchall()))
+                elapsed = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                    elapsed.append((time.perf_counter() - start) * 1000)
+                latencies[name] = statistics.median(elapsed)
+                self.stdout.write(f"median {latencies[name]:.2f}ms of {repeat} runs")
+        return latencies
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from contest import scoreboard
+from contest.models import Contest
+
+
+class Command(BaseCommand):
+    help = "Rebuild contest scoreboards in redis from the rank tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--contest_id", type=int)
+        parser.add_argument("--all", action="store_true")
+
+    def handle(self, *args, **options):
+        contest_id = options["contest_id"]
+        if contest_id:
+            contests = Contest.objects.filter(id=contest_id)
+        elif options["all"]:
+            contests = Contest.objects.all()
+        else:
+            self.stdout.write(self.style.ERROR("Invalid args, --contest_id or --all is required"))
+            exit(1)
+
+        if not contests.exists():
+            self.stdout.write(self.style.ERROR(f"Contest {contest_id} does not exist"))
+            exit(1)
+
+        for contest in contests:
+            scoreboard.rebuild(contest)
+            self.stdout.write(self.style.SUCCESS(f"Scoreboard of contest {contest.id} rebuilt"))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from contest import recompute
+from contest.models import Contest
+
+
+class Command(BaseCommand):
+    help = "Recompute all rank rows of a contest from its submissions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--contest_id", type=int)
+
+    def handle(self, *args, **options):
+        contest_id = options["contest_id"]
+        if not contest_id:
+            self.stdout.write(self.style.ERROR("Invalid args, --contest_id is required"))
+            exit(1)
+        try:
+            contest = Contest.objects.get(id=contest_id)
+        except Contest.DoesNotExist:
+            self.stdout.write(self.style.ERROR(f"Contest {contest_id} does not exist"))
+            exit(1)
+
+        result = recompute.recompute(contest)
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['ranks']} ranks recomputed from {result['submissions']} submissions in {result['time']}s, "
+            f"{result['time_per_100k_submissions']}s per 100k submissions"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+
+from submission.models import Submission, SubmissionCode
+
+
+def _size(number):
+    for unit in ("B", "KB", "MB", "GB"):
+        if number < 1024:
+            return f"{number:.1f}{unit}"
+        number /= 1024
+    return f"{number:.1f}TB"
+
+
+class Command(BaseCommand):
+    help = "Report storage used by deduplicated and compressed submission code"
+
+    def handle(self, *args, **options):
+        submission_number = Submission.objects.count()
+        code_number = SubmissionCode.objects.count()
+        unique = SubmissionCode.objects.aggregate(size=Sum("size"))["size"] or 0
+        with connection.cursor() as cursor:
+            # 去重之前所有提交的代码的总字节数
+            cursor.execute("SELECT SUM(c.size) FROM submission s JOIN submission_code c ON c.hash = s.code_hash")
+            raw = cursor.fetchone()[0] or 0
+            cursor.execute("SELECT SUM(octet_length(data)) FROM submission_code")
+            stored = cursor.fetchone()[0] or 0
+            cursor.execute("SELECT pg_total_relation_size('submission'), pg_total_relation_size('submission_code')")
+            submission_table, code_table = cursor.fetchone()
+
+        self.stdout.write(f"submissions: {submission_number}, distinct code: {code_number}")
+        self.stdout.write(f"code before dedup: {_size(raw)}, after dedup: {_size(unique)}, "
+                          f"after compression: {_size(stored)}")
+        if stored:
+            self.stdout.write(f"saved {_size(raw - stored)}, {raw / stored:.1f}x smaller")
+        self.stdout.write(f"table size: submission {_size(submission_table)}, submission_code {_size(code_table)}")
@@ -2,6 +2,7 @@ import os
 import re
 import datetime
 import random
+import time
 from base64 import b64encode
 from io import BytesIO
 
@@ -26,6 +27,22 @@ def rand_str(length=32, type="lower_hex"):
         return random.choice("123456789") + get_random_string(length - 1, allowed_chars="0123456789")
 
 
+# Crockford base32, 字符按照 ASCII 顺序排列, 编码之后的字符串按照字典序比较和按照数值比较的结果一致
+CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+def ulid():
+    """
+    生成按照时间递增的 26 位 id (ULID), 前 10 位是毫秒时间戳, 后 16 位是 80 bit 的随机数, 可以直接用在 url 中
+    """
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), "big")
+    chars = []
+    for _ in range(26):
+        chars.append(CROCKFORD_BASE32[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
 def build_query_string(kv_data, ignore_none=True):
     # {"a": 1, "b": "test"} -> "?a=1&b=test"
     query_string = ""